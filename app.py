@@ -1,14 +1,140 @@
 # debug_app.py - DEBUG VERSION to see exactly what's happening
 import os
 import json
+import re
+import io
+import csv
+import gzip
+import hashlib
+import mimetypes
+import sys
+import queue
+import random
+import logging
+import logging.handlers
+import atexit
+import hmac
+import heapq
+import itertools
+import pstats
+import cProfile
 import time
+import bisect
+import socket
+import uuid
+import threading
 import requests
 import sqlite3
-from datetime import datetime, timedelta
-from flask import Flask, request, jsonify
+from array import array
+from collections import defaultdict, OrderedDict, deque
+from contextlib import contextmanager
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from flask import Flask, request, jsonify, Response, g, has_request_context, send_from_directory, abort
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import brotli  # optional: adds br bodies for the static assets
+except ImportError:
+    brotli = None
 
 app = Flask(__name__)
 
+# Logging
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, event and the event's fields"""
+    def format(self, record):
+        entry = {
+            'ts': datetime.utcfromtimestamp(record.created).isoformat(timespec='milliseconds') + 'Z',
+            'level': record.levelname.lower(),
+            'event': record.getMessage(),
+            **getattr(record, 'fields', {})
+        }
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class EventLogger:
+    """Structured event logging with per-call-site sampling and rate limiting
+    
+    log.info('contacts_upserted', rows=100) emits one JSON line. Each event name is
+    its own call site: sample=0.01 keeps ~1% of its events, and per_second=N caps
+    it, reporting how many were dropped on the next event that gets through.
+    """
+    def __init__(self, name):
+        self.logger = logging.getLogger(name)
+        self.sites = {}
+        self.lock = threading.Lock()
+    
+    def _admit(self, event, per_second):
+        """Returns (allowed, events suppressed since the last allowed one)"""
+        now = time.monotonic()
+        with self.lock:
+            burst = max(per_second, 1)
+            site = self.sites.setdefault(event, {'tokens': burst, 'updated': now, 'suppressed': 0})
+            site['tokens'] = min(burst, site['tokens'] + (now - site['updated']) * per_second)
+            site['updated'] = now
+            if site['tokens'] < 1:
+                site['suppressed'] += 1
+                return False, 0
+            site['tokens'] -= 1
+            suppressed, site['suppressed'] = site['suppressed'], 0
+            return True, suppressed
+    
+    def log(self, level, event, sample=1.0, per_second=None, exc_info=False, **fields):
+        if not self.logger.isEnabledFor(level):
+            return
+        if sample < 1:
+            if random.random() >= sample:
+                return
+            fields['sample_rate'] = sample
+        if per_second:
+            allowed, suppressed = self._admit(event, per_second)
+            if not allowed:
+                return
+            if suppressed:
+                fields['suppressed'] = suppressed
+        self.logger.log(level, event, extra={'fields': fields}, exc_info=exc_info)
+    
+    def debug(self, event, **fields):
+        self.log(logging.DEBUG, event, **fields)
+    
+    def info(self, event, **fields):
+        self.log(logging.INFO, event, **fields)
+    
+    def warning(self, event, **fields):
+        self.log(logging.WARNING, event, **fields)
+    
+    def error(self, event, **fields):
+        self.log(logging.ERROR, event, **fields)
+
+def configure_logging():
+    """Route app logs through a queue so request and sync threads never block on stdout"""
+    logger = logging.getLogger('ghl_lead_tracker')
+    if logger.handlers:
+        return
+    
+    log_queue = queue.Queue(-1)
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.setFormatter(JSONFormatter())
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(logging.Formatter('%(message)s'))
+    
+    listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    listener.start()
+    atexit.register(listener.stop)
+    
+    logger.addHandler(queue_handler)
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+
+configure_logging()
+log = EventLogger('ghl_lead_tracker')
+
 # Configuration
 CLIENT_ID = os.getenv('GHL_CLIENT_ID', '6886150802562ad87b4e2dc0-mdlog30p')
 CLIENT_SECRET = os.getenv('GHL_CLIENT_SECRET', '3162ed43-8498-48a3-a8b4-8a60e980f318')
@@ -31,15 +157,1117 @@ SCOPES = [
     "locations/tags.readonly"
 ]
 
-class DebugLeadAnalytics:
-    def __init__(self, db_path="debug_analytics.db"):
+# GHL API
+GHL_API_BASE = os.getenv('GHL_API_BASE', 'https://services.leadconnectorhq.com')
+GHL_API_VERSION = "2021-07-28"
+GHL_TIMEOUT = float(os.getenv('GHL_TIMEOUT', '30'))
+GHL_RATE_LIMIT = float(os.getenv('GHL_RATE_LIMIT', '10'))  # requests per second, per process
+
+# Circuit breakers, one per GHL endpoint and tenant, per process
+BREAKER_FAILURES = int(os.getenv('BREAKER_FAILURES', '5'))  # consecutive failures that open a breaker
+BREAKER_WINDOW = 20
+BREAKER_MIN_CALLS = 10
+BREAKER_ERROR_RATE = 0.5
+BREAKER_SLOW_SECONDS = float(os.getenv('BREAKER_SLOW_SECONDS', '10'))
+BREAKER_OPEN_SECONDS = float(os.getenv('BREAKER_OPEN_SECONDS', '30'))
+BREAKER_MAX_OPEN_SECONDS = 600
+BREAKER_PROBES = 2
+
+# Background sync
+SYNC_CONCURRENCY = int(os.getenv('SYNC_CONCURRENCY', '4'))
+SYNC_PAGE_SIZE = 100
+SYNC_HOT_INTERVAL = int(os.getenv('SYNC_HOT_INTERVAL', '60'))
+SYNC_DORMANT_INTERVAL = int(os.getenv('SYNC_DORMANT_INTERVAL', '3600'))
+SYNC_LEASE_SECONDS = 120
+
+# Job queue for slow GHL work kicked off from the web app
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '2'))
+JOB_LEASE_SECONDS = 300
+JOB_MAX_ATTEMPTS = 3
+JOB_RETENTION_DAYS = 7
+
+# Metrics
+# Defaults next to DATABASE_PATH, so it doesn't depend on the working directory
+METRICS_DB_PATH = os.getenv('METRICS_DB_PATH') or os.path.join(
+    os.path.dirname(os.path.abspath(os.getenv('DATABASE_PATH', 'debug_analytics.db'))), 'metrics.db')
+METRICS_FLUSH_INTERVAL = 5
+# Label values escape backslash, double quote and newline in the text format
+LABEL_VALUE_ESCAPES = str.maketrans({'\\': '\\\\', '"': '\\"', '\n': '\\n'})
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+class Metrics:
+    """Prometheus-style metrics shared by every process through one SQLite file
+    
+    Each process accumulates deltas in memory and a background thread adds them
+    to metric_values every few seconds, so /metrics on any gunicorn worker reports
+    the sum over all web workers and the sync worker. Gauges that describe shared
+    state (queue depths, cache ratios) are computed at scrape time instead.
+    """
+    def __init__(self, db_path):
         self.db_path = db_path
-        self.init_database()
+        self.registry = {}
+        self.gauge_callbacks = []
+        self.pending = defaultdict(float)
+        self.lock = threading.Lock()
+        self.flusher_pid = None
+        
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS metric_values (
+                name TEXT NOT NULL,
+                labels TEXT NOT NULL,
+                le TEXT NOT NULL DEFAULT '',
+                value REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (name, labels, le)
+            )
+        ''')
+        conn.commit()
+        conn.close()
     
-    def init_database(self):
-        conn = sqlite3.connect(self.db_path)
+    def declare(self, name, kind, help_text, buckets=LATENCY_BUCKETS):
+        self.registry[name] = {'kind': kind, 'help': help_text, 'buckets': buckets}
+    
+    def gauge(self, fn):
+        """Register fn() -> [(name, labels, value)], evaluated on every scrape"""
+        self.gauge_callbacks.append(fn)
+        return fn
+    
+    def _add(self, name, labels, le, value):
+        key = (name, json.dumps(labels, sort_keys=True), le)
+        with self.lock:
+            self.pending[key] += value
+        if self.flusher_pid != os.getpid():
+            self._start_flusher()
+    
+    def inc(self, name, value=1, **labels):
+        self._add(name, labels, '', value)
+    
+    def observe(self, name, value, **labels):
+        buckets = self.registry[name]['buckets']
+        le = next((str(b) for b in buckets if value <= b), '+Inf')
+        self._add(name, labels, le, 1)
+        self._add(name, labels, 'sum', value)
+    
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+    
+    def _start_flusher(self):
+        with self.lock:
+            if self.flusher_pid == os.getpid():
+                return
+            self.flusher_pid = os.getpid()
+        
+        def loop():
+            while True:
+                time.sleep(METRICS_FLUSH_INTERVAL)
+                try:
+                    self.flush()
+                except sqlite3.Error as e:
+                    log.warning('metrics_flush_failed', error=str(e), per_second=0.1)
+        
+        threading.Thread(target=loop, name='metrics-flush', daemon=True).start()
+        atexit.register(self.flush)
+    
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, defaultdict(float)
+        if not pending:
+            return
+        
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.executemany('''
+            INSERT INTO metric_values (name, labels, le, value) VALUES (?, ?, ?, ?)
+            ON CONFLICT (name, labels, le) DO UPDATE SET value = value + excluded.value
+        ''', [(name, labels, le, value) for (name, labels, le), value in pending.items()])
+        conn.commit()
+        conn.close()
+    
+    @staticmethod
+    def _format_labels(labels, **extra):
+        labels = {**labels, **extra}
+        if not labels:
+            return ''
+        return '{' + ','.join(f'{k}="{str(v).translate(LABEL_VALUE_ESCAPES)}"' for k, v in sorted(labels.items())) + '}'
+    
+    def render(self):
+        """Prometheus text exposition of every process's metrics"""
+        self.flush()
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        cursor = conn.cursor()
+        cursor.execute('SELECT name, labels, le, value FROM metric_values ORDER BY name, labels')
+        rows = cursor.fetchall()
+        conn.close()
+        
+        series = defaultdict(lambda: defaultdict(dict))
+        for name, labels, le, value in rows:
+            series[name][labels][le] = value
+        
+        lines = []
+        for name, spec in sorted(self.registry.items()):
+            if spec['kind'] == 'gauge':
+                continue
+            lines.append(f"# HELP {name} {spec['help']}")
+            lines.append(f"# TYPE {name} {spec['kind']}")
+            for labels_json, values in series.get(name, {}).items():
+                labels = json.loads(labels_json)
+                if spec['kind'] == 'counter':
+                    lines.append(f"{name}{self._format_labels(labels)} {values.get('', 0)}")
+                    continue
+                cumulative = 0
+                for bucket in [str(b) for b in spec['buckets']] + ['+Inf']:
+                    cumulative += values.get(bucket, 0)
+                    lines.append(f"{name}_bucket{self._format_labels(labels, le=bucket)} {cumulative}")
+                lines.append(f"{name}_sum{self._format_labels(labels)} {values.get('sum', 0)}")
+                lines.append(f"{name}_count{self._format_labels(labels)} {cumulative}")
+        
+        gauges = defaultdict(list)
+        for callback in self.gauge_callbacks:
+            try:
+                for name, labels, value in callback():
+                    gauges[name].append((labels, value))
+            except Exception as e:
+                log.warning('metrics_gauge_failed', gauge=callback.__name__, error=str(e), per_second=0.1)
+        for name, samples in sorted(gauges.items()):
+            lines.append(f"# HELP {name} {self.registry[name]['help']}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in samples:
+                lines.append(f"{name}{self._format_labels(labels)} {value}")
+        
+        return '\n'.join(lines) + '\n'
+    
+    def counter_totals(self, name):
+        """Current aggregated counter values by label set, for scrape-time gauges"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
         cursor = conn.cursor()
+        cursor.execute("SELECT labels, value FROM metric_values WHERE name = ? AND le = ''", (name,))
+        totals = [(json.loads(labels), value) for labels, value in cursor.fetchall()]
+        conn.close()
+        return totals
+
+metrics = Metrics(METRICS_DB_PATH)
+metrics.declare('ghl_request_duration_seconds', 'histogram', 'GHL API call latency by endpoint and status code')
+metrics.declare('ghl_rate_limit_wait_seconds', 'histogram', 'Time spent waiting on the GHL rate limiter')
+metrics.declare('ghl_token_refresh_total', 'counter', 'OAuth token refreshes by result')
+metrics.declare('ghl_circuit_transitions_total', 'counter', 'GHL circuit breaker state changes by endpoint and new state')
+metrics.declare('ghl_circuit_rejected_total', 'counter', 'GHL calls failed fast by an open circuit breaker')
+metrics.declare('sqlite_query_duration_seconds', 'histogram', 'SQLite latency by named query')
+metrics.declare('ingest_rows_total', 'counter', 'Contact rows written; rows per second is rate() of this')
+metrics.declare('ingest_rows_skipped_total', 'counter', 'Fetched contacts not written because their fingerprint was unchanged')
+metrics.declare('cache_requests_total', 'counter', 'Cache lookups by cache and result')
+metrics.declare('cache_hit_ratio', 'gauge', 'Share of cache lookups served from cache')
+metrics.declare('singleflight_calls_total', 'counter', 'Coalesced calls by flight; result="shared" is a computation saved')
+metrics.declare('job_queue_depth', 'gauge', 'Background jobs by status')
+metrics.declare('sync_queue_depth', 'gauge', 'Locations due for sync (waiting) and leased (running)')
+
+# Request timing
+SLOW_REQUEST_MS = float(os.getenv('SLOW_REQUEST_MS', '1000'))
+SLOW_SPAN_MS = float(os.getenv('SLOW_SPAN_MS', '10'))
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+PROFILE_DIR = os.path.abspath(os.getenv('PROFILE_DIR', 'profiles'))
+
+def record_span(category, name, seconds):
+    """Attach a timed span (db, ghl, token, json) to the current request, if any"""
+    if has_request_context() and 'spans' in g:
+        g.spans.append((category, name, seconds))
+
+def normalize_endpoint(url):
+    """Metric label for a GHL URL: the path with ID-like segments replaced by :id"""
+    parsed = urlparse(url)
+    segments = [':id' if len(s) >= 16 and s.isalnum() else s for s in parsed.path.split('/')]
+    return parsed.netloc + '/'.join(segments)
+
+class RateLimiter:
+    """Token bucket shared by every outbound GHL request in this process"""
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+    
+    def try_acquire(self):
+        """Take a slot if one is free; otherwise return the seconds until one will be"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+    
+    def acquire(self):
+        """Block until a request slot is free, returning the seconds spent waiting"""
+        waited = 0.0
+        while (delay := self.try_acquire()) > 0:
+            time.sleep(delay)
+            waited += delay
+        return waited
+
+rate_limiter = RateLimiter(GHL_RATE_LIMIT)
+
+ghl_session = requests.Session()
+ghl_session.mount('https://', requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=SYNC_CONCURRENCY * 2))
+ghl_session.mount('http://', requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=SYNC_CONCURRENCY * 2))
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised instead of calling GHL while the endpoint's breaker is open"""
+    def __init__(self, breaker, retry_in):
+        super().__init__(f"Circuit open for {breaker.endpoint} ({breaker.tenant}); retry in {retry_in:.0f}s")
+        self.endpoint = breaker.endpoint
+        self.tenant = breaker.tenant
+        self.retry_in = retry_in
+
+class CircuitBreaker:
+    """Error and latency tracking for one GHL endpoint and tenant
+    
+    Closed, outcomes go into a rolling window; a failure is an exception, a 5xx
+    or a call slower than BREAKER_SLOW_SECONDS. BREAKER_FAILURES failures in a
+    row, or BREAKER_ERROR_RATE of the window, open the breaker and calls fail
+    fast with CircuitOpenError. Once the cool-down passes it half-opens and lets
+    BREAKER_PROBES calls through: if they all succeed it closes, otherwise it
+    re-opens with the cool-down doubled.
+    """
+    def __init__(self, endpoint, tenant):
+        self.endpoint = endpoint
+        self.tenant = tenant
+        self.state = 'closed'
+        self.outcomes = deque(maxlen=BREAKER_WINDOW)
+        self.consecutive_failures = 0
+        self.latency = None
+        self.open_seconds = BREAKER_OPEN_SECONDS
+        self.retry_at = 0.0
+        self.probes = 0
+        self.probe_successes = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+    
+    def _transition(self, state):
+        self.state = state
+        metrics.inc('ghl_circuit_transitions_total', endpoint=self.endpoint, state=state)
+        log.warning('ghl_circuit_' + state, endpoint=self.endpoint, tenant=self.tenant,
+                    failures=self.consecutive_failures, open_seconds=self.open_seconds)
+    
+    def _open(self):
+        self.retry_at = time.monotonic() + self.open_seconds
+        self._transition('open')
+    
+    def before_call(self):
+        """Admit a call, returning whether it is a half-open probe; raises CircuitOpenError"""
+        with self.lock:
+            if self.state == 'open':
+                retry_in = self.retry_at - time.monotonic()
+                if retry_in > 0:
+                    self.rejected += 1
+                    metrics.inc('ghl_circuit_rejected_total', endpoint=self.endpoint)
+                    raise CircuitOpenError(self, retry_in)
+                self.probes = self.probe_successes = 0
+                self._transition('half_open')
+            if self.state == 'half_open':
+                if self.probes >= BREAKER_PROBES:
+                    self.rejected += 1
+                    metrics.inc('ghl_circuit_rejected_total', endpoint=self.endpoint)
+                    raise CircuitOpenError(self, 0)
+                self.probes += 1
+                return True
+            return False
+    
+    def release(self, probe):
+        """Give back a half-open probe slot whose call ended with no outcome to record"""
+        if not probe:
+            return
+        with self.lock:
+            if self.state == 'half_open' and self.probes > 0:
+                self.probes -= 1
+    
+    def record(self, ok, seconds, probe=False):
+        failed = not ok or seconds > BREAKER_SLOW_SECONDS
+        with self.lock:
+            self.latency = seconds if self.latency is None else 0.8 * self.latency + 0.2 * seconds
+            self.outcomes.append(failed)
+            self.consecutive_failures = self.consecutive_failures + 1 if failed else 0
+            
+            if probe and self.state == 'half_open':
+                if failed:
+                    self.open_seconds = min(self.open_seconds * 2, BREAKER_MAX_OPEN_SECONDS)
+                    self._open()
+                else:
+                    self.probe_successes += 1
+                    if self.probe_successes >= BREAKER_PROBES:
+                        self.outcomes.clear()
+                        self.open_seconds = BREAKER_OPEN_SECONDS
+                        self._transition('closed')
+            elif self.state == 'closed' and failed:
+                error_rate = sum(self.outcomes) / len(self.outcomes)
+                if self.consecutive_failures >= BREAKER_FAILURES or \
+                        (len(self.outcomes) >= BREAKER_MIN_CALLS and error_rate >= BREAKER_ERROR_RATE):
+                    self._open()
+    
+    def snapshot(self):
+        with self.lock:
+            calls = len(self.outcomes)
+            return {
+                'endpoint': self.endpoint,
+                'tenant': self.tenant,
+                'state': self.state,
+                'error_rate': round(sum(self.outcomes) / calls, 3) if calls else 0.0,
+                'recent_calls': calls,
+                'consecutive_failures': self.consecutive_failures,
+                'latency_ms': round(self.latency * 1000, 1) if self.latency is not None else None,
+                'retry_in': round(max(self.retry_at - time.monotonic(), 0), 1) if self.state == 'open' else None,
+                'rejected': self.rejected
+            }
+
+class CircuitBreakers:
+    """Per-process registry of breakers keyed by (endpoint, tenant)"""
+    def __init__(self):
+        self.breakers = {}
+        self.lock = threading.Lock()
+    
+    def get(self, endpoint, tenant):
+        key = (endpoint, tenant)
+        breaker = self.breakers.get(key)
+        if breaker is None:
+            with self.lock:
+                breaker = self.breakers.setdefault(key, CircuitBreaker(endpoint, tenant))
+        return breaker
+    
+    def snapshot(self):
+        """Breaker states for /health, open and half-open first"""
+        order = {'open': 0, 'half_open': 1, 'closed': 2}
+        snapshots = [b.snapshot() for b in list(self.breakers.values())]
+        snapshots.sort(key=lambda b: (order[b['state']], b['endpoint'], b['tenant']))
+        counts = defaultdict(int)
+        for b in snapshots:
+            counts[b['state']] += 1
+        return {'open': counts['open'], 'half_open': counts['half_open'], 'closed': counts['closed'],
+                'breakers': snapshots}
+
+breakers = CircuitBreakers()
+
+def request_tenant(kwargs):
+    """Tenant a GHL call acts for: the locationId or companyId it sends, if any"""
+    for payload in (kwargs.get('params'), kwargs.get('data'), kwargs.get('json')):
+        if isinstance(payload, dict):
+            tenant = payload.get('locationId') or payload.get('companyId')
+            if tenant:
+                return tenant
+    return '*'
+
+def ghl_request(method, path, retries=3, tenant=None, **kwargs):
+    """Rate-limited GHL request over the pooled session, honouring 429 Retry-After
+    
+    Each call goes through the circuit breaker for its endpoint and tenant (the
+    locationId/companyId it sends unless `tenant` is given), so a degraded GHL
+    fails fast with CircuitOpenError instead of holding a worker for the timeout.
+    """
+    url = path if path.startswith('http') else f"{GHL_API_BASE}{path}"
+    kwargs.setdefault('timeout', GHL_TIMEOUT)
+    
+    endpoint = f"{method} {normalize_endpoint(url)}"
+    breaker = breakers.get(endpoint, tenant or request_tenant(kwargs))
+    probe = breaker.before_call()
+    recorded = False
+    
+    # A final 429 says nothing about the endpoint's health, so it is not recorded;
+    # calls that end without an outcome give their half-open probe slot back
+    try:
+        for attempt in range(retries + 1):
+            metrics.observe('ghl_rate_limit_wait_seconds', rate_limiter.acquire())
+            started = time.perf_counter()
+            try:
+                resp = ghl_session.request(method, url, **kwargs)
+            except requests.exceptions.RequestException:
+                metrics.observe('ghl_request_duration_seconds', time.perf_counter() - started,
+                                endpoint=endpoint, status='error')
+                breaker.record(False, time.perf_counter() - started, probe)
+                recorded = True
+                raise
+            elapsed = time.perf_counter() - started
+            metrics.observe('ghl_request_duration_seconds', elapsed,
+                            endpoint=endpoint, status=str(resp.status_code))
+            record_span('ghl', endpoint, elapsed)
+            if resp.status_code != 429:
+                breaker.record(resp.status_code < 500, elapsed, probe)
+                recorded = True
+                return resp
+            if attempt == retries:
+                return resp
+            
+            retry_after = resp.headers.get('Retry-After')
+            delay = float(retry_after) if retry_after and retry_after.isdigit() else 2 ** attempt
+            log.warning('ghl_rate_limited', endpoint=endpoint, retry_in=delay, attempt=attempt + 1, per_second=1)
+            time.sleep(delay)
+    finally:
+        if not recorded:
+            breaker.release(probe)
+
+class GHLSyncError(Exception):
+    pass
+
+# Diagnostic probes run concurrently; each one gets PROBE_TIMEOUT seconds
+PROBE_CONCURRENCY = int(os.getenv('PROBE_CONCURRENCY', '8'))
+PROBE_TIMEOUT = float(os.getenv('PROBE_TIMEOUT', '15'))
+probe_executor = ThreadPoolExecutor(max_workers=PROBE_CONCURRENCY, thread_name_prefix='probe')
+
+def run_probes(probes, probe_fn, name_key="name", timeout=PROBE_TIMEOUT):
+    """Run probe_fn over probes concurrently, returning results in probe order
+    
+    Each probe's timeout counts from when a probe thread picks it up, so time
+    spent queued behind other probes is not held against it. A probe that raised
+    or overran is reported as an error result labelled with the probe's name
+    under name_key, and is cancelled if it somehow has not started.
+    """
+    started = [None] * len(probes)
+    
+    def timed_probe(index, probe):
+        started[index] = time.monotonic()
+        return probe_fn(probe)
+    
+    futures = [probe_executor.submit(timed_probe, i, probe) for i, probe in enumerate(probes)]
+    results = []
+    
+    for index, (probe, future) in enumerate(zip(probes, futures)):
+        while True:
+            start = started[index]
+            remaining = timeout if start is None else start + timeout - time.monotonic()
+            try:
+                results.append(future.result(timeout=max(remaining, 0)))
+            except FutureTimeout:
+                if started[index] is None or started[index] != start:
+                    continue  # still queued, or picked up while we waited: wait out its own timeout
+                future.cancel()
+                results.append({name_key: probe['name'], "error": f"Timed out after {timeout}s"})
+            except Exception as e:
+                results.append({name_key: probe['name'], "error": str(e), "exception_type": type(e).__name__})
+            break
+    
+    return results
+
+class LocationDirectory:
+    """In-memory location_id -> metadata map, so contact rows don't carry location names
+    
+    Reloaded whenever this process writes locations, after `ttl` seconds to pick up
+    other processes' writes, and on a miss (rate-limited) for brand-new locations.
+    `version` moves on whenever a reload finds different entries, so results built
+    from the directory can be cached against it.
+    """
+    def __init__(self, db_path, ttl=60, miss_reload_interval=5):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.miss_reload_interval = miss_reload_interval
+        self.entries = {}
+        self.version = 0
+        self.loaded_at = 0
+        self.lock = threading.Lock()
+    
+    def refresh(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        cursor = conn.cursor()
+        cursor.execute('SELECT location_id, location_name, company_id, timezone FROM locations')
+        entries = {row[0]: {'name': row[1], 'company_id': row[2], 'timezone': row[3]} for row in cursor.fetchall()}
+        conn.close()
+        
+        with self.lock:
+            if entries != self.entries:
+                self.entries = entries
+                self.version += 1
+            self.loaded_at = time.monotonic()
+    
+    def get(self, location_id):
+        age = time.monotonic() - self.loaded_at
+        if age > self.ttl or (location_id not in self.entries and age > self.miss_reload_interval):
+            metrics.inc('cache_requests_total', cache='location_directory', result='miss')
+            self.refresh()
+        else:
+            metrics.inc('cache_requests_total', cache='location_directory', result='hit')
+        return self.entries.get(location_id)
+    
+    def all(self):
+        """Snapshot of every entry, reloaded once older than ttl"""
+        if time.monotonic() - self.loaded_at > self.ttl:
+            self.refresh()
+        return self.entries
+    
+    def name(self, location_id, default='Unknown Location'):
+        entry = self.get(location_id)
+        return entry['name'] if entry else default
+
+class GenerationCache:
+    """LRU of computed results that stay valid until their data generation moves on
+    
+    Callers pass the current generation of the data a result depends on (see
+    DebugLeadAnalytics.generation); a stored result is reused only while that
+    generation is unchanged, so writes from any process invalidate it.
+    """
+    def __init__(self, name, max_entries=1024):
+        self.name = name
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+    
+    def get_or_compute(self, key, generation, compute):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] == generation:
+                self.entries.move_to_end(key)
+                metrics.inc('cache_requests_total', cache=self.name, result='hit')
+                return entry[1]
+        metrics.inc('cache_requests_total', cache=self.name, result='miss')
         
+        value = compute()
+        with self.lock:
+            self.entries[key] = (generation, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return value
+
+class SingleFlight:
+    """Coalesces concurrent identical calls within this process onto one computation
+    
+    The first caller for a key runs the computation; callers that arrive while it
+    is in flight wait and share its result (or exception). Nothing is kept after
+    it finishes, so a result is never older than the request that started it.
+    """
+    class Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+            self.waiters = 0
+    
+    def __init__(self, name):
+        self.name = name
+        self.calls = {}
+        self.lock = threading.Lock()
+    
+    def do(self, key, compute):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = SingleFlight.Call()
+            else:
+                call.waiters += 1
+        
+        if not leader:
+            metrics.inc('singleflight_calls_total', flight=self.name, result='shared')
+            call.done.wait()
+            if call.error:
+                raise call.error
+            return call.result
+        
+        metrics.inc('singleflight_calls_total', flight=self.name, result='computed')
+        try:
+            call.result = compute()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+            if call.waiters:
+                log.debug('singleflight_coalesced', flight=self.name, key=str(key), waiters=call.waiters, sample=0.1)
+        return call.result
+
+# Contact fingerprints, so a re-sync only writes contacts that changed
+FINGERPRINT_MAX_CONTACTS = int(os.getenv('FINGERPRINT_MAX_CONTACTS', '5000000'))  # per process; 0 disables
+CONTACT_CONTENT_COLUMNS = ('location_id', 'first_name', 'last_name', 'email', 'phone', 'source', 'date_added',
+                           'custom_fields', 'tags', 'phone_e164', 'email_norm', 'date_added_ts')
+
+# An upsert rather than INSERT OR REPLACE keeps the rowid, which contacts_fts is keyed on
+CONTACT_UPSERT_SQL = '''
+    INSERT INTO contacts 
+    (contact_id, location_id, first_name, last_name, 
+     email, phone, source, date_added, custom_fields, tags, last_updated,
+     phone_e164, email_norm, date_added_ts)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(contact_id) DO UPDATE SET
+        location_id = excluded.location_id, first_name = excluded.first_name,
+        last_name = excluded.last_name, email = excluded.email, phone = excluded.phone,
+        source = excluded.source, date_added = excluded.date_added,
+        custom_fields = excluded.custom_fields, tags = excluded.tags,
+        last_updated = excluded.last_updated,
+        phone_e164 = excluded.phone_e164, email_norm = excluded.email_norm,
+        date_added_ts = excluded.date_added_ts
+'''
+
+def contact_row(contact_data, location_id, now):
+    """CONTACT_UPSERT_SQL parameters for a GHL contact (API shape)"""
+    return (
+        contact_data['id'],
+        location_id,
+        contact_data.get('firstName', ''),
+        contact_data.get('lastName', ''),
+        contact_data.get('email', ''),
+        contact_data.get('phone', ''),
+        contact_data.get('source', ''),
+        contact_data.get('dateAdded', ''),
+        json.dumps(contact_data.get('customFields', [])),
+        json.dumps(contact_data.get('tags', [])),
+        now,
+        normalize_phone(contact_data.get('phone')),
+        normalize_email(contact_data.get('email')),
+        parse_timestamp(contact_data.get('dateAdded'))
+    )
+
+def contact_fingerprint(contact_id, content):
+    """64-bit hashes of a contact's ID and of its stored content (CONTACT_CONTENT_COLUMNS)
+    
+    Python's own hash is salted per process, which is fine for an index that
+    never leaves the process and several times faster than a cryptographic digest.
+    """
+    return hash(contact_id), hash(content)
+
+class ContactFingerprints:
+    """contact_id -> content digest for one location, in two parallel sorted arrays
+    
+    IDs and digests are 64-bit hashes held in array('q'), 16 bytes a contact,
+    looked up by bisecting the sorted IDs. Loading sorts fixed-size runs and
+    merges them, so it peaks at about twice that rather than holding a Python
+    int per contact.
+    Contacts first seen after loading go into a small dict that is merged into
+    the arrays once it grows past an eighth of them. Callers hold `lock` around
+    get/set, since writers on several threads share one index.
+    """
+    LOAD_RUN = 65536
+    
+    def __init__(self, generation, pairs=()):
+        self.generation = generation
+        self.lock = threading.Lock()
+        # Each run is sorted as (id, digest) packed into one int, then kept as arrays
+        runs = []
+        pairs = iter(pairs)
+        while True:
+            packed = sorted(((i + (1 << 63)) << 64) | (d + (1 << 63)) for i, d in itertools.islice(pairs, self.LOAD_RUN))
+            if not packed:
+                break
+            runs.append((array('q', ((p >> 64) - (1 << 63) for p in packed)),
+                         array('q', ((p & 0xFFFFFFFFFFFFFFFF) - (1 << 63) for p in packed))))
+        self.ids, self.digests = array('q'), array('q')
+        for id_hash, digest in heapq.merge(*(zip(ids, digests) for ids, digests in runs)):
+            self.ids.append(id_hash)
+            self.digests.append(digest)
+        self.pending = {}
+    
+    def __len__(self):
+        return len(self.ids) + len(self.pending)
+    
+    def get(self, id_hash):
+        pos = bisect.bisect_left(self.ids, id_hash)
+        if pos < len(self.ids) and self.ids[pos] == id_hash:
+            return self.digests[pos]
+        return self.pending.get(id_hash)
+    
+    def set(self, id_hash, digest):
+        pos = bisect.bisect_left(self.ids, id_hash)
+        if pos < len(self.ids) and self.ids[pos] == id_hash:
+            self.digests[pos] = digest
+            return
+        self.pending[id_hash] = digest
+        if len(self.pending) > max(1024, len(self.ids) // 8):
+            self.merge()
+    
+    def merge(self):
+        """Fold pending entries into the arrays in one pass of slice copies"""
+        ids, digests = array('q'), array('q')
+        start = 0
+        for id_hash, digest in sorted(self.pending.items()):
+            pos = bisect.bisect_left(self.ids, id_hash, start)
+            ids.extend(self.ids[start:pos])
+            digests.extend(self.digests[start:pos])
+            ids.append(id_hash)
+            digests.append(digest)
+            start = pos
+        ids.extend(self.ids[start:])
+        digests.extend(self.digests[start:])
+        self.ids, self.digests, self.pending = ids, digests, {}
+    
+    def memory_bytes(self):
+        pending = sys.getsizeof(self.pending) + len(self.pending) * 2 * sys.getsizeof(1 << 62)
+        return sys.getsizeof(self.ids) + sys.getsizeof(self.digests) + pending
+
+class FingerprintStore:
+    """Per-process LRU of ContactFingerprints, capped at FINGERPRINT_MAX_CONTACTS in total
+    
+    An index is trusted only while the location's generation is the one it was
+    last brought up to date with; a write from anywhere else bumps the
+    generation and the index is reloaded from the database on next use.
+    """
+    def __init__(self, max_contacts=FINGERPRINT_MAX_CONTACTS):
+        self.max_contacts = max_contacts
+        self.locations = OrderedDict()
+        self.lock = threading.Lock()
+    
+    def get(self, location_id, generation, load):
+        """Index for location_id at `generation`, calling load() -> [(contact_id, content)] if stale"""
+        if not self.max_contacts:
+            return None
+        with self.lock:
+            index = self.locations.get(location_id)
+            if index and index.generation == generation:
+                self.locations.move_to_end(location_id)
+                metrics.inc('cache_requests_total', cache='contact_fingerprints', result='hit')
+                return index
+        metrics.inc('cache_requests_total', cache='contact_fingerprints', result='miss')
+        
+        started = time.perf_counter()
+        index = ContactFingerprints(generation, (contact_fingerprint(contact_id, content) for contact_id, content in load()))
+        log.info('fingerprints_loaded', location_id=location_id, contacts=len(index),
+                 bytes=index.memory_bytes(), seconds=round(time.perf_counter() - started, 3))
+        with self.lock:
+            self.locations[location_id] = index
+            self.locations.move_to_end(location_id)
+            self.evict()
+        return index
+    
+    def advance(self, location_id, expected, generation):
+        """Record our own write: keep the index only if no other write landed since `expected`"""
+        with self.lock:
+            index = self.locations.get(location_id)
+            if not index:
+                return
+            if index.generation == expected and generation == expected + 1:
+                index.generation = generation
+            else:
+                del self.locations[location_id]
+    
+    def evict(self):
+        total = sum(len(index) for index in self.locations.values())
+        while total > self.max_contacts and len(self.locations) > 1:
+            _, index = self.locations.popitem(last=False)
+            total -= len(index)
+    
+    def stats(self):
+        with self.lock:
+            indexes = list(self.locations.values())
+        contacts = sum(len(index) for index in indexes)
+        memory = sum(index.memory_bytes() for index in indexes)
+        return {
+            'locations': len(indexes),
+            'contacts': contacts,
+            'bytes': memory,
+            'bytes_per_contact': round(memory / contacts, 1) if contacts else None,
+            'max_contacts': self.max_contacts
+        }
+
+# Search
+SEARCH_MAX_LIMIT = 100
+SEARCH_MAX_OFFSET = 1000
+# Column weights for bm25(), in contacts_fts column order: names count most
+SEARCH_WEIGHTS = (0, 10.0, 10.0, 5.0, 5.0, 1.0, 1.0)
+# SQL for a row's phone with formatting stripped, used when indexing contacts_fts
+FTS_PHONE_DIGITS = "replace(replace(replace(replace(replace(replace(coalesce({row}.phone, ''), '+', ''), '-', ''), ' ', ''), '(', ''), ')', ''), '.', '')"
+
+def fts_query(text, location_id=None):
+    """FTS5 MATCH expression for free-text search: every term is a prefix match
+    
+    Input that looks like a phone number collapses to one digit run so
+    "(555) 123-4567" matches the indexed 5551234567. Returns None for input
+    with nothing searchable.
+    """
+    if re.fullmatch(r'[\d\s()+.-]*\d{3}[\d\s()+.-]*', text.strip()):
+        terms = [re.sub(r'\D', '', text)]
+    else:
+        terms = re.findall(r'\w+', text.lower())
+    if not terms:
+        return None
+    
+    match = '{first_name last_name email phone source tags}: (' + ' AND '.join(f'"{t}"*' for t in terms) + ')'
+    if location_id:
+        quoted = location_id.replace('"', '""')
+        match = f'location_id: "{quoted}" AND {match}'
+    return match
+
+# Identity: normalized phone/email used to match the same person across locations
+DEFAULT_PHONE_COUNTRY_CODE = os.getenv('DEFAULT_PHONE_COUNTRY_CODE', '1')
+IDENTITY_COLUMNS = {'phone': 'phone_e164', 'email': 'email_norm'}
+
+def normalize_phone(phone):
+    """E.164 form of a phone number, or None if it can't be one
+    
+    Numbers without a leading + are assumed to be national numbers in
+    DEFAULT_PHONE_COUNTRY_CODE (with or without that code already prefixed).
+    """
+    if not phone:
+        return None
+    digits = re.sub(r'\D', '', phone)
+    if not phone.strip().startswith('+'):
+        if len(digits) == 10 and DEFAULT_PHONE_COUNTRY_CODE == '1':
+            digits = '1' + digits
+        elif not digits.startswith(DEFAULT_PHONE_COUNTRY_CODE):
+            digits = DEFAULT_PHONE_COUNTRY_CODE + digits.lstrip('0')
+    if digits.startswith('1') and len(digits) != 11:
+        return None  # NANP numbers are always +1 and ten digits
+    return f"+{digits}" if 8 <= len(digits) <= 15 else None
+
+def normalize_email(email):
+    email = (email or '').strip().lower()
+    return email if '@' in email else None
+
+# Source attribution
+SOURCES_DEFAULT_TOP = 8
+SOURCES_MAX_TOP = 50
+
+# Change feed
+CHANGE_TRACKED_FIELDS = ('location_id', 'first_name', 'last_name', 'email', 'phone', 'source',
+                         'date_added', 'custom_fields', 'tags')
+CHANGE_OPS = {'i': 'insert', 'u': 'update', 'd': 'delete'}
+CHANGES_DEFAULT_LIMIT = 500
+CHANGES_MAX_LIMIT = 5000
+CHANGES_RETENTION_DAYS = int(os.getenv('CHANGES_RETENTION_DAYS', '14'))
+CHANGES_PRUNE_INTERVAL = 3600
+
+# Reconciliation of contacts deleted in GHL, run far less often than delta syncs
+RECONCILE_INTERVAL = int(os.getenv('RECONCILE_INTERVAL', str(24 * 3600)))
+RECONCILE_BATCH_SIZE = 500
+RECONCILE_MAX_DELETE_FRACTION = 0.5
+
+def sorted_difference(left, right):
+    """Items of sorted iterable left missing from sorted iterable right, in one merge pass"""
+    right = iter(right)
+    current = next(right, None)
+    for item in left:
+        while current is not None and current < item:
+            current = next(right, None)
+        if current != item:
+            yield item
+
+# Bulk import of GHL contact CSV exports
+IMPORT_CHUNK_ROWS = 5000
+IMPORT_TRANSACTION_ROWS = 50000
+IMPORT_DIR = os.getenv('IMPORT_DIR')  # uploads wait here for a job worker; defaults next to DATABASE_PATH
+IMPORT_LEASE_SECONDS = 900  # sync lease held by a deferred-index import, renewed after every commit
+CSV_CONTACT_FIELDS = {
+    'contact id': 'id', 'id': 'id',
+    'first name': 'firstName', 'last name': 'lastName',
+    'email': 'email', 'phone': 'phone', 'source': 'source', 'tags': 'tags',
+    'created': 'dateAdded', 'date created': 'dateAdded', 'date added': 'dateAdded'
+}
+CONTACT_SECONDARY_INDEXES = ('idx_contacts_phone_e164', 'idx_contacts_email_norm', 'idx_contacts_location_date',
+                             'idx_contacts_date', 'idx_contacts_location_source', 'idx_contacts_location_id')
+
+def csv_contact(record):
+    """A GHL export row in the API's contact shape, so it maps through contact_row unchanged
+    
+    Columns outside CSV_CONTACT_FIELDS become customFields entries; tags are
+    comma separated and the created date is rewritten as the API's ISO form.
+    """
+    contact = {'customFields': []}
+    for column, value in record.items():
+        if column is None:
+            continue
+        value = (value or '').strip()
+        field = CSV_CONTACT_FIELDS.get(column.strip().lower())
+        if field == 'tags':
+            contact['tags'] = [tag.strip() for tag in value.split(',') if tag.strip()]
+        elif field == 'dateAdded':
+            ts = parse_timestamp(value)
+            contact['dateAdded'] = time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(ts)) if ts is not None else value
+        elif field:
+            contact[field] = value
+        elif value:
+            contact['customFields'].append({'key': column.strip(), 'value': value})
+    return contact
+
+# Conversations; codes are stored, so only ever append to these maps
+MESSAGE_DIRECTIONS = {'inbound': 1, 'outbound': 2}
+MESSAGE_CHANNELS = {
+    'TYPE_SMS': 1, 'TYPE_EMAIL': 2, 'TYPE_CALL': 3, 'TYPE_FACEBOOK': 4, 'TYPE_INSTAGRAM': 5,
+    'TYPE_WHATSAPP': 6, 'TYPE_GMB': 7, 'TYPE_LIVE_CHAT': 8, 'TYPE_WEBCHAT': 9, 'TYPE_REVIEW': 10,
+    'TYPE_CUSTOM_SMS': 11, 'TYPE_CUSTOM_EMAIL': 12, 'TYPE_ACTIVITY': 13
+}
+GHL_CONVERSATIONS_VERSION = "2021-04-15"
+CONVERSATION_PAGE_SIZE = 100
+MESSAGE_PAGE_SIZE = 100
+
+def message_channel(message_type):
+    """Small-int channel code for a GHL message type ('TYPE_SMS', or the legacy numeric type); 0 if unknown"""
+    if isinstance(message_type, str):
+        return MESSAGE_CHANNELS.get(message_type.upper(), 0)
+    return 0
+
+# Tasks
+TASK_PAGE_SIZE = 100
+TASK_SYNC_INTERVAL = int(os.getenv('TASK_SYNC_INTERVAL', '900'))
+TASK_SYNC_PASSES = 2
+TASKS_DEFAULT_LIMIT = 50
+TASKS_MAX_LIMIT = 500
+
+# Debug page
+DEBUG_LOGS_DEFAULT_LIMIT = 20
+DEBUG_LOGS_MAX_LIMIT = 200
+
+# Leaderboard
+LEADERBOARD_SORTS = ('total_contacts', 'phone_rate', 'email_rate', 'complete_rate', 'new_today', 'new_this_week', 'name')
+
+# Time series
+TIMESERIES_MAX_BUCKETS = 1000
+TIMESERIES_DEFAULT_SPAN = {'hour': timedelta(hours=48), 'day': timedelta(days=30), 'week': timedelta(weeks=12)}
+
+def parse_timestamp(value):
+    """Epoch seconds for a GHL timestamp (ISO 8601 or epoch milliseconds), or None"""
+    if not value:
+        return None
+    if isinstance(value, (int, float)) or str(value).isdigit():
+        return int(value) // 1000
+    try:
+        parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp())
+
+def parse_time_param(value, tz=timezone.utc):
+    """Epoch seconds from a from/to query value; None if absent, False if unparseable
+    
+    Accepts epoch seconds or ISO dates/datetimes, reading naive values in tz.
+    """
+    if not value:
+        return None
+    if value.isdigit():
+        return int(value)
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return False
+    return int((parsed if parsed.tzinfo else parsed.replace(tzinfo=tz)).timestamp())
+
+def load_timezone(name):
+    try:
+        return ZoneInfo(name) if name else timezone.utc
+    except (ZoneInfoNotFoundError, ValueError):
+        return timezone.utc
+
+def bucket_starts(bucket, start, end, tz):
+    """Epoch-second starts of each local hour/day/week bucket covering [start, end), plus the final edge
+    
+    Day and week edges are local midnights (weeks start Monday), so they follow
+    the zone's DST changes.
+    """
+    local = datetime.fromtimestamp(start, tz)
+    if bucket == 'hour':
+        first = int(local.replace(minute=0, second=0, microsecond=0).timestamp())
+        return list(range(first, end + 3600, 3600))[:TIMESERIES_MAX_BUCKETS + 1]
+    
+    day = local.date()
+    if bucket == 'week':
+        day -= timedelta(days=day.weekday())
+    step = timedelta(weeks=1) if bucket == 'week' else timedelta(days=1)
+    edges = []
+    while len(edges) <= TIMESERIES_MAX_BUCKETS:
+        edge = int(datetime(day.year, day.month, day.day, tzinfo=tz).timestamp())
+        edges.append(edge)
+        if edge >= end:
+            break
+        day += step
+    return edges
+
+# Sharding: with SHARD_DIR set, each company's contacts live in their own SQLite
+# file there, so one agency's sync never write-locks another's reads. The main
+# database keeps locations, tokens, schedules, jobs and logs either way.
+SHARD_DIR = os.getenv('SHARD_DIR')
+SHARD_FANOUT = int(os.getenv('SHARD_FANOUT', '8'))
+shard_executor = ThreadPoolExecutor(max_workers=SHARD_FANOUT, thread_name_prefix='shard')
+
+class UnresolvedLocationError(Exception):
+    """A sharded write for a location whose company (and so shard) is not known yet"""
+    def __init__(self, location_id):
+        super().__init__(f"Location {location_id} has no known company yet; sync its locations first")
+        self.location_id = location_id
+
+class LeaseLostError(Exception):
+    """Another worker took over a location's sync lease while this one was still syncing it"""
+
+class ShardResolver:
+    """Routes a tenant's contact data to its SQLite file
+    
+    Without a shard_dir every tenant resolves to the main database, so the
+    unsharded layout is simply the one-shard case. Locations map to companies
+    through the LocationDirectory. A location with no known company reads from
+    the main database but cannot be written to (see path_for_write): rows stored
+    there would be orphaned once save_locations learns its company.
+    """
+    def __init__(self, db_path, shard_dir, directory, init_shard):
+        self.db_path = db_path
+        self.shard_dir = shard_dir
+        self.directory = directory
+        self.init_shard = init_shard
+        self.initialized = {db_path}
+        self.lock = threading.Lock()
+        if shard_dir:
+            os.makedirs(shard_dir, exist_ok=True)
+    
+    def path_for_company(self, company_id):
+        if not self.shard_dir or not company_id:
+            return self.db_path
+        safe = ''.join(ch if ch.isalnum() or ch in '-_' else '_' for ch in company_id)
+        return os.path.join(self.shard_dir, f"company_{safe}.db")
+    
+    def path_for_location(self, location_id):
+        if not self.shard_dir:
+            return self.db_path
+        entry = self.directory.get(location_id)
+        return self.path_for_company(entry and entry['company_id'])
+    
+    def path_for_write(self, location_id):
+        """path_for_location, refusing locations whose shard is not known yet"""
+        if self.shard_dir:
+            entry = self.directory.get(location_id)
+            if not (entry and entry['company_id']):
+                raise UnresolvedLocationError(location_id)
+        return self.path_for_location(location_id)
+    
+    def paths(self):
+        """Every shard file, main database first"""
+        if not self.shard_dir:
+            return [self.db_path]
+        names = sorted(n for n in os.listdir(self.shard_dir) if n.startswith('company_') and n.endswith('.db'))
+        return [self.db_path] + [os.path.join(self.shard_dir, n) for n in names]
+    
+    def connect(self, path):
+        """Connection to a shard, creating its schema on first use in this process"""
+        if path not in self.initialized:
+            with self.lock:
+                if path not in self.initialized:
+                    self.init_shard(path)
+                    self.initialized.add(path)
+        return sqlite3.connect(path, timeout=30)
+    
+    def reinitialize(self, path):
+        """Rerun the shard's schema setup on its next connection in this process"""
+        with self.lock:
+            self.initialized.discard(path)
+    
+    def map(self, fn):
+        """fn(path) for every shard, in parallel, results in paths() order"""
+        paths = self.paths()
+        if len(paths) == 1:
+            return [fn(paths[0])]
+        return list(shard_executor.map(fn, paths))
+
+class DebugLeadAnalytics:
+    def __init__(self, db_path="debug_analytics.db", shard_dir=None):
+        self.db_path = db_path
+        self.init_database()
+        self.location_directory = LocationDirectory(db_path)
+        self.shards = ShardResolver(db_path, shard_dir, self.location_directory, self.init_shard)
+        self.cache = GenerationCache('aggregates')
+        self.stats_flight = SingleFlight('basic_stats')
+        self.fingerprints = FingerprintStore()
+        self.changes_pruned_at = {}
+    
+    def init_contacts_schema(self, cursor):
+        """Tables that live in every shard"""
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS contacts (
                 contact_id TEXT PRIMARY KEY,
@@ -54,9 +1282,425 @@ class DebugLeadAnalytics:
                 created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
                 custom_fields TEXT,
                 tags TEXT,
-                last_updated DATETIME DEFAULT CURRENT_TIMESTAMP
+                last_updated DATETIME DEFAULT CURRENT_TIMESTAMP,
+                phone_e164 TEXT,
+                email_norm TEXT,
+                date_added_ts INTEGER
+            )
+        ''')
+        
+        # Normalized identities, set at ingest; older databases are migrated and backfilled
+        cursor.execute('PRAGMA table_info(contacts)')
+        columns = {row[1] for row in cursor.fetchall()}
+        backfill_identities = 'phone_e164' not in columns
+        if backfill_identities:
+            cursor.execute('ALTER TABLE contacts ADD COLUMN phone_e164 TEXT')
+            cursor.execute('ALTER TABLE contacts ADD COLUMN email_norm TEXT')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_contacts_phone_e164 ON contacts(phone_e164) WHERE phone_e164 IS NOT NULL')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_contacts_email_norm ON contacts(email_norm) WHERE email_norm IS NOT NULL')
+        
+        # Phone/email values shared by more than one contact, kept current by add_contacts
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS contact_identities (
+                kind TEXT NOT NULL,
+                value TEXT NOT NULL,
+                contacts INTEGER NOT NULL,
+                locations INTEGER NOT NULL,
+                PRIMARY KEY (kind, value)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_contact_identities_rank ON contact_identities(locations, contacts)')
+        if backfill_identities:
+            self.backfill_identities(cursor)
+        
+        # GHL's dateAdded as epoch seconds, plus hourly lead counts per location kept by triggers
+        backfill_dates = 'date_added_ts' not in columns
+        if backfill_dates:
+            cursor.execute('ALTER TABLE contacts ADD COLUMN date_added_ts INTEGER')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_contacts_location_date ON contacts(location_id, date_added_ts)')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS contact_rollup_hourly (
+                location_id TEXT NOT NULL,
+                hour_ts INTEGER NOT NULL,
+                contacts INTEGER NOT NULL DEFAULT 0,
+                with_phone INTEGER NOT NULL DEFAULT 0,
+                with_email INTEGER NOT NULL DEFAULT 0,
+                with_both INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (location_id, hour_ts)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_contact_rollup_hour ON contact_rollup_hourly(hour_ts)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_contacts_date ON contacts(date_added_ts)')
+        rollup_counts = lambda row, sign: ', '.join([
+            f"{sign}1",
+            f"{sign}({row}.phone IS NOT NULL AND {row}.phone != '')",
+            f"{sign}({row}.email IS NOT NULL AND {row}.email != '')",
+            f"{sign}({row}.phone IS NOT NULL AND {row}.phone != '' AND {row}.email IS NOT NULL AND {row}.email != '')"
+        ])
+        rollup_upsert = lambda row, sign: f'''
+            INSERT INTO contact_rollup_hourly (location_id, hour_ts, contacts, with_phone, with_email, with_both)
+            SELECT {row}.location_id, {row}.date_added_ts / 3600 * 3600, {rollup_counts(row, sign)}
+            WHERE {row}.date_added_ts IS NOT NULL
+            ON CONFLICT(location_id, hour_ts) DO UPDATE SET
+                contacts = contacts + excluded.contacts, with_phone = with_phone + excluded.with_phone,
+                with_email = with_email + excluded.with_email, with_both = with_both + excluded.with_both;
+        '''
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS contacts_rollup_insert AFTER INSERT ON contacts BEGIN
+                {rollup_upsert('new', '')}
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS contacts_rollup_delete AFTER DELETE ON contacts BEGIN
+                {rollup_upsert('old', '-')}
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS contacts_rollup_update AFTER UPDATE ON contacts
+            WHEN old.location_id IS NOT new.location_id OR old.date_added_ts IS NOT new.date_added_ts
+              OR old.phone IS NOT new.phone OR old.email IS NOT new.email
+            BEGIN
+                {rollup_upsert('old', '-')}
+                {rollup_upsert('new', '')}
+            END
+        ''')
+        if backfill_dates:
+            self.backfill_dates(cursor)
+        
+        # Covers the source breakdown, which counts usable (normalized) phones and emails
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_contacts_location_source ON contacts(location_id, source, date_added_ts, phone_e164, email_norm)')
+        
+        # Bumped on every write to a location's contacts; read-side caches key on it
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS contact_generations (
+                location_id TEXT PRIMARY KEY,
+                generation INTEGER NOT NULL
+            ) WITHOUT ROWID
+        ''')
+        
+        # Contacts removed by reconciliation because they no longer exist in GHL
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS contact_tombstones (
+                contact_id TEXT PRIMARY KEY,
+                location_id TEXT NOT NULL,
+                deleted_at REAL NOT NULL
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_contacts_location_id ON contacts(location_id, contact_id)')
+        
+        # Append-only change feed for downstream mirrors; AUTOINCREMENT never reuses
+        # a seq, even once retention has deleted every event
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS contact_changes (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                contact_id TEXT NOT NULL,
+                location_id TEXT NOT NULL,
+                op TEXT NOT NULL,
+                fields TEXT,
+                changed_at INTEGER NOT NULL
             )
         ''')
+        changed_fields = " || ".join(
+            f"CASE WHEN old.{field} IS NOT new.{field} THEN '{field},' ELSE '' END" for field in CHANGE_TRACKED_FIELDS
+        )
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS contacts_changes_insert AFTER INSERT ON contacts BEGIN
+                INSERT INTO contact_changes (contact_id, location_id, op, changed_at)
+                VALUES (new.contact_id, new.location_id, 'i', CAST(strftime('%s', 'now') AS INTEGER));
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS contacts_changes_update AFTER UPDATE ON contacts
+            WHEN {' OR '.join(f"old.{field} IS NOT new.{field}" for field in CHANGE_TRACKED_FIELDS)}
+            BEGIN
+                INSERT INTO contact_changes (contact_id, location_id, op, fields, changed_at)
+                VALUES (new.contact_id, new.location_id, 'u', rtrim({changed_fields}, ','),
+                        CAST(strftime('%s', 'now') AS INTEGER));
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS contacts_changes_delete AFTER DELETE ON contacts BEGIN
+                INSERT INTO contact_changes (contact_id, location_id, op, changed_at)
+                VALUES (old.contact_id, old.location_id, 'd', CAST(strftime('%s', 'now') AS INTEGER));
+            END
+        ''')
+        
+        # Full-text index over the searchable fields. It is contentless (results join
+        # back to contacts by rowid) so the phone column can also carry the national
+        # and local digit runs, letting "5551234" find "+15551234567".
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'contacts_fts'")
+        fts_exists = cursor.fetchone()
+        cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS contacts_fts USING fts5(
+                location_id, first_name, last_name, email, phone, source, tags,
+                content='', prefix='2 3'
+            )
+        ''')
+        fts_values = lambda row: ', '.join([
+            f"{row}.location_id", f"{row}.first_name", f"{row}.last_name", f"{row}.email",
+            f"{row}.phone || ' ' || substr({FTS_PHONE_DIGITS.format(row=row)}, -10)"
+            f" || ' ' || substr({FTS_PHONE_DIGITS.format(row=row)}, -7)",
+            f"{row}.source", f"{row}.tags"
+        ])
+        fts_columns = 'location_id, first_name, last_name, email, phone, source, tags'
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS contacts_fts_insert AFTER INSERT ON contacts BEGIN
+                INSERT INTO contacts_fts (rowid, {fts_columns}) VALUES (new.rowid, {fts_values('new')});
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS contacts_fts_delete AFTER DELETE ON contacts BEGIN
+                INSERT INTO contacts_fts (contacts_fts, rowid, {fts_columns}) VALUES ('delete', old.rowid, {fts_values('old')});
+            END
+        ''')
+        # Resyncs rewrite every row; only reindex when a searchable field changed
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS contacts_fts_update AFTER UPDATE ON contacts
+            WHEN old.location_id IS NOT new.location_id OR old.first_name IS NOT new.first_name
+              OR old.last_name IS NOT new.last_name OR old.email IS NOT new.email
+              OR old.phone IS NOT new.phone OR old.source IS NOT new.source OR old.tags IS NOT new.tags
+            BEGIN
+                INSERT INTO contacts_fts (contacts_fts, rowid, {fts_columns}) VALUES ('delete', old.rowid, {fts_values('old')});
+                INSERT INTO contacts_fts (rowid, {fts_columns}) VALUES (new.rowid, {fts_values('new')});
+            END
+        ''')
+        if not fts_exists:
+            cursor.execute(f"INSERT INTO contacts_fts (rowid, {fts_columns}) SELECT rowid, {fts_values('contacts')} FROM contacts")
+        
+        # Conversation history, one narrow row per message with no payload; the
+        # per-contact activity row is kept current by trigger as messages land
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS conversations (
+                conversation_id TEXT PRIMARY KEY,
+                location_id TEXT NOT NULL,
+                contact_id TEXT,
+                channel INTEGER NOT NULL DEFAULT 0,
+                last_message_ms INTEGER NOT NULL
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_conversations_location_last ON conversations(location_id, last_message_ms)')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS messages (
+                message_id TEXT PRIMARY KEY,
+                contact_id TEXT NOT NULL,
+                date_ts INTEGER NOT NULL,
+                conversation_id TEXT NOT NULL,
+                location_id TEXT NOT NULL,
+                direction INTEGER NOT NULL,
+                channel INTEGER NOT NULL
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_contact_date ON messages(contact_id, date_ts)')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS contact_activity (
+                contact_id TEXT PRIMARY KEY,
+                location_id TEXT NOT NULL,
+                last_inbound_ts INTEGER,
+                last_outbound_ts INTEGER,
+                inbound_messages INTEGER NOT NULL DEFAULT 0,
+                outbound_messages INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_contact_activity_location_inbound ON contact_activity(location_id, last_inbound_ts)')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS messages_activity_insert AFTER INSERT ON messages BEGIN
+                INSERT INTO contact_activity (contact_id, location_id, last_inbound_ts, last_outbound_ts,
+                                              inbound_messages, outbound_messages)
+                VALUES (new.contact_id, new.location_id,
+                        CASE WHEN new.direction = {MESSAGE_DIRECTIONS['inbound']} THEN new.date_ts END,
+                        CASE WHEN new.direction = {MESSAGE_DIRECTIONS['outbound']} THEN new.date_ts END,
+                        new.direction = {MESSAGE_DIRECTIONS['inbound']}, new.direction = {MESSAGE_DIRECTIONS['outbound']})
+                ON CONFLICT(contact_id) DO UPDATE SET
+                    location_id = excluded.location_id,
+                    last_inbound_ts = CASE WHEN excluded.last_inbound_ts > coalesce(last_inbound_ts, 0)
+                                           THEN excluded.last_inbound_ts ELSE last_inbound_ts END,
+                    last_outbound_ts = CASE WHEN excluded.last_outbound_ts > coalesce(last_outbound_ts, 0)
+                                            THEN excluded.last_outbound_ts ELSE last_outbound_ts END,
+                    inbound_messages = inbound_messages + excluded.inbound_messages,
+                    outbound_messages = outbound_messages + excluded.outbound_messages;
+            END
+        ''')
+        
+        # Tasks; only open ones are refreshed, and the partial index holds just those
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS tasks (
+                task_id TEXT PRIMARY KEY,
+                location_id TEXT NOT NULL,
+                contact_id TEXT,
+                title TEXT,
+                assigned_to TEXT,
+                due_ts INTEGER,
+                completed INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL NOT NULL
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_open_due ON tasks(location_id, due_ts) WHERE completed = 0')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS task_syncs (
+                location_id TEXT PRIMARY KEY,
+                synced_at REAL NOT NULL
+            ) WITHOUT ROWID
+        ''')
+    
+    def prune_changes(self, cursor):
+        """Drop change events past retention, at most once per CHANGES_PRUNE_INTERVAL per shard"""
+        path = cursor.connection.execute('PRAGMA database_list').fetchone()[2]
+        now = time.time()
+        if now - self.changes_pruned_at.get(path, 0) < CHANGES_PRUNE_INTERVAL:
+            return
+        self.changes_pruned_at[path] = now
+        
+        # seq follows time, so the cutoff is the first event inside retention, found by
+        # walking the primary key from the oldest event
+        cursor.execute('''
+            DELETE FROM contact_changes WHERE seq < (
+                SELECT COALESCE(MIN(seq), (SELECT MAX(seq) + 1 FROM contact_changes))
+                FROM (SELECT seq FROM contact_changes WHERE changed_at >= ? ORDER BY seq LIMIT 1)
+            )
+        ''', (int(now - CHANGES_RETENTION_DAYS * 86400),))
+        if cursor.rowcount:
+            log.info('changes_pruned', events=cursor.rowcount, retention_days=CHANGES_RETENTION_DAYS)
+    
+    def changes(self, after=0, limit=CHANGES_DEFAULT_LIMIT, company_id=None, include_contacts=False):
+        """Change events with seq > after, oldest first; returns (events, oldest_seq, latest_seq)
+        
+        The feed is per shard, so with SHARD_DIR set consumers read one company's feed.
+        """
+        conn = self.shards.connect(self.shards.path_for_company(company_id))
+        cursor = conn.cursor()
+        
+        events = self.query(cursor, 'changes', '''
+            SELECT seq, contact_id, location_id, op, fields, changed_at
+            FROM contact_changes WHERE seq > ? ORDER BY seq LIMIT ?
+        ''', (after, limit))
+        bounds = self.query(cursor, 'changes_bounds', '''
+            SELECT (SELECT seq FROM contact_changes ORDER BY seq LIMIT 1),
+                   (SELECT seq FROM sqlite_sequence WHERE name = 'contact_changes')
+        ''')[0]
+        
+        contacts = {}
+        if include_contacts and events:
+            ids = list({e[1] for e in events if e[3] != 'd'})
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                for row in self.query(cursor, 'changes_contacts', f'''
+                    SELECT contact_id, first_name, last_name, email, phone, source, date_added, tags
+                    FROM contacts WHERE contact_id IN ({','.join('?' * len(chunk))})
+                ''', chunk):
+                    contacts[row[0]] = {
+                        'first_name': row[1], 'last_name': row[2], 'email': row[3], 'phone': row[4],
+                        'source': row[5], 'date_added': row[6], 'tags': json.loads(row[7] or '[]')
+                    }
+        conn.close()
+        
+        return [{
+            'seq': seq,
+            'contact_id': contact_id,
+            'location_id': location_id,
+            'op': CHANGE_OPS[op],
+            'fields': fields.split(',') if fields else None,
+            'changed_at': datetime.fromtimestamp(changed_at, timezone.utc).isoformat(),
+            **({'contact': contacts.get(contact_id)} if include_contacts and op != 'd' else {})
+        } for seq, contact_id, location_id, op, fields, changed_at in events], bounds[0], bounds[1] or 0
+    
+    def bump_generation(self, cursor, location_id):
+        cursor.execute('''
+            INSERT INTO contact_generations (location_id, generation) VALUES (?, 1)
+            ON CONFLICT(location_id) DO UPDATE SET generation = generation + 1
+        ''', (location_id,))
+    
+    def generation(self, location_id=None):
+        """Opaque token that changes whenever the location's (or, for None, any) contacts change"""
+        def shard_generation(path):
+            conn = self.shards.connect(path)
+            cursor = conn.cursor()
+            if location_id:
+                rows = self.query(cursor, 'generation', 'SELECT generation FROM contact_generations WHERE location_id = ?', (location_id,))
+            else:
+                rows = self.query(cursor, 'generation_all', 'SELECT SUM(generation), COUNT(*) FROM contact_generations')
+            conn.close()
+            return rows[0] if rows else None
+        
+        if location_id:
+            return shard_generation(self.shards.path_for_location(location_id))
+        return tuple(self.shards.map(shard_generation))
+    
+    def backfill_dates(self, cursor):
+        """Parse date_added on existing rows and rebuild the hourly rollup from them"""
+        cursor.execute('SELECT contact_id, date_added FROM contacts')
+        while True:
+            batch = cursor.fetchmany(10000)
+            if not batch:
+                break
+            cursor.connection.executemany(
+                'UPDATE contacts SET date_added_ts = ? WHERE contact_id = ?',
+                [(parse_timestamp(date_added), contact_id) for contact_id, date_added in batch]
+            )
+        self.rebuild_rollup(cursor)
+    
+    def rebuild_rollup(self, cursor):
+        cursor.execute('DELETE FROM contact_rollup_hourly')
+        cursor.execute('''
+            INSERT INTO contact_rollup_hourly (location_id, hour_ts, contacts, with_phone, with_email, with_both)
+            SELECT location_id, date_added_ts / 3600 * 3600, COUNT(*),
+                   SUM(phone IS NOT NULL AND phone != ''), SUM(email IS NOT NULL AND email != ''),
+                   SUM(phone IS NOT NULL AND phone != '' AND email IS NOT NULL AND email != '')
+            FROM contacts WHERE date_added_ts IS NOT NULL
+            GROUP BY location_id, date_added_ts / 3600
+        ''')
+    
+    def backfill_identities(self, cursor):
+        """Normalize phone/email on existing rows, then rebuild contact_identities from them"""
+        cursor.execute('SELECT contact_id, phone, email FROM contacts')
+        while True:
+            batch = cursor.fetchmany(10000)
+            if not batch:
+                break
+            cursor.connection.executemany(
+                'UPDATE contacts SET phone_e164 = ?, email_norm = ? WHERE contact_id = ?',
+                [(normalize_phone(phone), normalize_email(email), contact_id) for contact_id, phone, email in batch]
+            )
+        self.rebuild_identities(cursor)
+    
+    def rebuild_identities(self, cursor):
+        cursor.execute('DELETE FROM contact_identities')
+        for kind, column in IDENTITY_COLUMNS.items():
+            cursor.execute(f'''
+                INSERT INTO contact_identities (kind, value, contacts, locations)
+                SELECT ?, {column}, COUNT(*), COUNT(DISTINCT location_id) FROM contacts
+                WHERE {column} IS NOT NULL GROUP BY {column} HAVING COUNT(*) > 1
+            ''', (kind,))
+    
+    def refresh_identities(self, cursor, touched):
+        """Recount the given (kind, value) identities through their indexes"""
+        for kind, value in touched:
+            column = IDENTITY_COLUMNS[kind]
+            cursor.execute(f'SELECT COUNT(*), COUNT(DISTINCT location_id) FROM contacts WHERE {column} = ?', (value,))
+            contacts, locations = cursor.fetchone()
+            if contacts > 1:
+                cursor.execute('''
+                    INSERT INTO contact_identities (kind, value, contacts, locations) VALUES (?, ?, ?, ?)
+                    ON CONFLICT(kind, value) DO UPDATE SET contacts = excluded.contacts, locations = excluded.locations
+                ''', (kind, value, contacts, locations))
+            else:
+                cursor.execute('DELETE FROM contact_identities WHERE kind = ? AND value = ?', (kind, value))
+    
+    def init_shard(self, path):
+        conn = sqlite3.connect(path, timeout=30)
+        cursor = conn.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        self.init_contacts_schema(cursor)
+        conn.commit()
+        conn.close()
+    
+    def init_database(self):
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        # WAL lets the sync worker write while dashboards read
+        cursor.execute('PRAGMA journal_mode=WAL')
+        
+        self.init_contacts_schema(cursor)
         
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS locations (
@@ -64,9 +1708,13 @@ class DebugLeadAnalytics:
                 location_name TEXT NOT NULL,
                 company_id TEXT,
                 is_active BOOLEAN DEFAULT TRUE,
-                last_synced DATETIME DEFAULT CURRENT_TIMESTAMP
+                last_synced DATETIME DEFAULT CURRENT_TIMESTAMP,
+                timezone TEXT
             )
         ''')
+        cursor.execute('PRAGMA table_info(locations)')
+        if 'timezone' not in {row[1] for row in cursor.fetchall()}:
+            cursor.execute('ALTER TABLE locations ADD COLUMN timezone TEXT')
         
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS oauth_tokens (
@@ -81,6 +1729,11 @@ class DebugLeadAnalytics:
             )
         ''')
         
+        # One row per installation: agency installs are keyed by company, sub-account installs by location
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_oauth_tokens_company ON oauth_tokens(company_id, created_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_oauth_tokens_location ON oauth_tokens(location_id, created_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_locations_company ON locations(company_id)')
+        
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS api_debug_log (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -94,9 +1747,74 @@ class DebugLeadAnalytics:
             )
         ''')
         
+        # Background sync state, one row per location. Times are unix epochs.
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sync_schedule (
+                location_id TEXT PRIMARY KEY,
+                next_run_at REAL NOT NULL DEFAULT 0,
+                last_started_at REAL,
+                last_finished_at REAL,
+                last_status TEXT,
+                last_error TEXT,
+                consecutive_failures INTEGER DEFAULT 0,
+                lead_rate REAL DEFAULT 0,
+                cursor_start_after TEXT,
+                cursor_start_after_id TEXT,
+                lease_owner TEXT,
+                lease_expires_at REAL,
+                last_reconciled_at REAL
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_sync_schedule_next_run ON sync_schedule(next_run_at)')
+        cursor.execute('PRAGMA table_info(sync_schedule)')
+        if 'last_reconciled_at' not in {row[1] for row in cursor.fetchall()}:
+            cursor.execute('ALTER TABLE sync_schedule ADD COLUMN last_reconciled_at REAL')
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                payload TEXT,
+                status TEXT NOT NULL DEFAULT 'queued',
+                result TEXT,
+                error TEXT,
+                attempts INTEGER DEFAULT 0,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                lease_owner TEXT,
+                lease_expires_at REAL
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs(status, created_at)')
+        
         conn.commit()
         conn.close()
-        print("✅ Debug database initialized")
+        log.info('database_initialized', db_path=self.db_path)
+    
+    def connect(self):
+        """Connection for code that may run alongside the sync worker"""
+        return sqlite3.connect(self.db_path, timeout=30)
+    
+    def connect_location(self, location_id, write=False):
+        """Connection to the shard holding location_id's contacts
+        
+        Writers pass write=True, which raises UnresolvedLocationError while the
+        location's company is unknown in sharded mode.
+        """
+        path = self.shards.path_for_write(location_id) if write else self.shards.path_for_location(location_id)
+        return self.shards.connect(path)
+    
+    def query(self, cursor, name, sql, params=()):
+        """Run a named query and fetch all rows, recording its latency under `name`"""
+        started = time.perf_counter()
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+        elapsed = time.perf_counter() - started
+        
+        metrics.observe('sqlite_query_duration_seconds', elapsed, query=name)
+        record_span('db', name, elapsed)
+        return rows
     
     def log_api_call(self, endpoint, method, status_code, request_data=None, response_data=None, error_message=None):
         """Log all API calls for debugging"""
@@ -119,8 +1837,7 @@ class DebugLeadAnalytics:
     
     def test_direct_contacts_with_current_token(self, access_token, location_id):
         """Test contacts API directly with current token (might already be location token)"""
-        print(f"🧪 TESTING CONTACTS API WITH CURRENT TOKEN")
-        print(f"📍 Location: {location_id}")
+        log.info('diagnostic_current_token_started', location_id=location_id)
         
         # Test different approaches with current token
         test_approaches = [
@@ -146,49 +1863,35 @@ class DebugLeadAnalytics:
             }
         ]
         
-        for approach in test_approaches:
-            try:
-                url = "https://services.leadconnectorhq.com/contacts/"
-                print(f"\n📡 Testing: {approach['name']}")
-                
-                resp = requests.get(url, headers=approach['headers'], params=approach['params'])
-                print(f"📊 Status: {resp.status_code}")
+        def probe(approach):
+            resp = ghl_request('GET', '/contacts/', retries=0, headers=approach['headers'],
+                               params=approach['params'], timeout=PROBE_TIMEOUT)
+            log.debug('diagnostic_probe', approach=approach['name'], status=resp.status_code)
+            if resp.status_code != 200:
+                return {"name": approach['name'], "status_code": resp.status_code, "error": resp.text[:200]}
+            return {"name": approach['name'], "status_code": 200, "contacts": resp.json().get('contacts', [])}
+        
+        # First approach (in listed order) that returned contacts wins
+        for result in run_probes(test_approaches, probe):
+            contacts = result.get('contacts')
+            if contacts:
+                log.info('diagnostic_current_token_succeeded', approach=result['name'], contacts=len(contacts))
+                self.add_contacts(contacts, location_id)
                 
-                if resp.status_code == 200:
-                    data = resp.json()
-                    contacts = data.get('contacts', [])
-                    print(f"🎉 SUCCESS: Found {len(contacts)} contacts!")
-                    
-                    if contacts:
-                        print(f"👤 First contact: {contacts[0].get('firstName', '')} {contacts[0].get('lastName', '')}")
-                        
-                        # Save contacts to database
-                        for contact in contacts:
-                            self.add_contact(contact, location_id)
-                        
-                        return {
-                            "success": True,
-                            "approach": approach['name'],
-                            "contacts_found": len(contacts),
-                            "sample_contact": contacts[0],
-                            "all_contacts": contacts
-                        }
-                else:
-                    print(f"❌ Failed: {resp.text[:200]}")
-                    
-            except Exception as e:
-                print(f"💥 Exception: {e}")
+                return {
+                    "success": True,
+                    "approach": result['name'],
+                    "contacts_found": len(contacts),
+                    "sample_contact": contacts[0],
+                    "all_contacts": contacts
+                }
         
         return {"success": False, "message": "All approaches failed"}
     
     def get_location_token(self, agency_access_token, company_id, location_id):
         """Exchange agency token for location-specific token - FIXED"""
-        print(f"🔄 EXCHANGING AGENCY TOKEN FOR LOCATION TOKEN")
-        print(f"📍 Location: {location_id}")
-        print(f"🏢 Company: {company_id}")
-        
         try:
-            url = "https://services.leadconnectorhq.com/oauth/locationToken"
+            url = f"{GHL_API_BASE}/oauth/locationToken"
             headers = {
                 "Authorization": f"Bearer {agency_access_token}",
                 "Version": "2021-07-28",
@@ -200,11 +1903,8 @@ class DebugLeadAnalytics:
                 "locationId": location_id
             }
             
-            print(f"📡 POST {url}")
-            print(f"📋 Data: {data}")
-            
-            resp = requests.post(url, headers=headers, data=data)
-            print(f"📊 Status: {resp.status_code}")
+            resp = ghl_request('POST', url, headers=headers, data=data)
+            log.info('location_token_exchange', location_id=location_id, company_id=company_id, status=resp.status_code)
             
             self.log_api_call(url, "POST", resp.status_code, data, resp.text[:500])
             
@@ -212,10 +1912,8 @@ class DebugLeadAnalytics:
             if resp.status_code in [200, 201]:
                 try:
                     token_data = resp.json()
-                    print(f"✅ SUCCESS: Got location token")
-                    print(f"🔑 Token: {token_data.get('access_token', '')[:20]}...")
-                    print(f"📝 Scopes: {token_data.get('scope', 'Unknown')}")
-                    print(f"⏰ Expires in: {token_data.get('expires_in', 'Unknown')} seconds")
+                    log.debug('location_token_received', location_id=location_id,
+                              scope=token_data.get('scope'), expires_in=token_data.get('expires_in'))
                     
                     return {
                         "success": True,
@@ -235,7 +1933,7 @@ class DebugLeadAnalytics:
                         "raw_response": resp.text
                     }
             else:
-                print(f"❌ Failed: {resp.text}")
+                log.warning('location_token_failed', location_id=location_id, status=resp.status_code, body=resp.text[:200])
                 return {
                     "success": False,
                     "error": resp.text,
@@ -243,7 +1941,7 @@ class DebugLeadAnalytics:
                 }
                 
         except Exception as e:
-            print(f"💥 Exception: {e}")
+            log.error('location_token_error', location_id=location_id, error=str(e))
             return {
                 "success": False,
                 "error": str(e)
@@ -251,8 +1949,6 @@ class DebugLeadAnalytics:
     
     def test_with_location_token(self, agency_access_token, company_id, location_id):
         """Get location token and test contacts API"""
-        print(f"🧪 TESTING CONTACTS API WITH LOCATION TOKEN")
-        
         # Step 1: Get location token
         location_token_result = self.get_location_token(agency_access_token, company_id, location_id)
         
@@ -271,12 +1967,11 @@ class DebugLeadAnalytics:
         }
         
         try:
-            url = "https://services.leadconnectorhq.com/contacts/"
+            url = f"{GHL_API_BASE}/contacts/"
             params = {"locationId": location_id, "limit": 10}
             
-            print(f"📡 Testing contacts API with location token")
-            resp = requests.get(url, headers=headers, params=params)
-            print(f"📊 Contacts API Status: {resp.status_code}")
+            resp = ghl_request('GET', url, headers=headers, params=params)
+            log.info('diagnostic_location_token_contacts', location_id=location_id, status=resp.status_code)
             
             contacts_result = {
                 "status_code": resp.status_code,
@@ -291,15 +1986,12 @@ class DebugLeadAnalytics:
                     "sample_contact": contacts[0] if contacts else None,
                     "response_keys": list(data.keys())
                 })
-                print(f"🎉 SUCCESS: Found {len(contacts)} contacts!")
                 
                 # Save contacts to database
-                for contact in contacts:
-                    self.add_contact(contact, location_id)
+                self.add_contacts(contacts, location_id)
                     
             else:
                 contacts_result["error"] = resp.text
-                print(f"❌ Still failed: {resp.text}")
             
             return {
                 "location_token_exchange": location_token_result,
@@ -314,7 +2006,7 @@ class DebugLeadAnalytics:
     
     def test_location_specific_auth(self, access_token, location_id):
         """Test if we need location-specific authentication"""
-        print(f"🔍 TESTING LOCATION-SPECIFIC AUTH for {location_id}")
+        log.info('diagnostic_location_auth_started', location_id=location_id)
         
         # Try different approaches with the location
         location_tests = [
@@ -346,128 +2038,114 @@ class DebugLeadAnalytics:
             }
         ]
         
-        results = []
-        
-        for test in location_tests:
-            try:
-                resp = requests.get(
-                    "https://services.leadconnectorhq.com/contacts/",
-                    headers=test['headers'],
-                    params=test['params']
-                )
-                
-                result = {
-                    "test_name": test['name'],
-                    "status_code": resp.status_code,
-                    "response_preview": resp.text[:200],
-                    "success": resp.status_code == 200
-                }
-                
-                if resp.status_code == 200:
-                    data = resp.json()
-                    result["contacts_found"] = len(data.get('contacts', []))
-                
-                results.append(result)
-                print(f"{test['name']}: {resp.status_code}")
-                
-            except Exception as e:
-                results.append({
-                    "test_name": test['name'],
-                    "error": str(e)
-                })
+        def probe(test):
+            resp = ghl_request('GET', '/contacts/', retries=0, headers=test['headers'],
+                               params=test['params'], timeout=PROBE_TIMEOUT)
+            
+            result = {
+                "test_name": test['name'],
+                "status_code": resp.status_code,
+                "response_preview": resp.text[:200],
+                "success": resp.status_code == 200
+            }
+            
+            if resp.status_code == 200:
+                data = resp.json()
+                result["contacts_found"] = len(data.get('contacts', []))
+            
+            log.debug('diagnostic_probe', approach=test['name'], status=resp.status_code)
+            return result
         
-        return results
+        return run_probes(location_tests, probe, name_key="test_name")
     
     def debug_locations_api(self, access_token, company_id):
         """Debug the locations API with multiple approaches"""
         headers = {"Authorization": f"Bearer {access_token}", "Version": "2021-04-15"}
         
-        print(f"🔍 DEBUGGING LOCATIONS API for company: {company_id}")
+        log.info('diagnostic_locations_started', company_id=company_id)
         
         # Approach 1: Installed locations
         try:
-            url1 = "https://services.leadconnectorhq.com/oauth/installedLocations"
+            url1 = f"{GHL_API_BASE}/oauth/installedLocations"
             params1 = {"companyId": company_id, "appId": APP_ID, "isInstalled": True}
             
-            print(f"📡 Testing: {url1}")
-            print(f"📋 Params: {params1}")
-            
-            resp1 = requests.get(url1, headers=headers, params=params1)
-            print(f"📊 Response: {resp1.status_code}")
+            resp1 = ghl_request('GET', url1, headers=headers, params=params1)
+            log.debug('diagnostic_probe', approach='installed_locations', status=resp1.status_code)
             
             self.log_api_call(url1, "GET", resp1.status_code, params1, resp1.text[:1000])
             
             if resp1.status_code == 200:
                 data1 = resp1.json()
-                print(f"✅ Installed Locations Found: {len(data1.get('locations', []))}")
-                if data1.get('locations'):
-                    print(f"🏢 First location: {data1['locations'][0].get('name', 'No name')}")
+                log.info('locations_found', approach='installed_locations', locations=len(data1.get('locations', [])))
                 return data1.get('locations', [])
             else:
-                print(f"❌ Installed locations failed: {resp1.text}")
+                log.warning('locations_probe_failed', approach='installed_locations',
+                            status=resp1.status_code, body=resp1.text[:200])
                 
         except Exception as e:
-            print(f"❌ Installed locations error: {e}")
+            log.error('locations_probe_error', approach='installed_locations', error=str(e))
         
         # Approach 2: Direct locations API
         try:
-            url2 = "https://services.leadconnectorhq.com/locations/"
+            url2 = f"{GHL_API_BASE}/locations/"
             params2 = {"companyId": company_id}
             
-            print(f"📡 Testing: {url2}")
-            resp2 = requests.get(url2, headers=headers, params=params2)
-            print(f"📊 Response: {resp2.status_code}")
+            resp2 = ghl_request('GET', url2, headers=headers, params=params2)
+            log.debug('diagnostic_probe', approach='direct_locations', status=resp2.status_code)
             
             self.log_api_call(url2, "GET", resp2.status_code, params2, resp2.text[:1000])
             
             if resp2.status_code == 200:
                 data2 = resp2.json()
                 locations = data2.get('locations', [])
-                print(f"✅ Direct Locations Found: {len(locations)}")
+                log.info('locations_found', approach='direct_locations', locations=len(locations))
                 return locations
             else:
-                print(f"❌ Direct locations failed: {resp2.text}")
+                log.warning('locations_probe_failed', approach='direct_locations',
+                            status=resp2.status_code, body=resp2.text[:200])
                 
         except Exception as e:
-            print(f"❌ Direct locations error: {e}")
+            log.error('locations_probe_error', approach='direct_locations', error=str(e))
         
         return []
     
     def debug_contacts_api(self, access_token, location_id):
-        """Enhanced debug using CORRECT GHL API version and endpoints"""
-        print(f"🔍 TESTING CORRECT GHL API APPROACHES for location: {location_id}")
+        """Enhanced debug using CORRECT GHL API version and endpoints
         
-        all_results = []
+        All approaches are probed concurrently. Returns (contacts, results), where
+        contacts come from the first approach in listed order that found any.
+        """
+        log.info('diagnostic_contacts_started', location_id=location_id)
         
         # Based on GHL documentation - test the RIGHT endpoints
         test_approaches = [
             {
                 "name": "GHL Contacts List API v2021-07-28",
-                "url": "https://services.leadconnectorhq.com/contacts/",
+                "url": f"{GHL_API_BASE}/contacts/",
                 "headers": {"Authorization": f"Bearer {access_token}", "Version": "2021-07-28"},
                 "params": {"locationId": location_id, "limit": 25}
             },
             {
                 "name": "GHL Contacts Search v2021-07-28",
-                "url": "https://services.leadconnectorhq.com/contacts/search",
+                "url": f"{GHL_API_BASE}/contacts/search",
                 "headers": {"Authorization": f"Bearer {access_token}", "Version": "2021-07-28"},
                 "params": {"locationId": location_id, "limit": 25}
             },
             {
                 "name": "GHL Location Contacts v2021-07-28",
-                "url": f"https://services.leadconnectorhq.com/locations/{location_id}/contacts",
+                "url": f"{GHL_API_BASE}/locations/{location_id}/contacts",
                 "headers": {"Authorization": f"Bearer {access_token}", "Version": "2021-07-28"},
                 "params": {"limit": 25}
             },
             {
                 "name": "GHL Contacts with startAfter v2021-07-28",
-                "url": "https://services.leadconnectorhq.com/contacts/",
+                "url": f"{GHL_API_BASE}/contacts/",
                 "headers": {"Authorization": f"Bearer {access_token}", "Version": "2021-07-28"},
                 "params": {"locationId": location_id, "limit": 25, "startAfter": ""}
             },
             {
                 "name": "GHL All Contacts (no location filter)",
-                "url": "https://services.leadconnectorhq.com/contacts/",
+                "url": f"{GHL_API_BASE}/contacts/",
                 "headers": {"Authorization": f"Bearer {access_token}", "Version": "2021-07-28"},
                 "params": {"limit": 10}
             },
@@ -479,235 +2157,1197 @@ class DebugLeadAnalytics:
             },
             {
                 "name": "Alternative Services Endpoint",
-                "url": "https://services.leadconnectorhq.com/contacts/",
+                "url": f"{GHL_API_BASE}/contacts/",
                 "headers": {"Authorization": f"Bearer {access_token}", "Version": "2021-07-28"},
                 "params": {"location_id": location_id, "limit": 25}  # Different param name
             }
         ]
         
-        for i, approach in enumerate(test_approaches, 1):
+        def probe(approach):
             try:
-                print(f"\n📡 TEST {i}: {approach['name']}")
-                print(f"🔗 URL: {approach['url']}")
-                print(f"📋 Headers: {approach['headers']}")
-                print(f"📋 Params: {approach['params']}")
-                
-                resp = requests.get(approach['url'], headers=approach['headers'], params=approach['params'])
-                print(f"📊 Status Code: {resp.status_code}")
-                print(f"📄 Response Headers: {dict(resp.headers)}")
-                
-                result = {
+                resp = ghl_request('GET', approach['url'], retries=0, headers=approach['headers'],
+                                   params=approach['params'], timeout=PROBE_TIMEOUT)
+            except requests.exceptions.RequestException as e:
+                log.warning('diagnostic_probe_network_error', approach=approach['name'], error=str(e))
+                return {
                     "approach": approach['name'],
-                    "status_code": resp.status_code,
-                    "url": approach['url'],
-                    "params": approach['params'],
-                    "response_headers": dict(resp.headers)
+                    "error": f"Network error: {str(e)}",
+                    "exception_type": "RequestException"
                 }
+            
+            log.debug('diagnostic_probe', approach=approach['name'], status=resp.status_code)
+            self.log_api_call(approach['url'], "GET", resp.status_code, approach['params'], resp.text[:1000])
+            
+            result = {
+                "approach": approach['name'],
+                "status_code": resp.status_code,
+                "url": approach['url'],
+                "params": approach['params'],
+                "response_headers": dict(resp.headers)
+            }
+            
+            if resp.status_code == 200:
+                try:
+                    data = resp.json()
+                except json.JSONDecodeError as e:
+                    result["error"] = f"Invalid JSON response: {str(e)}"
+                    result["raw_response"] = resp.text[:500]
+                    return result
                 
-                if resp.status_code == 200:
-                    try:
-                        data = resp.json()
-                        print(f"📦 Response Keys: {list(data.keys())}")
-                        
-                        # Handle different response structures
-                        contacts = []
-                        if 'contacts' in data:
-                            contacts = data['contacts']
-                        elif 'data' in data:
-                            contacts = data['data']
-                        elif isinstance(data, list):
-                            contacts = data
-                        
-                        result.update({
-                            "contacts_found": len(contacts),
-                            "response_structure": {
-                                "keys": list(data.keys()),
-                                "contacts_key_exists": 'contacts' in data,
-                                "data_key_exists": 'data' in data,
-                                "is_array": isinstance(data, list),
-                                "total_from_meta": data.get('meta', {}).get('total', 'unknown'),
-                                "count_field": data.get('count', data.get('total', 'none'))
-                            },
-                            "sample_contact": contacts[0] if contacts else None,
-                            "raw_response_preview": str(data)[:500] + "..." if len(str(data)) > 500 else data
-                        })
-                        
-                        print(f"✅ FOUND {len(contacts)} CONTACTS!")
-                        if contacts:
-                            first = contacts[0]
-                            print(f"👤 First contact: {first.get('firstName', first.get('name', ''))} {first.get('lastName', '')} ({first.get('id', 'no-id')})")
-                            print(f"📧 Email: {first.get('email', 'no-email')}")
-                            print(f"📱 Phone: {first.get('phone', 'no-phone')}")
-                            
-                            # Save a few contacts for testing
-                            for contact in contacts[:3]:
-                                self.add_contact(contact, location_id)
-                            
-                            all_results.append(result)
-                            self.last_debug_results = all_results
-                            return contacts
-                        else:
-                            print(f"📭 Empty response structure: {data}")
-                            
-                    except json.JSONDecodeError as e:
-                        result["error"] = f"Invalid JSON response: {str(e)}"
-                        result["raw_response"] = resp.text[:500]
-                        print(f"❌ JSON Error: {e}")
-                        print(f"Raw response: {resp.text[:200]}...")
-                        
-                elif resp.status_code == 401:
-                    result["error"] = "Unauthorized - Check token and permissions"
-                    result["response_text"] = resp.text
-                    print(f"🔐 UNAUTHORIZED: {resp.text}")
-                    
-                elif resp.status_code == 403:
-                    result["error"] = "Forbidden - Need contacts.readonly scope"
-                    result["response_text"] = resp.text
-                    print(f"🚫 FORBIDDEN: {resp.text}")
-                    
-                elif resp.status_code == 422:
-                    result["error"] = "Unprocessable Entity - Check parameters"
-                    result["response_text"] = resp.text
-                    print(f"⚠️ UNPROCESSABLE: {resp.text}")
-                    
-                else:
-                    result["error"] = f"HTTP {resp.status_code}"
-                    result["response_text"] = resp.text
-                    print(f"❌ ERROR {resp.status_code}: {resp.text[:200]}...")
+                # Handle different response structures
+                contacts = []
+                if isinstance(data, list):
+                    contacts = data
+                elif 'contacts' in data:
+                    contacts = data['contacts']
+                elif 'data' in data:
+                    contacts = data['data']
                 
-                all_results.append(result)
-                self.log_api_call(approach['url'], "GET", resp.status_code, approach['params'], resp.text[:1000])
+                result.update({
+                    "contacts_found": len(contacts),
+                    "response_structure": {
+                        "keys": list(data.keys()) if isinstance(data, dict) else [],
+                        "contacts_key_exists": 'contacts' in data,
+                        "data_key_exists": 'data' in data,
+                        "is_array": isinstance(data, list),
+                        "total_from_meta": data.get('meta', {}).get('total', 'unknown') if isinstance(data, dict) else 'unknown',
+                        "count_field": data.get('count', data.get('total', 'none')) if isinstance(data, dict) else 'none'
+                    },
+                    "sample_contact": contacts[0] if contacts else None,
+                    "raw_response_preview": str(data)[:500] + "..." if len(str(data)) > 500 else data
+                })
+                # Not part of the reported result; popped before returning
+                result["_contacts"] = contacts
                 
-                time.sleep(0.5)  # Longer rate limiting
+            elif resp.status_code == 401:
+                result["error"] = "Unauthorized - Check token and permissions"
+                result["response_text"] = resp.text
                 
-            except requests.exceptions.RequestException as e:
-                error_result = {
-                    "approach": approach['name'],
-                    "error": f"Network error: {str(e)}",
-                    "exception_type": "RequestException"
-                }
-                print(f"🌐 NETWORK ERROR: {e}")
-                all_results.append(error_result)
+            elif resp.status_code == 403:
+                result["error"] = "Forbidden - Need contacts.readonly scope"
+                result["response_text"] = resp.text
                 
-            except Exception as e:
-                error_result = {
-                    "approach": approach['name'],
-                    "error": f"Unexpected error: {str(e)}",
-                    "exception_type": type(e).__name__
-                }
-                print(f"💥 UNEXPECTED ERROR: {e}")
-                all_results.append(error_result)
+            elif resp.status_code == 422:
+                result["error"] = "Unprocessable Entity - Check parameters"
+                result["response_text"] = resp.text
+                
+            else:
+                result["error"] = f"HTTP {resp.status_code}"
+                result["response_text"] = resp.text
+            
+            return result
+        
+        all_results = run_probes(test_approaches, probe, name_key="approach")
+        
+        # First approach (in listed order) that returned contacts wins
+        found = []
+        for result in all_results:
+            contacts = result.pop("_contacts", [])
+            if contacts and not found:
+                found = contacts
+        
+        if found:
+            log.info('diagnostic_contacts_found', location_id=location_id, contacts=len(found),
+                     first_contact_id=found[0].get('id'))
+            
+            # Save a few contacts for testing
+            self.add_contacts(found[:3], location_id)
+            return found, all_results
+        
+        # Either the location has no contacts, they're in another status/stage,
+        # the token lacks scope, or a different kind of auth is needed
+        log.warning('diagnostic_contacts_none', location_id=location_id, approaches=len(test_approaches))
+        
+        return [], all_results
+    
+    def debug_all_locations_contacts(self, access_token, company_id=None, max_parallel_locations=4):
+        """Run the contacts diagnostic for every known location of a company, fanned out in parallel"""
+        locations = self.get_locations(company_id)
+        
+        # Location fan-out gets its own pool so it never waits on its own probes
+        with ThreadPoolExecutor(max_workers=max_parallel_locations, thread_name_prefix='diag') as pool:
+            outcomes = list(pool.map(lambda loc: self.debug_contacts_api(access_token, loc['id']), locations))
+        
+        summaries = []
+        for loc, (contacts, results) in zip(locations, outcomes):
+            summaries.append({
+                'location_id': loc['id'],
+                'location_name': loc['name'],
+                'contacts_found': len(contacts),
+                'successful_approaches': [r['approach'] for r in results if r.get('contacts_found', 0) > 0],
+                'failed_approaches': [r['approach'] for r in results if r.get('status_code', 0) != 200],
+                'detailed_api_tests': results
+            })
+        return summaries
+    
+    def add_contact(self, contact_data, location_id):
+        """Add contact with debug logging"""
+        contact_id = contact_data.get('id')
+        if not contact_id:
+            log.warning('contact_missing_id', location_id=location_id, per_second=1)
+            return False
+        
+        self.add_contacts([contact_data], location_id)
+        
+        log.debug('contact_saved', contact_id=contact_id, location_id=location_id, sample=0.01)
+        return True
+    
+    def add_contacts(self, contacts, location_id):
+        """Upsert a page of contacts in one transaction, returning how many were written
+        
+        Contacts whose content matches the location's fingerprint index are
+        skipped, so an unchanged page costs one generation lookup, not a write.
+        """
+        now = datetime.now()
+        rows = [contact_row(contact_data, location_id, now) for contact_data in contacts if contact_data.get('id')]
+        if not rows:
+            return 0
+        
+        conn = self.connect_location(location_id, write=True)
+        cursor = conn.cursor()
+        generation = self.location_generation(cursor, location_id)
+        index = self.fingerprints.get(location_id, generation, lambda: self.load_fingerprint_rows(cursor, location_id))
+        received = len(rows)
+        if index is not None:
+            fingerprints = [(row, *contact_fingerprint(row[0], row[1:10] + row[11:])) for row in rows]
+            with index.lock:
+                changed = [(row, id_hash, digest) for row, id_hash, digest in fingerprints if index.get(id_hash) != digest]
+            rows = [row for row, _, _ in changed]
+            metrics.inc('ingest_rows_skipped_total', received - len(rows))
+        if not rows:
+            conn.close()
+            log.debug('contacts_unchanged', location_id=location_id, rows=received, sample=0.1)
+            return 0
+        
+        # location_name is left NULL; names are joined at read time via location_directory
+        with metrics.timer('sqlite_query_duration_seconds', query='upsert_contacts'):
+            # Identities whose membership this batch changes: old and new values of
+            # every contact whose phone or email moved (nothing, on a plain resync)
+            previous = {}
+            for start in range(0, len(rows), 500):
+                ids = [row[0] for row in rows[start:start + 500]]
+                cursor.execute(f"SELECT contact_id, phone_e164, email_norm FROM contacts WHERE contact_id IN ({','.join('?' * len(ids))})", ids)
+                previous.update((row[0], row[1:]) for row in cursor.fetchall())
+            touched = set()
+            for row in rows:
+                old_phone, old_email = previous.get(row[0], (None, None))
+                for kind, old, new in (('phone', old_phone, row[11]), ('email', old_email, row[12])):
+                    if old != new or row[0] not in previous:
+                        touched.update((kind, value) for value in (old, new) if value)
+            
+            cursor.executemany(CONTACT_UPSERT_SQL, rows)
+            self.refresh_identities(cursor, touched)
+            self.bump_generation(cursor, location_id)
+            self.prune_changes(cursor)
+            written_generation = self.location_generation(cursor, location_id)
+            
+            conn.commit()
+            conn.close()
+        
+        if index is not None:
+            with index.lock:
+                for _, id_hash, digest in changed:
+                    index.set(id_hash, digest)
+            self.fingerprints.advance(location_id, generation, written_generation)
+        
+        metrics.inc('ingest_rows_total', len(rows))
+        log.debug('contacts_upserted', location_id=location_id, rows=len(rows), unchanged=received - len(rows),
+                  skipped=len(contacts) - received)
+        return len(rows)
+    
+    def location_generation(self, cursor, location_id):
+        rows = self.query(cursor, 'generation', 'SELECT generation FROM contact_generations WHERE location_id = ?', (location_id,))
+        return rows[0][0] if rows else 0
+    
+    def load_fingerprint_rows(self, cursor, location_id):
+        """(contact_id, content) for every stored contact of a location, in the shape add_contacts hashes"""
+        cursor.execute(f"SELECT contact_id, {', '.join(CONTACT_CONTENT_COLUMNS)} FROM contacts WHERE location_id = ?",
+                       (location_id,))
+        while True:
+            batch = cursor.fetchmany(10000)
+            if not batch:
+                return
+            for row in batch:
+                yield row[0], row[1:]
+    
+    def iter_contact_pages(self, access_token, location_id, cursor=None):
+        """Yield (contacts, cursor) for each page of a location's contacts after a (startAfter, startAfterId) cursor"""
+        headers = {"Authorization": f"Bearer {access_token}", "Version": GHL_API_VERSION}
+        start_after, start_after_id = cursor or (None, None)
+        
+        while True:
+            params = {"locationId": location_id, "limit": SYNC_PAGE_SIZE}
+            if start_after_id:
+                params["startAfter"] = start_after
+                params["startAfterId"] = start_after_id
+            
+            resp = ghl_request('GET', '/contacts/', headers=headers, params=params)
+            if resp.status_code != 200:
+                self.log_api_call(f"{GHL_API_BASE}/contacts/", "GET", resp.status_code, params, resp.text[:1000])
+                raise GHLSyncError(f"HTTP {resp.status_code}: {resp.text[:200]}")
+            
+            data = resp.json()
+            contacts = data.get('contacts', [])
+            if not contacts:
+                return
+            
+            meta = data.get('meta', {})
+            if meta.get('startAfterId'):
+                start_after, start_after_id = meta.get('startAfter'), meta.get('startAfterId')
+            else:
+                last = contacts[-1]
+                start_after, start_after_id = last.get('dateAdded'), last.get('id')
+            
+            yield contacts, (start_after, start_after_id)
+            
+            if len(contacts) < SYNC_PAGE_SIZE:
+                return
+    
+    def sync_location_contacts(self, access_token, location_id, cursor=None, on_page=None):
+        """Page through a location's contacts from a (startAfter, startAfterId) high-water mark
+        
+        Returns (contacts_written, cursor). on_page is called with the new cursor after
+        every committed page so an interrupted sync can resume from there. Edits to
+        contacts behind the cursor come in with reconcile_location_contacts.
+        """
+        written = 0
+        for contacts, cursor in self.iter_contact_pages(access_token, location_id, cursor):
+            written += self.add_contacts(contacts, location_id)
+            if on_page:
+                on_page(cursor)
+        
+        return written, cursor or (None, None)
+    
+    def iter_conversation_pages(self, access_token, location_id, after_ms=None):
+        """Yield pages of a location's conversations, oldest last message first, after a last-message time"""
+        headers = {"Authorization": f"Bearer {access_token}", "Version": GHL_CONVERSATIONS_VERSION}
+        
+        while True:
+            params = {"locationId": location_id, "limit": CONVERSATION_PAGE_SIZE,
+                      "sort": "asc", "sortBy": "last_message_date"}
+            if after_ms:
+                params["startAfterDate"] = after_ms
+            
+            resp = ghl_request('GET', '/conversations/search', headers=headers, params=params)
+            if resp.status_code != 200:
+                self.log_api_call(f"{GHL_API_BASE}/conversations/search", "GET", resp.status_code, params, resp.text[:1000])
+                raise GHLSyncError(f"HTTP {resp.status_code}: {resp.text[:200]}")
+            
+            conversations = resp.json().get('conversations', [])
+            if not conversations:
+                return
+            yield conversations
+            
+            last_ms = conversations[-1].get('lastMessageDate')
+            if len(conversations) < CONVERSATION_PAGE_SIZE or not last_ms or last_ms == after_ms:
+                return
+            after_ms = last_ms
+    
+    def iter_message_pages(self, access_token, conversation_id, location_id=None):
+        """Yield pages of a conversation's messages, newest first"""
+        headers = {"Authorization": f"Bearer {access_token}", "Version": GHL_CONVERSATIONS_VERSION}
+        last_message_id = None
+        
+        while True:
+            params = {"limit": MESSAGE_PAGE_SIZE}
+            if last_message_id:
+                params["lastMessageId"] = last_message_id
+            
+            resp = ghl_request('GET', f'/conversations/{conversation_id}/messages', tenant=location_id,
+                               headers=headers, params=params)
+            if resp.status_code != 200:
+                raise GHLSyncError(f"HTTP {resp.status_code}: {resp.text[:200]}")
+            
+            page = resp.json().get('messages', {})
+            messages = page.get('messages', [])
+            if messages:
+                yield messages
+            if not messages or not page.get('nextPage') or not page.get('lastMessageId'):
+                return
+            last_message_id = page['lastMessageId']
+    
+    def sync_location_conversations(self, access_token, location_id, on_page=None):
+        """Fetch messages for every conversation with activity since the last run, returning messages stored
+        
+        The high-water mark is the newest last_message_ms already stored for the
+        location. Conversations come oldest-first and each one's new messages are
+        stored together with its conversation row, so an interrupted run resumes
+        cleanly. A conversation's messages are paged newest-first only until a
+        page reaches one already stored. on_page is called after every commit.
+        """
+        conn = self.connect_location(location_id, write=True)
+        cursor = conn.cursor()
+        rows = self.query(cursor, 'conversations_high_water',
+                          'SELECT MAX(last_message_ms) FROM conversations WHERE location_id = ?', (location_id,))
+        after_ms = rows[0][0]
+        stored = 0
+        
+        for conversations in self.iter_conversation_pages(access_token, location_id, after_ms):
+            for conversation in conversations:
+                if not conversation.get('id') or not conversation.get('lastMessageDate'):
+                    continue
+                new_messages = []
+                for page in self.iter_message_pages(access_token, conversation['id'], location_id):
+                    ids = [m['id'] for m in page if m.get('id')]
+                    cursor.execute(f"SELECT message_id FROM messages WHERE message_id IN ({','.join('?' * len(ids))})", ids)
+                    known = {row[0] for row in cursor.fetchall()}
+                    new_messages.extend(m for m in page if m.get('id') and m['id'] not in known)
+                    if known:
+                        break
+                
+                rows = []
+                for message in new_messages:
+                    date_ts = parse_timestamp(message.get('dateAdded'))
+                    contact_id = message.get('contactId') or conversation.get('contactId')
+                    if date_ts is None or not contact_id:
+                        continue
+                    rows.append((message['id'], contact_id, date_ts, conversation['id'], location_id,
+                                 MESSAGE_DIRECTIONS.get(message.get('direction'), 0),
+                                 message_channel(message.get('messageType'))))
+                # Oldest first, so activity timestamps only ever move forward
+                rows.sort(key=lambda row: row[2])
+                
+                cursor.executemany('''
+                    INSERT OR IGNORE INTO messages
+                    (message_id, contact_id, date_ts, conversation_id, location_id, direction, channel)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', rows)
+                stored += cursor.rowcount if cursor.rowcount > 0 else 0
+                cursor.execute('''
+                    INSERT INTO conversations (conversation_id, location_id, contact_id, channel, last_message_ms)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(conversation_id) DO UPDATE SET
+                        contact_id = excluded.contact_id, channel = excluded.channel,
+                        last_message_ms = excluded.last_message_ms
+                ''', (conversation['id'], location_id, conversation.get('contactId'),
+                      message_channel(conversation.get('lastMessageType')), conversation['lastMessageDate']))
+                conn.commit()
+                if on_page:
+                    on_page()
+        
+        conn.close()
+        if stored:
+            log.info('conversations_synced', location_id=location_id, messages=stored)
+        return stored
+    
+    def activity_summary(self, location_id):
+        """Reply-status counts for a location, answered from contact_activity alone"""
+        conn = self.connect_location(location_id)
+        cursor = conn.cursor()
+        now = int(time.time())
+        rows = self.query(cursor, 'activity_summary', '''
+            SELECT COUNT(*),
+                   SUM(last_inbound_ts > coalesce(last_outbound_ts, 0)),
+                   MIN(CASE WHEN last_inbound_ts > coalesce(last_outbound_ts, 0) THEN last_inbound_ts END),
+                   SUM(last_inbound_ts >= ?), SUM(last_outbound_ts >= ?),
+                   SUM(inbound_messages), SUM(outbound_messages)
+            FROM contact_activity WHERE location_id = ?
+        ''', (now - 86400, now - 86400, location_id))
+        conn.close()
+        
+        contacts, awaiting, oldest, inbound_24h, outbound_24h, inbound, outbound = rows[0]
+        return {
+            'location_id': location_id,
+            'contacts_with_messages': contacts,
+            'awaiting_reply': awaiting or 0,
+            'oldest_unanswered_at': datetime.fromtimestamp(oldest, timezone.utc).isoformat() if oldest else None,
+            'contacts_inbound_24h': inbound_24h or 0,
+            'contacts_outbound_24h': outbound_24h or 0,
+            'inbound_messages': inbound or 0,
+            'outbound_messages': outbound or 0
+        }
+    
+    def iter_task_pages(self, access_token, location_id, completed=False):
+        """Yield (tasks, total) pages of a location's tasks, open ones only by default
+        
+        total is the count the search reports for the whole listing, or None.
+        """
+        headers = {"Authorization": f"Bearer {access_token}", "Version": GHL_API_VERSION}
+        skip = 0
+        
+        while True:
+            body = {"completed": completed, "limit": TASK_PAGE_SIZE, "skip": skip}
+            resp = ghl_request('POST', f'/locations/{location_id}/tasks/search', tenant=location_id,
+                               headers=headers, json=body)
+            if resp.status_code not in (200, 201):
+                self.log_api_call(f"{GHL_API_BASE}/locations/{location_id}/tasks/search", "POST",
+                                  resp.status_code, body, resp.text[:1000])
+                raise GHLSyncError(f"HTTP {resp.status_code}: {resp.text[:200]}")
+            
+            data = resp.json()
+            tasks = data.get('tasks', [])
+            if tasks:
+                yield tasks, data.get('total', data.get('meta', {}).get('total'))
+            if len(tasks) < TASK_PAGE_SIZE:
+                return
+            skip += len(tasks)
+    
+    def sync_location_tasks(self, access_token, location_id, force=False, on_page=None):
+        """Refresh a location's open tasks, at most once per TASK_SYNC_INTERVAL; returns the summary or None
         
-        print(f"\n❌ ALL {len(test_approaches)} APPROACHES RETURNED 0 CONTACTS")
-        print("🤔 This suggests either:")
-        print("   1. The location truly has no contacts")
-        print("   2. Contacts are in a different status/stage")
-        print("   3. Permission/scope issue")
-        print("   4. Different API authentication needed")
+        Only the open list is downloaded. Tasks stored as open that are missing from
+        it have been completed or deleted in GHL and are closed locally, so task
+        history is never fetched again and the open-task index stays small. Each
+        page is committed (open_task_ids is a temp table, so it outlives the
+        commits) and followed by on_page.
         
-        self.last_debug_results = all_results
-        return []
+        The search pages by offset, so a task completed mid-listing shifts the
+        rest forward and one open task can be skipped. A pass is trusted when it
+        returned as many distinct tasks as the search reports; otherwise it is
+        rerun, and if no pass of TASK_SYNC_PASSES matches, nothing is closed this
+        time. Without a reported total every pass runs, and only tasks that all
+        of them missed are closed.
+        """
+        conn = self.connect_location(location_id, write=True)
+        cursor = conn.cursor()
+        now = time.time()
+        rows = self.query(cursor, 'task_sync_due', 'SELECT synced_at FROM task_syncs WHERE location_id = ?', (location_id,))
+        if rows and rows[0][0] > now - TASK_SYNC_INTERVAL and not force:
+            conn.close()
+            return None
+        
+        cursor.execute('CREATE TEMP TABLE IF NOT EXISTS open_task_ids (task_id TEXT PRIMARY KEY) WITHOUT ROWID')
+        cursor.execute('DELETE FROM open_task_ids')
+        for attempt in range(TASK_SYNC_PASSES):
+            seen, total = set(), None
+            for tasks, page_total in self.iter_task_pages(access_token, location_id):
+                total = page_total if total is None else total
+                seen.update(self.store_task_page(cursor, location_id, tasks, now))
+                conn.commit()
+                if on_page:
+                    on_page()
+            if total is not None and len(seen) >= total:
+                complete = True
+                break
+        else:
+            complete = total is None
+            if not complete:
+                log.warning('tasks_listing_incomplete', location_id=location_id, seen=len(seen), total=total,
+                            passes=TASK_SYNC_PASSES)
+        fetched = len(seen)
+        
+        closed = 0
+        if complete:
+            cursor.execute('''
+                UPDATE tasks SET completed = 1, updated_at = ?
+                WHERE location_id = ? AND completed = 0 AND task_id NOT IN (SELECT task_id FROM open_task_ids)
+            ''', (now, location_id))
+            closed = cursor.rowcount
+        cursor.execute('''
+            INSERT INTO task_syncs (location_id, synced_at) VALUES (?, ?)
+            ON CONFLICT(location_id) DO UPDATE SET synced_at = excluded.synced_at
+        ''', (location_id, now))
+        cursor.execute('DROP TABLE open_task_ids')
+        conn.commit()
+        conn.close()
+        
+        log.info('tasks_synced', location_id=location_id, open=fetched, closed=closed, passes=attempt + 1)
+        return {'location_id': location_id, 'open': fetched, 'closed': closed}
     
-    def add_contact(self, contact_data, location_id):
-        """Add contact with debug logging"""
-        contact_id = contact_data.get('id')
-        if not contact_id:
-            print("❌ No contact ID found in data")
-            return False
+    def store_task_page(self, cursor, location_id, tasks, now):
+        """Upsert one page of open tasks and mark them seen in open_task_ids; returns their ids"""
+        rows = [(
+            task.get('id') or task['_id'], location_id, task.get('contactId'), task.get('title'),
+            task.get('assignedTo'), parse_timestamp(task.get('dueDate')), int(bool(task.get('completed'))), now
+        ) for task in tasks if task.get('id') or task.get('_id')]
+        cursor.executemany('''
+            INSERT INTO tasks (task_id, location_id, contact_id, title, assigned_to, due_ts, completed, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(task_id) DO UPDATE SET
+                location_id = excluded.location_id, contact_id = excluded.contact_id, title = excluded.title,
+                assigned_to = excluded.assigned_to, due_ts = excluded.due_ts,
+                completed = excluded.completed, updated_at = excluded.updated_at
+        ''', rows)
+        cursor.executemany('INSERT OR IGNORE INTO open_task_ids (task_id) VALUES (?)', [(row[0],) for row in rows])
+        return [row[0] for row in rows]
+    
+    def overdue_tasks(self, location_id, after=None, limit=TASKS_DEFAULT_LIMIT):
+        """Open tasks past due, oldest due first, from the open-task index
         
-        print(f"💾 Adding contact: {contact_data.get('firstName', '')} {contact_data.get('lastName', '')} ({contact_id})")
+        Keyset paged on (due_ts, task_id): `after` is the previous page's last
+        pair, so each page is one index range scan however deep it is.
+        """
+        conn = self.connect_location(location_id)
+        cursor = conn.cursor()
+        after_due, after_id = after or (None, '')
+        rows = self.query(cursor, 'tasks_overdue', '''
+            SELECT t.task_id, t.title, t.due_ts, t.assigned_to, t.contact_id, c.first_name, c.last_name
+            FROM tasks t LEFT JOIN contacts c ON c.contact_id = t.contact_id
+            WHERE t.location_id = ? AND t.completed = 0 AND t.due_ts < ?
+              AND (t.due_ts, t.task_id) > (?, ?)
+            ORDER BY t.due_ts, t.task_id LIMIT ?
+        ''', (location_id, int(time.time()), after_due if after_due is not None else -1, after_id, limit))
+        synced = self.query(cursor, 'task_sync_due', 'SELECT synced_at FROM task_syncs WHERE location_id = ?', (location_id,))
+        conn.close()
         
-        conn = sqlite3.connect(self.db_path)
+        now = time.time()
+        return [{
+            'task_id': task_id,
+            'title': title,
+            'due_at': datetime.fromtimestamp(due_ts, timezone.utc).isoformat(),
+            'days_overdue': round((now - due_ts) / 86400, 1),
+            'assigned_to': assigned_to,
+            'contact_id': contact_id,
+            'contact_name': ' '.join(filter(None, (first_name, last_name))) or None,
+            'cursor': f"{due_ts}:{task_id}"
+        } for task_id, title, due_ts, assigned_to, contact_id, first_name, last_name in rows], \
+            (datetime.fromtimestamp(synced[0][0], timezone.utc).isoformat() if synced else None)
+    
+    def import_contacts_csv(self, stream, location_id, defer_indexes=None, on_progress=None):
+        """Stream a GHL contacts CSV export into contacts, returning a summary
+        
+        Rows map exactly as API pages do (csv_contact, contact_row) and are parsed
+        IMPORT_CHUNK_ROWS at a time. When the location's shard holds no other
+        location's contacts (a new agency's shard) and the location's sync lease
+        can be taken, the secondary indexes and the search index are dropped for
+        the load, rows are committed IMPORT_TRANSACTION_ROWS at a time, and
+        indexes, search and identity counts are rebuilt once at the end. The lease
+        keeps the scheduler off the shard until then: it is renewed before each
+        transaction starts (the lease row may live in this same database, so not
+        inside one), and once another worker holds it no further rows are
+        written, the indexes are rebuilt as soon as the lease is back, and the
+        import fails with LeaseLostError. Otherwise each chunk goes
+        through add_contacts. The newest imported contact becomes the sync cursor,
+        so the API sync only fetches what was added after the export.
+        on_progress is called with the running summary after every commit.
+        """
+        reader = csv.DictReader(stream)
+        if 'id' not in {CSV_CONTACT_FIELDS.get((name or '').strip().lower()) for name in reader.fieldnames or []}:
+            raise ValueError('CSV has no Contact Id column')
+        
+        conn = self.connect_location(location_id, write=True)
         cursor = conn.cursor()
+        requested = defer_indexes
+        if defer_indexes is None:
+            cursor.execute('SELECT 1 FROM contacts WHERE location_id != ? LIMIT 1', (location_id,))
+            defer_indexes = cursor.fetchone() is None
+        lease_owner = f"import:{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        if defer_indexes and not self.lease_location(location_id, lease_owner, IMPORT_LEASE_SECONDS):
+            if requested:
+                conn.close()
+                raise ValueError(f'Location {location_id} is being synced; retry later or import without deferring indexes')
+            defer_indexes = False
         
-        cursor.execute('SELECT location_name FROM locations WHERE location_id = ?', (location_id,))
-        loc_result = cursor.fetchone()
-        location_name = loc_result[0] if loc_result else 'Unknown Location'
+        summary = {'location_id': location_id, 'rows_read': 0, 'rows_imported': 0, 'rows_skipped': 0,
+                   'deferred_indexes': defer_indexes}
+        high_water = None
+        started = time.perf_counter()
+        now = datetime.now()
+        uncommitted = 0
+        lease_lost = None
         
-        cursor.execute('''
-            INSERT OR REPLACE INTO contacts 
-            (contact_id, location_id, location_name, first_name, last_name, 
-             email, phone, source, date_added, custom_fields, tags, last_updated)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            contact_id,
-            location_id,
-            location_name,
-            contact_data.get('firstName', ''),
-            contact_data.get('lastName', ''),
-            contact_data.get('email', ''),
-            contact_data.get('phone', ''),
-            contact_data.get('source', ''),
-            contact_data.get('dateAdded', ''),
-            json.dumps(contact_data.get('customFields', [])),
-            json.dumps(contact_data.get('tags', [])),
-            datetime.now()
-        ))
+        def renew_lease():
+            if not self.lease_location(location_id, lease_owner, IMPORT_LEASE_SECONDS):
+                raise LeaseLostError(f"Import lease on {location_id} lost to another worker "
+                                     f"after {summary['rows_imported']} rows; rerun the import")
+        
+        def flush(batch, last=False):
+            nonlocal high_water, uncommitted
+            committed = True
+            if defer_indexes:
+                if not uncommitted:
+                    renew_lease()
+                rows = [contact_row(contact, location_id, now) for contact in batch]
+                cursor.executemany(CONTACT_UPSERT_SQL, rows)
+                uncommitted += len(rows)
+                committed = uncommitted >= IMPORT_TRANSACTION_ROWS or last
+                if committed:
+                    conn.commit()
+                    uncommitted = 0
+            else:
+                self.add_contacts(batch, location_id)
+            for contact in batch:
+                ts = parse_timestamp(contact.get('dateAdded'))
+                if ts is not None and (high_water is None or (ts, contact['id']) > high_water):
+                    high_water = (ts, contact['id'])
+            
+            summary['rows_imported'] += len(batch)
+            summary['rows_per_second'] = round(summary['rows_imported'] / max(time.perf_counter() - started, 1e-9))
+            metrics.inc('ingest_rows_total', len(batch))
+            # Report between transactions: progress writes may need the same database
+            if on_progress and committed:
+                on_progress(dict(summary))
+        
+        try:
+            if defer_indexes:
+                for index in CONTACT_SECONDARY_INDEXES:
+                    cursor.execute(f'DROP INDEX IF EXISTS {index}')
+                # Per-row FTS inserts dominate load time; init_contacts_schema refills it in one pass
+                for trigger in ('contacts_fts_insert', 'contacts_fts_delete', 'contacts_fts_update'):
+                    cursor.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+                cursor.execute('DROP TABLE IF EXISTS contacts_fts')
+                conn.commit()
+            
+            batch = []
+            for record in reader:
+                summary['rows_read'] += 1
+                contact = csv_contact(record)
+                if not contact.get('id'):
+                    summary['rows_skipped'] += 1
+                    continue
+                batch.append(contact)
+                if len(batch) >= IMPORT_CHUNK_ROWS:
+                    flush(batch)
+                    batch = []
+            flush(batch, last=True)
+        except LeaseLostError as e:
+            lease_lost = e
+            raise
+        finally:
+            if defer_indexes:
+                conn.commit()
+                if lease_lost is None:
+                    try:
+                        renew_lease()
+                    except LeaseLostError as e:
+                        lease_lost = e
+                if lease_lost is not None:
+                    log.warning('import_lease_lost', location_id=location_id, error=str(lease_lost))
+                    # The indexes are still dropped; rebuild them under the lease once its holder lets go
+                    deadline = time.monotonic() + IMPORT_LEASE_SECONDS
+                    while not self.lease_location(location_id, lease_owner, IMPORT_LEASE_SECONDS):
+                        if time.monotonic() > deadline:
+                            log.error('import_rebuild_deferred', location_id=location_id)
+                            self.shards.reinitialize(self.shards.path_for_location(location_id))
+                            conn.close()
+                            raise lease_lost
+                        time.sleep(1.0)
+                rebuild_started = time.perf_counter()
+                self.init_contacts_schema(cursor)
+                self.rebuild_identities(cursor)
+                self.bump_generation(cursor, location_id)
+                conn.commit()
+                summary['index_rebuild_seconds'] = round(time.perf_counter() - rebuild_started, 2)
+                self.release_location(location_id, lease_owner)
+            conn.close()
+        if lease_lost is not None:
+            raise lease_lost
         
+        summary['seconds'] = round(time.perf_counter() - started, 2)
+        if high_water:
+            summary['sync_cursor'] = self.advance_sync_cursor(location_id, (high_water[0] * 1000, high_water[1]))
+        log.info('contacts_imported', **summary)
+        return summary
+    
+    def lease_location(self, location_id, owner, seconds):
+        """Take or renew location_id's sync lease for `owner`; False while someone else holds it"""
+        now = time.time()
+        conn = self.connect()
+        conn.execute('INSERT OR IGNORE INTO sync_schedule (location_id, next_run_at) VALUES (?, 0)', (location_id,))
+        leased = conn.execute('''
+            UPDATE sync_schedule SET lease_owner = ?, lease_expires_at = ?
+            WHERE location_id = ? AND (lease_owner = ? OR lease_expires_at IS NULL OR lease_expires_at < ?)
+        ''', (owner, now + seconds, location_id, owner, now)).rowcount
+        conn.commit()
+        conn.close()
+        return bool(leased)
+    
+    def release_location(self, location_id, owner):
+        conn = self.connect()
+        conn.execute('''
+            UPDATE sync_schedule SET lease_owner = NULL, lease_expires_at = NULL
+            WHERE location_id = ? AND lease_owner = ?
+        ''', (location_id, owner))
+        conn.commit()
+        conn.close()
+    
+    def advance_sync_cursor(self, location_id, cursor):
+        """Move a location's saved sync cursor forward to `cursor`, never back; returns the cursor in effect"""
+        conn = self.connect()
+        db_cursor = conn.cursor()
+        db_cursor.execute('INSERT OR IGNORE INTO sync_schedule (location_id, next_run_at) VALUES (?, 0)', (location_id,))
+        db_cursor.execute('SELECT cursor_start_after, cursor_start_after_id FROM sync_schedule WHERE location_id = ?',
+                          (location_id,))
+        current = db_cursor.fetchone()
+        current_ts = parse_timestamp(current[0]) if current[1] else None
+        if current_ts is None or current_ts < cursor[0] // 1000:
+            db_cursor.execute('''
+                UPDATE sync_schedule SET cursor_start_after = ?, cursor_start_after_id = ? WHERE location_id = ?
+            ''', (str(cursor[0]), cursor[1], location_id))
+            current = (str(cursor[0]), cursor[1])
         conn.commit()
         conn.close()
+        return list(current)
+    
+    def reconcile_location_contacts(self, access_token, location_id, force=False):
+        """Delete local contacts that no longer exist in GHL, returning a summary
         
-        print(f"✅ Contact saved to database")
-        return True
+        The scheduled sync's cursor only moves forward, so edits to contacts older
+        than it are picked up here: each page of the full listing also goes through
+        add_contacts, whose fingerprint index skips the unchanged rows. Remote IDs stream into a temp table whose primary key keeps them sorted on
+        disk; one merge pass against the local (location_id, contact_id) index then
+        finds the stale rows, so memory stays flat at any account size. Only rows
+        last written before the remote listing began are candidates, so contacts
+        synced mid-run are never mistaken for deletions. Unless force is set, a run
+        that would remove more than RECONCILE_MAX_DELETE_FRACTION of the location
+        is refused as more likely an API problem than real deletions.
+        """
+        started = datetime.now()
+        conn = self.connect_location(location_id, write=True)
+        conn.execute('CREATE TEMP TABLE IF NOT EXISTS remote_ids (contact_id TEXT PRIMARY KEY) WITHOUT ROWID')
+        conn.execute('CREATE TEMP TABLE IF NOT EXISTS stale_ids (contact_id TEXT PRIMARY KEY) WITHOUT ROWID')
+        
+        try:
+            remote = updated = 0
+            for contacts, _ in self.iter_contact_pages(access_token, location_id):
+                conn.executemany('INSERT OR IGNORE INTO temp.remote_ids VALUES (?)',
+                                 [(c['id'],) for c in contacts if c.get('id')])
+                remote += len(contacts)
+                updated += self.add_contacts(contacts, location_id)
+            conn.commit()
+            
+            local_rows = conn.execute('''
+                SELECT contact_id FROM contacts WHERE location_id = ? AND last_updated < ? ORDER BY contact_id
+            ''', (location_id, started))
+            remote_rows = conn.cursor().execute('SELECT contact_id FROM temp.remote_ids ORDER BY contact_id')
+            stale_rows = sorted_difference((row[0] for row in local_rows), (row[0] for row in remote_rows))
+            
+            # Buffer the stale IDs on disk so no read cursor is open while deleting
+            while True:
+                batch = [(contact_id,) for _, contact_id in zip(range(RECONCILE_BATCH_SIZE), stale_rows)]
+                if not batch:
+                    break
+                conn.executemany('INSERT INTO temp.stale_ids VALUES (?)', batch)
+            conn.commit()
+            
+            local = conn.execute('SELECT COUNT(*) FROM contacts WHERE location_id = ?', (location_id,)).fetchone()[0]
+            stale = conn.execute('SELECT COUNT(*) FROM temp.stale_ids').fetchone()[0]
+            summary = {'location_id': location_id, 'remote_contacts': remote, 'local_contacts': local,
+                       'updated': updated, 'stale_contacts': stale, 'deleted': 0}
+            
+            if stale > local * RECONCILE_MAX_DELETE_FRACTION and not force:
+                log.warning('reconcile_refused', **summary, max_fraction=RECONCILE_MAX_DELETE_FRACTION)
+                return {**summary, 'status': 'refused'}
+            
+            last_id = ''
+            while True:
+                ids = [row[0] for row in conn.execute('''
+                    SELECT contact_id FROM temp.stale_ids WHERE contact_id > ? ORDER BY contact_id LIMIT ?
+                ''', (last_id, RECONCILE_BATCH_SIZE))]
+                if not ids:
+                    break
+                last_id = ids[-1]
+                summary['deleted'] += self.tombstone_contacts(conn, location_id, ids)
+            
+            log.info('reconcile_finished', **summary, seconds=round((datetime.now() - started).total_seconds(), 2))
+            return {**summary, 'status': 'ok'}
+        finally:
+            conn.execute('DROP TABLE IF EXISTS temp.remote_ids')
+            conn.execute('DROP TABLE IF EXISTS temp.stale_ids')
+            conn.close()
+    
+    def tombstone_contacts(self, conn, location_id, contact_ids):
+        """Delete a batch of contacts in one transaction, recording a tombstone for each"""
+        cursor = conn.cursor()
+        placeholders = ','.join('?' * len(contact_ids))
+        
+        cursor.execute(f'SELECT phone_e164, email_norm FROM contacts WHERE contact_id IN ({placeholders})', contact_ids)
+        touched = {(kind, value) for phone, email in cursor.fetchall()
+                   for kind, value in (('phone', phone), ('email', email)) if value}
+        
+        cursor.execute(f'''
+            INSERT OR REPLACE INTO contact_tombstones (contact_id, location_id, deleted_at)
+            SELECT contact_id, location_id, ? FROM contacts WHERE contact_id IN ({placeholders})
+        ''', (time.time(), *contact_ids))
+        cursor.execute(f'DELETE FROM contacts WHERE contact_id IN ({placeholders})', contact_ids)
+        deleted = cursor.rowcount
+        
+        self.refresh_identities(cursor, touched)
+        self.bump_generation(cursor, location_id)
+        conn.commit()
+        return deleted
     
     def get_basic_stats(self, location_id=None):
-        """Get basic stats with debug info"""
-        conn = sqlite3.connect(self.db_path)
+        """Get basic stats with debug info, merged across shards for 'all'
+        
+        Identical concurrent calls (a room full of dashboards opening at once)
+        share one computation instead of each scanning the shards.
+        """
+        key = location_id if location_id and location_id != 'all' else 'all'
+        return self.stats_flight.do(key, lambda: self.compute_basic_stats(location_id))
+    
+    def compute_basic_stats(self, location_id=None):
+        if location_id and location_id != 'all':
+            parts = [self.shard_stats(self.shards.path_for_location(location_id), location_id)]
+        else:
+            parts = self.shards.map(self.shard_stats)
+        
+        totals = {key: sum(part[key] for part in parts) for key in parts[0] if key != 'sample'}
+        total_contacts = totals['total_contacts']
+        
+        # Debug: Show sample contacts
+        sample_contacts = [
+            c[:4] + (self.location_directory.name(c[4]),)
+            for c in [c for part in parts for c in part['sample']][:5]
+        ]
+        
+        log.debug('stats_computed', location_id=location_id, total_contacts=total_contacts,
+                  shards=len(parts), sample=0.1)
+        
+        return {
+            'total_contacts': total_contacts,
+            'contacts_with_phone': totals['contacts_with_phone'],
+            'contacts_with_email': totals['contacts_with_email'],
+            'contacts_with_both': totals['contacts_with_both'],
+            'new_today': totals['new_today'],
+            'new_this_week': totals['new_this_week'],
+            'phone_rate': round(totals['contacts_with_phone'] * 100.0 / max(total_contacts, 1), 1),
+            'email_rate': round(totals['contacts_with_email'] * 100.0 / max(total_contacts, 1), 1),
+            'complete_rate': round(totals['contacts_with_both'] * 100.0 / max(total_contacts, 1), 1),
+            'sample_contacts': [f"{c[0]} {c[1]} - {c[2]} - {c[3]} ({c[4]})" for c in sample_contacts]
+        }
+    
+    def shard_stats(self, path, location_id=None):
+        """Stat counts from one shard, optionally for a single location"""
+        conn = self.shards.connect(path)
         cursor = conn.cursor()
         
         where_clause = "WHERE 1=1"
         params = []
         
-        if location_id and location_id != 'all':
+        if location_id:
             where_clause += " AND location_id = ?"
             params.append(location_id)
         
-        cursor.execute(f"SELECT COUNT(*) FROM contacts {where_clause}", params)
-        total_contacts = cursor.fetchone()[0]
+        # Same definitions as the leaderboard: normalized phone/email present,
+        # and new counts by date_added_ts against UTC midnight
+        today = int(datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0).timestamp())
+        week = today - 7 * 86400
+        total, phone, email, both, new_today, new_this_week = self.query(cursor, 'stats_counts', f'''
+            SELECT COUNT(*), SUM(phone_e164 IS NOT NULL), SUM(email_norm IS NOT NULL),
+                   SUM(phone_e164 IS NOT NULL AND email_norm IS NOT NULL),
+                   SUM(date_added_ts >= ?), SUM(date_added_ts >= ?)
+            FROM contacts {where_clause}
+        ''', [today, week] + params)[0]
+        
+        stats = {
+            'total_contacts': total,
+            'contacts_with_phone': phone or 0,
+            'contacts_with_email': email or 0,
+            'contacts_with_both': both or 0,
+            'new_today': new_today or 0,
+            'new_this_week': new_this_week or 0,
+            'sample': self.query(cursor, 'stats_sample', f"SELECT first_name, last_name, email, phone, location_id FROM contacts {where_clause} LIMIT 5", params)
+        }
+        
+        conn.close()
+        return stats
+    
+    def search_contacts(self, text, location_id=None, limit=20, offset=0):
+        """Ranked full-text search; returns (results, has_more)"""
+        location_id = location_id if location_id and location_id != 'all' else None
+        match = fts_query(text, location_id)
+        if not match:
+            return [], False
+        
+        # Each shard returns its top offset+limit+1 so the merged page is exact
+        def search_shard(path):
+            conn = self.shards.connect(path)
+            cursor = conn.cursor()
+            rows = self.query(cursor, 'search_contacts', f'''
+                SELECT c.contact_id, c.location_id, c.first_name, c.last_name, c.email, c.phone,
+                       c.source, c.date_added, bm25(contacts_fts, {', '.join(map(str, SEARCH_WEIGHTS))}) AS score
+                FROM contacts_fts JOIN contacts c ON c.rowid = contacts_fts.rowid
+                WHERE contacts_fts MATCH ?
+                ORDER BY score
+                LIMIT ?
+            ''', (match, offset + limit + 1))
+            conn.close()
+            return rows
+        
+        if location_id:
+            rows = search_shard(self.shards.path_for_location(location_id))
+        else:
+            rows = sorted((r for part in self.shards.map(search_shard) for r in part), key=lambda r: r[8])
+        page = rows[offset:offset + limit]
+        
+        return [{
+            'id': r[0],
+            'location_id': r[1],
+            'location_name': self.location_directory.name(r[1]),
+            'name': f"{r[2] or ''} {r[3] or ''}".strip(),
+            'email': r[4],
+            'phone': r[5],
+            'source': r[6],
+            'date_added': r[7],
+            'score': round(-r[8], 3)
+        } for r in page], len(rows) > offset + limit
+    
+    def find_duplicates(self, kind=None, location_id=None, min_locations=2, limit=50, offset=0):
+        """Identities shared by several contacts, largest first, with their members
         
-        cursor.execute(f"SELECT COUNT(*) FROM contacts {where_clause} AND phone IS NOT NULL AND phone != ''", params)
-        contacts_with_phone = cursor.fetchone()[0]
+        Reads the contact_identities summary and joins members back through the
+        phone/email indexes. Returns (groups, has_more).
+        """
+        location_id = location_id if location_id and location_id != 'all' else None
+        kinds = [kind] if kind else list(IDENTITY_COLUMNS)
         
-        cursor.execute(f"SELECT COUNT(*) FROM contacts {where_clause} AND email IS NOT NULL AND email != ''", params)
-        contacts_with_email = cursor.fetchone()[0]
+        def shard_duplicates(path):
+            conn = self.shards.connect(path)
+            cursor = conn.cursor()
+            filters = [f"kind IN ({','.join('?' * len(kinds))})", 'locations >= ?']
+            params = [*kinds, min_locations]
+            if location_id:
+                filters.append('''EXISTS (SELECT 1 FROM contacts m WHERE m.location_id = ? AND (
+                    (d.kind = 'phone' AND m.phone_e164 = d.value) OR (d.kind = 'email' AND m.email_norm = d.value)))''')
+                params.append(location_id)
+            
+            rows = self.query(cursor, 'duplicates', f'''
+                SELECT d.kind, d.value, d.contacts, d.locations,
+                       c.contact_id, c.location_id, c.first_name, c.last_name, c.email, c.phone, c.date_added
+                FROM (
+                    SELECT kind, value, contacts, locations FROM contact_identities d
+                    WHERE {' AND '.join(filters)}
+                    ORDER BY contacts DESC, kind, value
+                    LIMIT ?
+                ) d
+                JOIN contacts c ON (d.kind = 'phone' AND c.phone_e164 = d.value)
+                                OR (d.kind = 'email' AND c.email_norm = d.value)
+                ORDER BY d.contacts DESC, d.kind, d.value, c.date_added
+            ''', (*params, offset + limit + 1))
+            conn.close()
+            return rows
         
-        cursor.execute(f"SELECT COUNT(*) FROM contacts {where_clause} AND phone IS NOT NULL AND phone != '' AND email IS NOT NULL AND email != ''", params)
-        contacts_with_both = cursor.fetchone()[0]
+        if location_id:
+            rows = shard_duplicates(self.shards.path_for_location(location_id))
+        else:
+            rows = [r for part in self.shards.map(shard_duplicates) for r in part]
         
-        cursor.execute(f"SELECT COUNT(*) FROM contacts {where_clause} AND date(created_at) = date('now')", params)
-        new_today = cursor.fetchone()[0]
+        groups = {}
+        for r in rows:
+            group = groups.setdefault((r[0], r[1]), {
+                'kind': r[0], 'value': r[1], 'contacts': r[2], 'locations': r[3], 'members': []
+            })
+            group['members'].append({
+                'id': r[4],
+                'location_id': r[5],
+                'location_name': self.location_directory.name(r[5]),
+                'name': f"{r[6] or ''} {r[7] or ''}".strip(),
+                'email': r[8],
+                'phone': r[9],
+                'date_added': r[10]
+            })
+        ordered = sorted(groups.values(), key=lambda g: (-g['contacts'], g['kind'], g['value']))
+        return ordered[offset:offset + limit], len(ordered) > offset + limit
+    
+    def timeseries(self, location_id=None, bucket='day', start=None, end=None, tz_name=None):
+        """Lead counts and completeness per hour/day/week bucket, gap-filled
         
-        cursor.execute(f"SELECT COUNT(*) FROM contacts {where_clause} AND created_at >= date('now', '-7 days')", params)
-        new_this_week = cursor.fetchone()[0]
+        Buckets are local to tz_name, else the location's timezone, else UTC. When
+        every bucket edge falls on a UTC hour (any whole-hour zone) the counts come
+        from contact_rollup_hourly; otherwise from contacts via its date index.
+        """
+        location_id = location_id if location_id and location_id != 'all' else None
+        if not tz_name and location_id:
+            entry = self.location_directory.get(location_id)
+            tz_name = entry and entry.get('timezone')
+        tz = load_timezone(tz_name)
         
-        # Debug: Show sample contacts
-        cursor.execute(f"SELECT first_name, last_name, email, phone, location_name FROM contacts {where_clause} LIMIT 5", params)
-        sample_contacts = cursor.fetchall()
+        end = end or int(time.time())
+        start = start or end - int(TIMESERIES_DEFAULT_SPAN[bucket].total_seconds())
+        edges = bucket_starts(bucket, start, end, tz)
+        from_rollup = all(edge % 3600 == 0 for edge in edges)
         
-        conn.close()
+        def shard_counts(path):
+            conn = self.shards.connect(path)
+            cursor = conn.cursor()
+            location_filter = 'AND location_id = ?' if location_id else ''
+            params = (edges[0], edges[-1]) + ((location_id,) if location_id else ())
+            if from_rollup:
+                rows = self.query(cursor, 'timeseries_rollup', f'''
+                    SELECT hour_ts, SUM(contacts), SUM(with_phone), SUM(with_email), SUM(with_both)
+                    FROM contact_rollup_hourly
+                    WHERE hour_ts >= ? AND hour_ts < ? {location_filter}
+                    GROUP BY hour_ts
+                ''', params)
+            else:
+                # Every timezone offset is a multiple of 15 minutes
+                rows = self.query(cursor, 'timeseries_contacts', f'''
+                    SELECT date_added_ts / 900 * 900, COUNT(*),
+                           SUM(phone IS NOT NULL AND phone != ''), SUM(email IS NOT NULL AND email != ''),
+                           SUM(phone IS NOT NULL AND phone != '' AND email IS NOT NULL AND email != '')
+                    FROM contacts
+                    WHERE date_added_ts >= ? AND date_added_ts < ? {location_filter}
+                    GROUP BY date_added_ts / 900
+                ''', params)
+            conn.close()
+            return rows
         
-        print(f"📊 STATS DEBUG - Total: {total_contacts}, Location filter: {location_id}")
-        print(f"📋 Sample contacts: {sample_contacts}")
+        if location_id:
+            rows = shard_counts(self.shards.path_for_location(location_id))
+        else:
+            rows = [r for part in self.shards.map(shard_counts) for r in part]
+        
+        counts = [[0, 0, 0, 0] for _ in edges[:-1]]
+        for ts, *values in rows:
+            index = bisect.bisect_right(edges, ts) - 1
+            if 0 <= index < len(counts):
+                counts[index] = [a + (b or 0) for a, b in zip(counts[index], values)]
         
         return {
-            'total_contacts': total_contacts,
-            'contacts_with_phone': contacts_with_phone,
-            'contacts_with_email': contacts_with_email,
-            'contacts_with_both': contacts_with_both,
-            'new_today': new_today,
-            'new_this_week': new_this_week,
-            'phone_rate': round(contacts_with_phone * 100.0 / max(total_contacts, 1), 1),
-            'email_rate': round(contacts_with_email * 100.0 / max(total_contacts, 1), 1),
-            'complete_rate': round(contacts_with_both * 100.0 / max(total_contacts, 1), 1),
-            'sample_contacts': [f"{c[0]} {c[1]} - {c[2]} - {c[3]} ({c[4]})" for c in sample_contacts]
+            'location_id': location_id or 'all',
+            'bucket': bucket,
+            'timezone': tz_name if tz is not timezone.utc else 'UTC',
+            'from': datetime.fromtimestamp(edges[0], tz).isoformat(),
+            'to': datetime.fromtimestamp(edges[-1], tz).isoformat(),
+            'source': 'rollup' if from_rollup else 'contacts',
+            'buckets': [{
+                'start': datetime.fromtimestamp(edge, tz).isoformat(),
+                'contacts': total,
+                'with_phone': phone,
+                'with_email': email,
+                'with_both': both,
+                'phone_rate': round(phone * 100.0 / max(total, 1), 1),
+                'email_rate': round(email * 100.0 / max(total, 1), 1),
+                'complete_rate': round(both * 100.0 / max(total, 1), 1)
+            } for edge, (total, phone, email, both) in zip(edges, counts)]
         }
     
-    def get_locations(self):
+    def source_breakdown(self, location_id=None, start=None, end=None, top=SOURCES_DEFAULT_TOP):
+        """Leads and completeness per source, largest first, with the tail folded into 'Other'"""
+        location_id = location_id if location_id and location_id != 'all' else None
+        
+        def compute():
+            def shard_sources(path):
+                conn = self.shards.connect(path)
+                cursor = conn.cursor()
+                filters, params = [], []
+                if location_id:
+                    filters.append('location_id = ?')
+                    params.append(location_id)
+                if start:
+                    filters.append('date_added_ts >= ?')
+                    params.append(start)
+                if end:
+                    filters.append('date_added_ts < ?')
+                    params.append(end)
+                rows = self.query(cursor, 'sources', f'''
+                    SELECT source, COUNT(*), SUM(phone_e164 IS NOT NULL), SUM(email_norm IS NOT NULL),
+                           SUM(phone_e164 IS NOT NULL AND email_norm IS NOT NULL)
+                    FROM contacts {'WHERE ' + ' AND '.join(filters) if filters else ''}
+                    GROUP BY source
+                ''', params)
+                conn.close()
+                return rows
+            
+            if location_id:
+                parts = [shard_sources(self.shards.path_for_location(location_id))]
+            else:
+                parts = self.shards.map(shard_sources)
+            
+            totals = defaultdict(lambda: [0, 0, 0, 0])
+            for source, *counts in (r for part in parts for r in part):
+                totals[source or 'Unknown'] = [a + b for a, b in zip(totals[source or 'Unknown'], counts)]
+            ranked = sorted(totals.items(), key=lambda item: (-item[1][0], item[0]))
+            
+            head, tail = ranked[:top], ranked[top:]
+            if tail:
+                head.append(('Other', [sum(counts[i] for _, counts in tail) for i in range(4)]))
+            total_contacts = sum(counts[0] for _, counts in ranked)
+            
+            return {
+                'location_id': location_id or 'all',
+                'total_contacts': total_contacts,
+                'other_sources': len(tail),
+                'sources': [{
+                    'source': source,
+                    'contacts': contacts,
+                    'share': round(contacts * 100.0 / max(total_contacts, 1), 1),
+                    'with_phone': phone,
+                    'with_email': email,
+                    'with_both': both,
+                    'phone_rate': round(phone * 100.0 / max(contacts, 1), 1),
+                    'email_rate': round(email * 100.0 / max(contacts, 1), 1),
+                    'complete_rate': round(both * 100.0 / max(contacts, 1), 1)
+                } for source, (contacts, phone, email, both) in head]
+            }
+        
+        return self.cache.get_or_compute(('sources', location_id, start, end, top), self.generation(location_id), compute)
+    
+    def leaderboard(self, sort='total_contacts', descending=True, top=None):
+        """Every known location's totals and rates from one GROUP BY per shard
+        
+        Cached per UTC day, since new_today/new_this_week move at midnight with no
+        writes, and against the location directory's version for names.
+        """
+        today = int(datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0).timestamp())
+        week = today - 7 * 86400
+        # Version before entries: a reload in between only costs a recompute next time
+        directory_version = self.location_directory.version
+        entries = self.location_directory.all()
+        
+        def compute():            
+            # GROUP BY walks idx_contacts_location_source in order, so no temp b-tree or table reads
+            def shard_leaderboard(path):
+                conn = self.shards.connect(path)
+                cursor = conn.cursor()
+                rows = self.query(cursor, 'leaderboard', '''
+                    SELECT location_id, COUNT(*), SUM(phone_e164 IS NOT NULL), SUM(email_norm IS NOT NULL),
+                           SUM(phone_e164 IS NOT NULL AND email_norm IS NOT NULL),
+                           SUM(date_added_ts >= ?), SUM(date_added_ts >= ?)
+                    FROM contacts
+                    GROUP BY location_id
+                ''', (today, week))
+                conn.close()
+                return rows
+            
+            counts = defaultdict(lambda: [0] * 6)
+            for location_id, *values in (r for part in self.shards.map(shard_leaderboard) for r in part):
+                counts[location_id] = [a + (b or 0) for a, b in zip(counts[location_id], values)]
+            
+            # Join to locations through the directory, keeping locations with no contacts yet
+            rows = []
+            for location_id in set(entries) | set(counts):
+                total, phone, email, both, new_today, new_this_week = counts.get(location_id, [0] * 6)
+                rows.append({
+                    'location_id': location_id,
+                    'name': entries.get(location_id, {}).get('name', 'Unknown Location'),
+                    'total_contacts': total,
+                    'with_phone': phone,
+                    'with_email': email,
+                    'with_both': both,
+                    'phone_rate': round(phone * 100.0 / max(total, 1), 1),
+                    'email_rate': round(email * 100.0 / max(total, 1), 1),
+                    'complete_rate': round(both * 100.0 / max(total, 1), 1),
+                    'new_today': new_today,
+                    'new_this_week': new_this_week
+                })
+            return rows
+        
+        rows = self.cache.get_or_compute(('leaderboard', today), (self.generation(), directory_version), compute)
+        ranked = sorted(rows, key=lambda r: (r[sort], r['name']), reverse=descending)
+        return ranked[:top] if top else ranked
+    
+    def save_locations(self, locations, company_id):
+        """Store locations returned by the GHL locations APIs"""
+        conn = self.connect()
+        cursor = conn.cursor()
+        
+        for loc in locations:
+            location_id = loc.get('_id') or loc.get('id') or loc.get('locationId')
+            location_name = loc.get('name', 'Unknown Location')
+            
+            cursor.execute('''
+                INSERT OR REPLACE INTO locations 
+                (location_id, location_name, company_id, last_synced, timezone)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (location_id, location_name, company_id, datetime.now(), loc.get('timezone')))
+        
+        conn.commit()
+        conn.close()
+        self.location_directory.refresh()
+    
+    def get_locations(self, company_id=None):
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         
-        cursor.execute('SELECT location_id, location_name, last_synced FROM locations ORDER BY location_name')
-        locations = cursor.fetchall()
+        if company_id:
+            locations = self.query(cursor, 'locations_list_company', '''
+                SELECT location_id, location_name, last_synced FROM locations
+                WHERE company_id = ? ORDER BY location_name
+            ''', (company_id,))
+        else:
+            locations = self.query(cursor, 'locations_list', 'SELECT location_id, location_name, last_synced FROM locations ORDER BY location_name')
         conn.close()
         
         return [{'id': loc[0], 'name': loc[1], 'last_synced': loc[2]} for loc in locations]
@@ -717,14 +3357,12 @@ class DebugLeadAnalytics:
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         
-        cursor.execute('''
+        logs = self.query(cursor, 'debug_logs', '''
             SELECT endpoint, method, status_code, error_message, timestamp 
             FROM api_debug_log 
             ORDER BY timestamp DESC 
             LIMIT ?
         ''', (limit,))
-        
-        logs = cursor.fetchall()
         conn.close()
         
         return [{
@@ -733,62 +3371,600 @@ class DebugLeadAnalytics:
         } for log in logs]
 
 # Global instance
-analytics = DebugLeadAnalytics()
+analytics = DebugLeadAnalytics(os.getenv('DATABASE_PATH', 'debug_analytics.db'), shard_dir=SHARD_DIR)
 
 # Token functions
-def get_valid_token():
+#
+# Each installation has its own oauth_tokens row: agency installs are keyed by
+# company_id, sub-account installs by location_id. Lookups resolve the tenant
+# that owns a location, and refreshes are serialised per installation because
+# GHL rotates the refresh token on every use.
+_token_locks = defaultdict(threading.Lock)
+_token_locks_lock = threading.Lock()
+
+def token_lock(client_key):
+    with _token_locks_lock:
+        return _token_locks[client_key]
+
+def find_token_record(cursor, company_id=None, location_id=None):
+    """oauth_tokens row for a tenant: the location's own install, else its company's install"""
+    if location_id:
+        rows = analytics.query(cursor, 'token_lookup_location', '''
+            SELECT * FROM oauth_tokens WHERE location_id = ? ORDER BY created_at DESC LIMIT 1
+        ''', (location_id,))
+        if rows:
+            return rows[0]
+        if not company_id:
+            rows = analytics.query(cursor, 'token_location_company',
+                                   'SELECT company_id FROM locations WHERE location_id = ?', (location_id,))
+            company_id = rows[0][0] if rows else None
+        if not company_id:
+            return None
+    
+    if company_id:
+        # Prefer the agency install over any sub-account installs in the same company
+        rows = analytics.query(cursor, 'token_lookup_company', '''
+            SELECT * FROM oauth_tokens WHERE company_id = ?
+            ORDER BY location_id IS NOT NULL, created_at DESC LIMIT 1
+        ''', (company_id,))
+    else:
+        # No tenant given: single-install deployments and the debug pages use the newest install
+        rows = analytics.query(cursor, 'token_lookup', 'SELECT * FROM oauth_tokens ORDER BY created_at DESC LIMIT 1')
+    return rows[0] if rows else None
+
+def get_valid_token(company_id=None, location_id=None):
+    """Access token for a tenant, refreshing it if it expires within five minutes"""
     conn = sqlite3.connect(analytics.db_path)
     cursor = conn.cursor()
+    result = find_token_record(cursor, company_id, location_id)
+    conn.close()
+    
+    if not result:
+        return None
+    
+    expires_at = datetime.fromisoformat(result[4])
+    if expires_at <= datetime.now() + timedelta(minutes=5):
+        refreshed = refresh_access_token(result)
+        # While GHL is unreachable, keep using the current token until it actually expires
+        if refreshed or expires_at <= datetime.now():
+            return refreshed
+        log.warning('token_refresh_degraded', client_key=result[1], expires_at=result[4], per_second=0.1)
+    
+    return {
+        'access_token': result[2],
+        'company_id': result[6],
+        'location_id': result[5]
+    }
+
+def refresh_access_token(token_record):
+    started = time.perf_counter()
+    client_key = token_record[1]
+    try:
+        with token_lock(client_key):
+            # Another thread may have refreshed this install while we waited
+            conn = sqlite3.connect(analytics.db_path)
+            cursor = conn.cursor()
+            current = analytics.query(cursor, 'token_lookup_client',
+                                      'SELECT * FROM oauth_tokens WHERE client_key = ?', (client_key,))
+            conn.close()
+            if current and current[0][2] != token_record[2] and \
+                    datetime.fromisoformat(current[0][4]) > datetime.now() + timedelta(minutes=5):
+                return {
+                    'access_token': current[0][2],
+                    'company_id': current[0][6],
+                    'location_id': current[0][5]
+                }
+            token_record = current[0] if current else token_record
+            
+            resp = ghl_request('POST', '/oauth/token', tenant=client_key, data={
+                "grant_type": "refresh_token",
+                "client_id": CLIENT_ID,
+                "client_secret": CLIENT_SECRET,
+                "refresh_token": token_record[3]
+            })
+            
+            metrics.inc('ghl_token_refresh_total', result='ok' if resp.status_code == 200 else 'error')
+            if resp.status_code == 200:
+                new_tokens = resp.json()
+                expires_at = datetime.now() + timedelta(seconds=new_tokens.get('expires_in', 3600))
+                
+                conn = sqlite3.connect(analytics.db_path)
+                cursor = conn.cursor()
+                cursor.execute('''
+                    UPDATE oauth_tokens 
+                    SET access_token = ?, refresh_token = ?, expires_at = ?
+                    WHERE client_key = ?
+                ''', (new_tokens['access_token'], new_tokens.get('refresh_token') or token_record[3],
+                      expires_at, client_key))
+                conn.commit()
+                conn.close()
+                
+                return {
+                    'access_token': new_tokens['access_token'],
+                    'company_id': token_record[6],
+                    'location_id': token_record[5]
+                }
+            log.warning('token_refresh_rejected', client_key=client_key, status=resp.status_code)
+    except Exception as e:
+        metrics.inc('ghl_token_refresh_total', result='error')
+        log.error('token_refresh_failed', client_key=client_key, error=str(e))
+    finally:
+        record_span('token', 'refresh', time.perf_counter() - started)
+    
+    return None
+
+# Location tokens are cached per (company, location) until shortly before they expire
+_location_tokens = {}
+_location_tokens_lock = threading.Lock()
+
+def get_location_access_token(location_id, company_id=None):
+    """Token the contacts API accepts for location_id, exchanging its agency's token if needed"""
+    key = (company_id, location_id)
+    with _location_tokens_lock:
+        cached = _location_tokens.get(key)
+    if cached and cached['expires_at'] > datetime.now() + timedelta(minutes=5):
+        metrics.inc('cache_requests_total', cache='location_token', result='hit')
+        return cached['access_token']
+    metrics.inc('cache_requests_total', cache='location_token', result='miss')
+    
+    token_data = get_valid_token(company_id=company_id, location_id=location_id)
+    if not token_data:
+        return None
+    
+    # Sub-account installs already hold a location token
+    company_id = company_id or token_data.get('company_id')
+    if not company_id or token_data.get('location_id') == location_id:
+        return token_data['access_token']
+    
+    result = analytics.get_location_token(token_data['access_token'], company_id, location_id)
+    if not result.get('success'):
+        if cached and cached['expires_at'] > datetime.now():
+            metrics.inc('cache_requests_total', cache='location_token', result='stale')
+            log.warning('location_token_degraded', location_id=location_id, per_second=0.1)
+            return cached['access_token']
+        return None
+    
+    with _location_tokens_lock:
+        _location_tokens[key] = {
+            'access_token': result['access_token'],
+            'expires_at': datetime.now() + timedelta(seconds=result.get('expires_in') or 3600)
+        }
+    return result['access_token']
+
+class SyncScheduler:
+    """Runs contact syncs in the background, one location at a time per slot
+    
+    State lives in sync_schedule so any number of worker processes can share the
+    queue through leases, and a restarted worker resumes each location from its
+    saved page cursor. Due locations are ordered by how overdue they are, weighted
+    up by lead volume and down by recent failures.
+    """
+    def __init__(self, analytics, concurrency=SYNC_CONCURRENCY):
+        self.analytics = analytics
+        self.concurrency = concurrency
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='sync')
+        self.running = {}
+        self.stopping = threading.Event()
+    
+    @staticmethod
+    def next_interval(lead_rate):
+        """Seconds until the next sync; ~1 lead/hour syncs hourly, 60+/hour every minute"""
+        if lead_rate <= 0:
+            return SYNC_DORMANT_INTERVAL
+        return max(SYNC_HOT_INTERVAL, min(SYNC_DORMANT_INTERVAL, SYNC_DORMANT_INTERVAL / lead_rate))
+    
+    @staticmethod
+    def backoff_interval(failures):
+        return min(SYNC_DORMANT_INTERVAL, SYNC_HOT_INTERVAL * 2 ** failures)
+    
+    def seed(self):
+        """Add a schedule row for every active location that doesn't have one yet
+        
+        When sharded, locations wait until their company (and so their shard) is known.
+        """
+        conn = self.analytics.connect()
+        conn.execute('''
+            INSERT OR IGNORE INTO sync_schedule (location_id, next_run_at)
+            SELECT location_id, 0 FROM locations
+            WHERE is_active AND (COALESCE(company_id, '') != '' OR ?)
+        ''', (not self.analytics.shards.shard_dir,))
+        conn.commit()
+        conn.close()
+    
+    def claim(self, limit):
+        """Lease up to `limit` due locations to this worker, highest priority first"""
+        now = time.time()
+        conn = self.analytics.connect()
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        location_ids = [row[0] for row in self.analytics.query(cursor, 'sync_claim', '''
+            SELECT location_id FROM sync_schedule
+            WHERE next_run_at <= ? AND (lease_expires_at IS NULL OR lease_expires_at < ?)
+            ORDER BY (? - next_run_at + 1) * (1 + lead_rate) / (1 + consecutive_failures) DESC
+            LIMIT ?
+        ''', (now, now, now, limit))]
+        
+        cursor.executemany('''
+            UPDATE sync_schedule SET lease_owner = ?, lease_expires_at = ?, last_started_at = ?
+            WHERE location_id = ?
+        ''', [(self.worker_id, now + SYNC_LEASE_SECONDS, now, loc) for loc in location_ids])
+        conn.commit()
+        conn.close()
+        return location_ids
+    
+    def lease_renewer(self, location_id):
+        """on_page callback that extends our lease on location_id every quarter lease at most
+        
+        Raises LeaseLostError once another worker holds it, so we stop syncing.
+        """
+        renewed_at = time.monotonic()
+        
+        def renew():
+            nonlocal renewed_at
+            if time.monotonic() - renewed_at < SYNC_LEASE_SECONDS / 4:
+                return
+            if not self.analytics.lease_location(location_id, self.worker_id, SYNC_LEASE_SECONDS):
+                raise LeaseLostError(f"Sync lease on {location_id} lost to another worker")
+            renewed_at = time.monotonic()
+        return renew
+    
+    def save_cursor(self, location_id, cursor):
+        conn = self.analytics.connect()
+        conn.execute('''
+            UPDATE sync_schedule SET cursor_start_after = ?, cursor_start_after_id = ?, lease_expires_at = ?
+            WHERE location_id = ? AND lease_owner = ?
+        ''', (cursor[0], cursor[1], time.time() + SYNC_LEASE_SECONDS, location_id, self.worker_id))
+        conn.commit()
+        conn.close()
+    
+    def load_state(self, location_id):
+        conn = self.analytics.connect()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT s.cursor_start_after, s.cursor_start_after_id, s.last_finished_at,
+                   s.lead_rate, s.consecutive_failures, l.company_id
+            FROM sync_schedule s LEFT JOIN locations l ON l.location_id = s.location_id
+            WHERE s.location_id = ?
+        ''', (location_id,))
+        row = cursor.fetchone()
+        conn.close()
+        
+        return {
+            'cursor': (row[0], row[1]),
+            'last_finished_at': row[2],
+            'lead_rate': row[3] or 0,
+            'failures': row[4] or 0,
+            'company_id': row[5],
+            'started': time.time()
+        }
+    
+    def defer(self, location_id, error):
+        """Put a sync off until its GHL breaker half-opens, without counting a failure"""
+        log.info('sync_deferred', location_id=location_id, endpoint=error.endpoint,
+                 retry_in=round(error.retry_in, 1), per_second=1)
+        conn = self.analytics.connect()
+        conn.execute('''
+            UPDATE sync_schedule SET next_run_at = ?, lease_owner = NULL, lease_expires_at = NULL
+            WHERE location_id = ? AND lease_owner = ?
+        ''', (time.time() + max(error.retry_in, 1), location_id, self.worker_id))
+        conn.commit()
+        conn.close()
+    
+    def record_failure(self, location_id, state, error):
+        failures = state['failures'] + 1
+        log.warning('sync_failed', location_id=location_id, failures=failures, error=str(error)[:200])
+        
+        conn = self.analytics.connect()
+        conn.execute('''
+            UPDATE sync_schedule
+            SET last_status = 'error', last_error = ?, consecutive_failures = ?,
+                next_run_at = ?, last_finished_at = ?, lease_owner = NULL, lease_expires_at = NULL
+            WHERE location_id = ? AND lease_owner = ?
+        ''', (str(error)[:500], failures, time.time() + self.backoff_interval(failures), time.time(),
+              location_id, self.worker_id))
+        conn.commit()
+        conn.close()
+    
+    def record_success(self, location_id, state, written):
+        # The first sync is a backfill, so it says nothing about the lead rate
+        finished = time.time()
+        lead_rate = state['lead_rate']
+        if state['last_finished_at']:
+            hours = max(finished - state['last_finished_at'], 1) / 3600
+            lead_rate = 0.3 * (written / hours) + 0.7 * lead_rate
+        
+        conn = self.analytics.connect()
+        owned = conn.execute('''
+            UPDATE sync_schedule
+            SET last_status = 'ok', last_error = NULL, consecutive_failures = 0, lead_rate = ?,
+                next_run_at = ?, last_finished_at = ?, lease_owner = NULL, lease_expires_at = NULL
+            WHERE location_id = ? AND lease_owner = ?
+        ''', (lead_rate, finished + self.next_interval(lead_rate), finished, location_id, self.worker_id)).rowcount
+        if not owned:
+            conn.close()
+            log.warning('sync_lease_lost', location_id=location_id, worker_id=self.worker_id)
+            return
+        conn.execute('UPDATE locations SET last_synced = ? WHERE location_id = ?', (datetime.now(), location_id))
+        conn.commit()
+        conn.close()
+        log.info('sync_finished', location_id=location_id, contacts=written,
+                 seconds=round(finished - state['started'], 2), next_in=round(self.next_interval(lead_rate)))
+        self.queue_reconcile_if_due(location_id, state['company_id'])
+    
+    def queue_reconcile_if_due(self, location_id, company_id):
+        """Queue a deletion reconcile once per RECONCILE_INTERVAL; the conditional update lets one worker win"""
+        now = time.time()
+        conn = self.analytics.connect()
+        claimed = conn.execute('''
+            UPDATE sync_schedule SET last_reconciled_at = ?
+            WHERE location_id = ? AND COALESCE(last_reconciled_at, 0) < ?
+        ''', (now, location_id, now - RECONCILE_INTERVAL)).rowcount
+        conn.commit()
+        conn.close()
+        
+        if claimed:
+            jobs.submit('reconcile_contacts', {'location_id': location_id, 'company_id': company_id})
+    
+    def sync_activity(self, access_token, location_id):
+        """Conversation and task syncs after the contacts; they have their own scopes, so failures here don't fail the contacts
+        
+        Both can run for minutes under the rate limit, so they renew the lease as they go.
+        """
+        renew = self.lease_renewer(location_id)
+        try:
+            self.analytics.sync_location_conversations(access_token, location_id, on_page=renew)
+        except LeaseLostError:
+            raise
+        except Exception as e:
+            log.warning('conversation_sync_failed', location_id=location_id, error=str(e)[:200], per_second=1)
+        try:
+            self.analytics.sync_location_tasks(access_token, location_id, on_page=renew)
+        except LeaseLostError:
+            raise
+        except Exception as e:
+            log.warning('task_sync_failed', location_id=location_id, error=str(e)[:200], per_second=1)
+    
+    def run_job(self, location_id):
+        state = self.load_state(location_id)
+        try:
+            access_token = get_location_access_token(location_id, state['company_id'])
+            if not access_token:
+                raise GHLSyncError("No valid token for location")
+            
+            written, _ = self.analytics.sync_location_contacts(
+                access_token, location_id,
+                cursor=state['cursor'],
+                on_page=lambda c: self.save_cursor(location_id, c)
+            )
+            self.sync_activity(access_token, location_id)
+        except CircuitOpenError as e:
+            self.defer(location_id, e)
+            return
+        except LeaseLostError as e:
+            log.warning('sync_lease_lost', location_id=location_id, worker_id=self.worker_id, error=str(e))
+            return
+        except Exception as e:
+            self.record_failure(location_id, state, e)
+            return
+        
+        self.record_success(location_id, state, written)
+    
+    def run_forever(self, poll_interval=1.0, seed_interval=60):
+        log.info('scheduler_started', worker_id=self.worker_id, slots=self.concurrency)
+        last_seed = 0
+        
+        while not self.stopping.is_set():
+            if time.time() - last_seed >= seed_interval:
+                self.seed()
+                last_seed = time.time()
+            
+            for location_id, future in list(self.running.items()):
+                if future.done():
+                    del self.running[location_id]
+            
+            free = self.concurrency - len(self.running)
+            if free > 0:
+                for location_id in self.claim(free):
+                    self.running[location_id] = self.executor.submit(self.run_job, location_id)
+            
+            self.stopping.wait(poll_interval)
+        
+        # Let in-flight pages commit; unfinished locations resume from their cursor
+        self.executor.shutdown(wait=True)
+        log.info('scheduler_stopped', worker_id=self.worker_id)
+    
+    def stop(self):
+        self.stopping.set()
+
+class JobQueue:
+    """SQLite-backed queue that moves slow GHL work off the request path
+    
+    Web processes submit jobs and start their own worker threads on first use;
+    worker.py drains the same table. A job whose worker died is picked up again
+    once its lease expires, up to JOB_MAX_ATTEMPTS times. A handler's cleanup, if
+    registered, runs with the payload once the job is finished for good.
+    """
+    def __init__(self, analytics, workers=JOB_WORKERS):
+        self.analytics = analytics
+        self.workers = workers
+        self.handlers = {}
+        self.cleanups = {}
+        self.wakeup = threading.Event()
+        self.started_pid = None
+        self.start_lock = threading.Lock()
+        self.current = threading.local()
+    
+    def handler(self, kind, cleanup=None):
+        def register(fn):
+            self.handlers[kind] = fn
+            if cleanup:
+                self.cleanups[kind] = cleanup
+            return fn
+        return register
+    
+    def clean_up(self, kind, payload):
+        cleanup = self.cleanups.get(kind)
+        if not cleanup:
+            return
+        try:
+            cleanup(payload)
+        except Exception as e:
+            log.warning('job_cleanup_failed', kind=kind, error=str(e))
+    
+    def start(self):
+        """Start this process's worker threads (once per process, so forks get their own)"""
+        with self.start_lock:
+            if self.started_pid == os.getpid():
+                return
+            self.started_pid = os.getpid()
+            for i in range(self.workers):
+                threading.Thread(target=self.work_loop, name=f'job-{i}', daemon=True).start()
+    
+    def submit(self, kind, payload=None):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        
+        conn = self.analytics.connect()
+        conn.execute('''
+            INSERT INTO jobs (id, kind, payload, status, created_at) VALUES (?, ?, ?, 'queued', ?)
+        ''', (job_id, kind, json.dumps(payload or {}), now))
+        conn.execute("DELETE FROM jobs WHERE status IN ('done', 'error') AND finished_at < ?",
+                     (now - JOB_RETENTION_DAYS * 86400,))
+        conn.commit()
+        conn.close()
+        
+        self.start()
+        self.wakeup.set()
+        return job_id
+    
+    def get(self, job_id):
+        conn = self.analytics.connect()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT id, kind, status, result, error, attempts, created_at, started_at, finished_at
+            FROM jobs WHERE id = ?
+        ''', (job_id,))
+        row = cursor.fetchone()
+        conn.close()
+        
+        if not row:
+            return None
+        return {
+            'job_id': row[0], 'kind': row[1], 'status': row[2],
+            'result': json.loads(row[3]) if row[3] else None,
+            'error': row[4], 'attempts': row[5],
+            'created_at': row[6], 'started_at': row[7], 'finished_at': row[8]
+        }
     
-    cursor.execute('SELECT * FROM oauth_tokens ORDER BY created_at DESC LIMIT 1')
-    result = cursor.fetchone()
-    conn.close()
+    def claim(self, worker_id):
+        now = time.time()
+        conn = self.analytics.connect()
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        rows = self.analytics.query(cursor, 'job_claim', '''
+            SELECT id, kind, payload, attempts FROM jobs
+            WHERE status = 'queued' OR (status = 'running' AND lease_expires_at < ?)
+            ORDER BY created_at LIMIT 1
+        ''', (now,))
+        row = rows[0] if rows else None
+        if row:
+            cursor.execute('''
+                UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ?,
+                                lease_owner = ?, lease_expires_at = ?
+                WHERE id = ?
+            ''', (now, worker_id, now + JOB_LEASE_SECONDS, row[0]))
+        conn.commit()
+        conn.close()
+        return row
     
-    if not result:
-        return None
+    def progress(self, result):
+        """From inside a handler: publish partial results and extend the job's lease"""
+        job_id = getattr(self.current, 'job_id', None)
+        if not job_id:
+            return
+        conn = self.analytics.connect()
+        conn.execute('''
+            UPDATE jobs SET result = ?, lease_expires_at = ? WHERE id = ? AND status = 'running'
+        ''', (json.dumps(result), time.time() + JOB_LEASE_SECONDS, job_id))
+        conn.commit()
+        conn.close()
     
-    expires_at = datetime.fromisoformat(result[4])
-    if expires_at <= datetime.now() + timedelta(minutes=5):
-        return refresh_access_token(result)
+    def finish(self, job_id, status, result=None, error=None):
+        conn = self.analytics.connect()
+        conn.execute('''
+            UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?,
+                            lease_owner = NULL, lease_expires_at = NULL
+            WHERE id = ?
+        ''', (status, json.dumps(result) if result is not None else None, error, time.time(), job_id))
+        conn.commit()
+        conn.close()
     
-    return {
-        'access_token': result[2],
-        'company_id': result[6],
-        'location_id': result[5]
-    }
-
-def refresh_access_token(token_record):
-    try:
-        resp = requests.post("https://services.leadconnectorhq.com/oauth/token", data={
-            "grant_type": "refresh_token",
-            "client_id": CLIENT_ID,
-            "client_secret": CLIENT_SECRET,
-            "refresh_token": token_record[3]
-        })
-        
-        if resp.status_code == 200:
-            new_tokens = resp.json()
-            expires_at = datetime.now() + timedelta(seconds=new_tokens.get('expires_in', 3600))
+    def work_loop(self):
+        worker_id = f"{socket.gethostname()}:{os.getpid()}:{threading.current_thread().name}"
+        while True:
+            row = self.claim(worker_id)
+            if not row:
+                self.wakeup.wait(timeout=2)
+                self.wakeup.clear()
+                continue
             
-            conn = sqlite3.connect(analytics.db_path)
-            cursor = conn.cursor()
-            cursor.execute('''
-                UPDATE oauth_tokens 
-                SET access_token = ?, expires_at = ?
-                WHERE client_key = ?
-            ''', (new_tokens['access_token'], expires_at, token_record[1]))
-            conn.commit()
-            conn.close()
+            job_id, kind, payload, attempts = row
+            payload = json.loads(payload or '{}')
+            if attempts >= JOB_MAX_ATTEMPTS:
+                self.finish(job_id, 'error', error=f'Gave up after {attempts} attempts')
+                self.clean_up(kind, payload)
+                continue
             
-            return {
-                'access_token': new_tokens['access_token'],
-                'company_id': token_record[6],
-                'location_id': token_record[5]
-            }
-    except Exception as e:
-        print(f"Token refresh failed: {e}")
+            handler = self.handlers.get(kind)
+            if not handler:
+                self.finish(job_id, 'error', error=f'Unknown job kind: {kind}')
+                continue
+            
+            self.current.job_id = job_id
+            try:
+                result = handler(payload)
+                self.finish(job_id, 'done', result=result)
+            except Exception as e:
+                log.error('job_failed', job_id=job_id, kind=kind, error=str(e), exc_info=True)
+                self.finish(job_id, 'error', error=str(e))
+            finally:
+                self.current.job_id = None
+                self.clean_up(kind, payload)
+
+jobs = JobQueue(analytics)
+
+@metrics.gauge
+def queue_depth_gauges():
+    conn = analytics.connect()
+    cursor = conn.cursor()
+    cursor.execute("SELECT status, COUNT(*) FROM jobs WHERE status IN ('queued', 'running') GROUP BY status")
+    job_counts = dict(cursor.fetchall())
+    now = time.time()
+    cursor.execute('''
+        SELECT SUM(next_run_at <= ? AND (lease_expires_at IS NULL OR lease_expires_at < ?)),
+               SUM(lease_expires_at >= ?)
+        FROM sync_schedule
+    ''', (now, now, now))
+    waiting, running = cursor.fetchone()
+    conn.close()
     
-    return None
+    return [
+        ('job_queue_depth', {'status': 'queued'}, job_counts.get('queued', 0)),
+        ('job_queue_depth', {'status': 'running'}, job_counts.get('running', 0)),
+        ('sync_queue_depth', {'state': 'waiting'}, waiting or 0),
+        ('sync_queue_depth', {'state': 'running'}, running or 0),
+    ]
+
+@metrics.gauge
+def cache_ratio_gauges():
+    lookups = defaultdict(lambda: defaultdict(float))
+    for labels, value in metrics.counter_totals('cache_requests_total'):
+        lookups[labels['cache']][labels['result']] += value
+    return [
+        ('cache_hit_ratio', {'cache': cache}, round(c['hit'] / max(c['hit'] + c['miss'], 1), 4))
+        for cache, c in sorted(lookups.items())
+    ]
 
 def generate_install_url():
     import urllib.parse
@@ -799,6 +3975,181 @@ def generate_install_url():
             f"?response_type=code&client_id={CLIENT_ID}&redirect_uri={redirect}"
             f"&app_id={APP_ID}&scope={scope_param}&installToFutureLocations=true")
 
+# Request instrumentation
+class TimedJSONProvider(DefaultJSONProvider):
+    """Default JSON provider that reports encoding time as a request span"""
+    def dumps(self, obj, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            record_span('json', 'encode', time.perf_counter() - started)
+
+app.json = TimedJSONProvider(app)
+
+def is_admin():
+    supplied = request.headers.get('X-Admin-Token') or request.args.get('admin_token') or ''
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(supplied, ADMIN_TOKEN)
+
+@app.before_request
+def start_request_timing():
+    g.request_started = time.perf_counter()
+    g.spans = []
+    if request.args.get('profile') == '1' and is_admin():
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+@app.after_request
+def add_server_timing(response):
+    """Server-Timing header per span category, slow-request log, optional profile dump"""
+    if 'request_started' not in g:
+        return response
+    total = time.perf_counter() - g.request_started
+    
+    profiler = g.pop('profiler', None)
+    if profiler:
+        profiler.disable()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        name = f"{int(time.time())}-{request.endpoint or 'unknown'}-{uuid.uuid4().hex[:6]}.pstats"
+        profiler.dump_stats(os.path.join(PROFILE_DIR, name))
+        response.headers['X-Profile'] = f"/admin/profiles/{name}"
+    
+    totals = defaultdict(lambda: [0.0, 0])
+    for category, _, seconds in g.spans:
+        totals[category][0] += seconds
+        totals[category][1] += 1
+    timings = [f'{category};dur={seconds * 1000:.1f};desc="{count} calls"'
+               for category, (seconds, count) in sorted(totals.items())]
+    timings.append(f'total;dur={total * 1000:.1f}')
+    response.headers['Server-Timing'] = ', '.join(timings)
+    
+    if total * 1000 >= SLOW_REQUEST_MS:
+        slow_spans = sorted((s for s in g.spans if s[2] * 1000 >= SLOW_SPAN_MS), key=lambda s: -s[2])
+        log.warning('slow_request', method=request.method, path=request.full_path,
+                    status=response.status_code, ms=round(total * 1000),
+                    spans=[{'type': c, 'name': n, 'ms': round(s * 1000, 1)} for c, n, s in slow_spans[:20]])
+    
+    return response
+
+@app.route('/admin/profiles/<name>')
+def admin_profile(name):
+    """Download a ?profile=1 dump, or ?format=text for the top functions by cumulative time"""
+    if not is_admin():
+        abort(403)
+    if request.args.get('format') != 'text':
+        return send_from_directory(PROFILE_DIR, name)
+    
+    path = os.path.join(PROFILE_DIR, os.path.basename(name))
+    if not os.path.exists(path):
+        abort(404)
+    output = io.StringIO()
+    pstats.Stats(path, stream=output).sort_stats('cumulative').print_stats(50)
+    return Response(output.getvalue(), mimetype='text/plain')
+
+# Static assets
+ASSET_DIR = os.path.abspath(os.getenv('ASSET_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets')))
+ASSET_HASH_LENGTH = 12
+ASSET_MIN_COMPRESS_BYTES = 256
+ASSET_IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+ASSET_PAGE_CACHE = 'no-cache'  # pages keep their URLs, so they revalidate on every load (a 304 when unchanged)
+
+metrics.declare('asset_responses_total', 'counter', 'Static asset responses by asset, status and content encoding')
+
+class StaticAssets:
+    """The files under ASSET_DIR, fingerprinted and precompressed once at startup
+    
+    CSS and JS are published under content-hashed names (dashboard.3f2a9c1b7e4d.js)
+    and cached for a year; pages reference them by their plain /assets/ name and
+    have those references rewritten to the hashed URLs, so a deploy changes the
+    page's ETag and nothing else needs purging. Each file is held as identity,
+    gzip and (when the brotli package is installed) br bodies, with one strong
+    ETag per encoding.
+    """
+    ENCODINGS = ('br', 'gzip')
+    
+    def __init__(self, directory):
+        self.directory = directory
+        self.files = {}   # plain name -> entry
+        self.hashed = {}  # hashed name -> entry
+        self.load()
+    
+    def load(self):
+        if not os.path.isdir(self.directory):
+            log.warning('asset_dir_missing', path=self.directory)
+            return
+        names = sorted(os.listdir(self.directory))
+        # Pages last, so the assets they reference already have their hashed URLs
+        for name in sorted(names, key=lambda n: n.endswith('.html')):
+            with open(os.path.join(self.directory, name), 'rb') as f:
+                body = f.read()
+            if name.endswith('.html'):
+                body = re.sub(rb'/assets/([\w.-]+)',
+                              lambda m: self.url(m.group(1).decode()).encode(), body)
+            entry = self.build(name, body)
+            self.files[name] = entry
+            if not name.endswith('.html'):
+                self.hashed[entry['hashed_name']] = entry
+        log.info('assets_loaded', files=len(self.files), brotli=brotli is not None,
+                 bytes={name: {enc: len(b) for enc, b in e['bodies'].items()} for name, e in self.files.items()})
+    
+    def build(self, name, body):
+        digest = hashlib.sha256(body).hexdigest()[:ASSET_HASH_LENGTH]
+        stem, ext = os.path.splitext(name)
+        bodies = {'identity': body}
+        if len(body) >= ASSET_MIN_COMPRESS_BYTES:
+            candidates = {'gzip': gzip.compress(body, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                candidates['br'] = brotli.compress(body, quality=11)
+            bodies.update((enc, b) for enc, b in candidates.items() if len(b) < len(body))
+        return {
+            'name': name,
+            'hashed_name': f"{stem}.{digest}{ext}",
+            'mimetype': mimetypes.guess_type(name)[0] or 'application/octet-stream',
+            'digest': digest,
+            'bodies': bodies
+        }
+    
+    def url(self, name):
+        """Hashed URL for an asset; names that are not assets are left as they were"""
+        entry = self.files.get(name)
+        return f"/assets/{entry['hashed_name']}" if entry else f"/assets/{name}"
+    
+    def response(self, name):
+        """Best encoding of an asset for this request, or a 304 when the client's copy is current
+        
+        Hashed names never change content, so they are cached as immutable; plain
+        names (the pages, or an asset fetched without its hash) must revalidate.
+        """
+        entry = self.hashed.get(name)
+        cache_control = ASSET_IMMUTABLE_CACHE
+        if entry is None:
+            entry = self.files.get(name)
+            cache_control = ASSET_PAGE_CACHE
+        if entry is None:
+            abort(404)
+        
+        encoding = next((enc for enc in self.ENCODINGS
+                         if enc in entry['bodies'] and request.accept_encodings[enc]), 'identity')
+        etag = entry['digest'] if encoding == 'identity' else f"{entry['digest']}-{encoding}"
+        
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = Response(entry['bodies'][encoding], mimetype=entry['mimetype'])
+            if encoding != 'identity':
+                response.headers['Content-Encoding'] = encoding
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = cache_control
+        response.headers['Vary'] = 'Accept-Encoding'
+        metrics.inc('asset_responses_total', asset=entry['name'], status=str(response.status_code), encoding=encoding)
+        return response
+
+assets = StaticAssets(ASSET_DIR)
+
+@app.route('/assets/<name>')
+def static_asset(name):
+    return assets.response(name)
+
 # Routes
 @app.route('/')
 def home():
@@ -831,322 +4182,19 @@ def home():
     </html>
     '''
 
+def requested_company_id():
+    """Tenant a request is scoped to, from ?company_id= or the JSON body; None means the newest install"""
+    data = request.get_json(silent=True) if request.is_json else None
+    return (data or {}).get('company_id') or request.args.get('company_id')
+
 @app.route('/debug')
 def debug_info():
-    """Show debug information"""
-    token_data = get_valid_token()
-    debug_logs = analytics.get_debug_logs(20)
-    
-    return f'''
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>Debug Information</title>
-        <style>
-            body {{ font-family: monospace; margin: 20px; background: #1a1a1a; color: #00ff00; }}
-            .section {{ background: #2a2a2a; padding: 20px; margin: 10px 0; border-radius: 5px; }}
-            .error {{ color: #ff6b6b; }}
-            .success {{ color: #51cf66; }}
-            .info {{ color: #74c0fc; }}
-        </style>
-    </head>
-    <body>
-        <h1>🔍 DEBUG INFORMATION</h1>
-        
-        <div class="section">
-            <h2>🔑 TOKEN STATUS</h2>
-            <p>Token Available: <span class="{'success' if token_data else 'error'}">{'YES' if token_data else 'NO'}</span></p>
-            {f'<p>Company ID: {token_data.get("company_id", "Unknown")}</p>' if token_data else ''}
-        </div>
-        
-        <div class="section">
-            <h2>📊 RECENT API CALLS</h2>
-            {''.join([f'<p class="{'success' if log['status_code'] == 200 else 'error'}">{log["timestamp"]}: {log["method"]} {log["endpoint"]} - Status: {log["status_code"]}{" - Error: " + log["error_message"] if log["error_message"] else ""}</p>' for log in debug_logs])}
-        </div>
-        
-        <div class="section">
-            <h2>🛠️ DEBUG ACTIONS</h2>
-            <button onclick="testConnection()">Test API Connection</button>
-            <button onclick="debugLocations()">Debug Locations API</button>
-            <button onclick="debugContacts()">Debug Contacts API</button>
-        </div>
-        
-        <div id="results"></div>
-        
-        <script>
-            async function testConnection() {{
-                const response = await fetch('/api/test-connection', {{ method: 'POST' }});
-                const result = await response.json();
-                document.getElementById('results').innerHTML = '<div class="section"><h3>🔗 Connection Test</h3><pre>' + JSON.stringify(result, null, 2) + '</pre></div>';
-            }}
-            
-            async function debugLocations() {{
-                const response = await fetch('/api/debug-locations', {{ method: 'POST' }});
-                const result = await response.json();
-                document.getElementById('results').innerHTML = '<div class="section"><h3>📍 Locations Debug</h3><pre>' + JSON.stringify(result, null, 2) + '</pre></div>';
-            }}
-            
-            async function debugContacts() {{
-                const locationId = prompt('Enter Location ID to test:');
-                if (locationId) {{
-                    const response = await fetch('/api/debug-contacts', {{ 
-                        method: 'POST',
-                        headers: {{ 'Content-Type': 'application/json' }},
-                        body: JSON.stringify({{ location_id: locationId }})
-                    }});
-                    const result = await response.json();
-                    document.getElementById('results').innerHTML = '<div class="section"><h3>👥 Contacts Debug</h3><pre>' + JSON.stringify(result, null, 2) + '</pre></div>';
-                }}
-            }}
-        </script>
-    </body>
-    </html>
-    '''
+    """Debug page; token status and recent API calls load from /api/debug-info"""
+    return assets.response('debug.html')
 
 @app.route('/dashboard')
 def dashboard():
-    return '''
-<!DOCTYPE html>
-<html>
-<head>
-    <title>Debug Dashboard</title>
-    <style>
-        body { font-family: Arial; margin: 0; padding: 20px; background: #f5f5f5; }
-        .container { max-width: 1200px; margin: 0 auto; }
-        .header { background: white; padding: 30px; border-radius: 10px; margin-bottom: 20px; text-align: center; }
-        .controls { background: white; padding: 20px; border-radius: 10px; margin-bottom: 20px; }
-        .metrics { display: grid; grid-template-columns: repeat(auto-fit, minmax(250px, 1fr)); gap: 20px; }
-        .metric { background: white; padding: 25px; border-radius: 10px; text-align: center; box-shadow: 0 2px 4px rgba(0,0,0,0.1); }
-        .metric-value { font-size: 2.5em; font-weight: bold; color: #667eea; margin-bottom: 10px; }
-        .metric-label { color: #666; font-weight: 500; }
-        .metric-sub { color: #999; font-size: 0.9em; margin-top: 5px; }
-        button { background: #667eea; color: white; border: none; padding: 12px 24px; border-radius: 5px; cursor: pointer; margin: 5px; font-weight: 500; }
-        button:hover { background: #5a6fd8; }
-        select { padding: 10px; border: 1px solid #ddd; border-radius: 5px; margin: 5px; }
-        .status { padding: 10px; margin: 10px 0; border-radius: 5px; }
-        .success { background: #d4edda; color: #155724; border: 1px solid #c3e6cb; }
-        .error { background: #f8d7da; color: #721c24; border: 1px solid #f5c6cb; }
-        .debug-section { background: #fff3cd; color: #856404; border: 1px solid #ffeaa7; padding: 15px; margin: 10px 0; border-radius: 5px; }
-    </style>
-</head>
-<body>
-    <div class="container">
-        <div class="header">
-            <h1>🔍 Debug Dashboard</h1>
-            <p>Let's see exactly what's happening with the API calls</p>
-        </div>
-
-        <div class="controls">
-            <label>Location:</label>
-            <select id="locationFilter">
-                <option value="all">Loading locations...</option>
-            </select>
-            
-            <button onclick="loadDashboard()">🔄 Refresh Data</button>
-            <button onclick="testLocationToken()">🔑 Test Location Token</button>
-            <button onclick="debugLocationsCall()">📍 Debug Locations</button>
-            <button onclick="debugContactsCall()">👥 Debug Contacts (Old Method)</button>
-        </div>
-
-        <div id="status"></div>
-        
-        <div class="debug-section">
-            <h3>🛠️ Debug Information</h3>
-            <div id="debugInfo">Click debug buttons to see detailed API responses...</div>
-        </div>
-
-        <div class="metrics" id="metricsGrid">
-            <div class="metric">
-                <div class="metric-value">Loading...</div>
-                <div class="metric-label">Please wait</div>
-            </div>
-        </div>
-    </div>
-
-    <script>
-        let currentData = {};
-
-        document.addEventListener('DOMContentLoaded', function() {
-            loadLocations();
-            loadDashboard();
-        });
-
-        function showStatus(message, type = 'success') {
-            const statusDiv = document.getElementById('status');
-            statusDiv.innerHTML = '<div class="' + type + '">' + message + '</div>';
-            setTimeout(() => statusDiv.innerHTML = '', 10000);
-        }
-        
-        function showDebugInfo(info) {
-            document.getElementById('debugInfo').innerHTML = '<pre>' + JSON.stringify(info, null, 2) + '</pre>';
-        }
-
-        async function loadLocations() {
-            try {
-                const response = await fetch('/api/locations');
-                const locations = await response.json();
-                
-                const select = document.getElementById('locationFilter');
-                select.innerHTML = '<option value="all">All Locations (' + locations.length + ')</option>';
-                
-                locations.forEach(location => {
-                    const option = document.createElement('option');
-                    option.value = location.id;
-                    option.textContent = location.name;
-                    select.appendChild(option);
-                });
-                
-                showStatus('Loaded ' + locations.length + ' locations');
-            } catch (error) {
-                showStatus('Error loading locations: ' + error.message, 'error');
-            }
-        }
-
-        async function loadDashboard() {
-            try {
-                const locationId = document.getElementById('locationFilter').value;
-                const response = await fetch('/api/stats?location=' + locationId);
-                currentData = await response.json();
-                
-                updateMetrics();
-                showStatus('Dashboard data loaded');
-            } catch (error) {
-                showStatus('Error loading dashboard: ' + error.message, 'error');
-            }
-        }
-
-        function updateMetrics() {
-            const metricsGrid = document.getElementById('metricsGrid');
-            
-            const metrics = [
-                { 
-                    label: 'Total Contacts', 
-                    value: currentData.total_contacts || 0,
-                    sub: 'Database count'
-                },
-                { 
-                    label: 'With Phone', 
-                    value: currentData.contacts_with_phone || 0,
-                    sub: (currentData.phone_rate || 0) + '% of total'
-                },
-                { 
-                    label: 'With Email', 
-                    value: currentData.contacts_with_email || 0,
-                    sub: (currentData.email_rate || 0) + '% of total'
-                },
-                { 
-                    label: 'Complete Contacts', 
-                    value: currentData.contacts_with_both || 0,
-                    sub: 'Both phone & email'
-                }
-            ];
-
-            metricsGrid.innerHTML = '';
-            
-            metrics.forEach(function(metric) {
-                const card = document.createElement('div');
-                card.className = 'metric';
-                card.innerHTML = 
-                    '<div class="metric-value">' + metric.value + '</div>' +
-                    '<div class="metric-label">' + metric.label + '</div>' +
-                    '<div class="metric-sub">' + metric.sub + '</div>';
-                metricsGrid.appendChild(card);
-            });
-            
-            // Show sample contacts if available
-            if (currentData.sample_contacts && currentData.sample_contacts.length > 0) {
-                const sampleDiv = document.createElement('div');
-                sampleDiv.className = 'debug-section';
-                sampleDiv.innerHTML = '<h4>📋 Sample Contacts:</h4>' + 
-                    currentData.sample_contacts.map(c => '<p>' + c + '</p>').join('');
-                metricsGrid.appendChild(sampleDiv);
-            }
-        }
-
-        async function testLocationToken() {
-            try {
-                const locationId = document.getElementById('locationFilter').value;
-                if (locationId === 'all') {
-                    showStatus('Please select a specific location to test location token', 'error');
-                    return;
-                }
-                
-                showStatus('🔑 Testing location token exchange...', 'success');
-                const response = await fetch('/api/test-location-token', { 
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({ location_id: locationId })
-                });
-                const result = await response.json();
-                
-                showDebugInfo(result);
-                
-                const diagnosis = result.diagnosis || {};
-                
-                if (diagnosis.token_exchange_worked && diagnosis.contacts_api_worked) {
-                    showStatus('🎉 SUCCESS! Location token works - Found ' + diagnosis.contacts_found + ' contacts!');
-                    loadDashboard(); // Refresh to show new data
-                } else if (diagnosis.token_exchange_worked) {
-                    showStatus('✅ Token exchange worked, but contacts API still failed', 'error');
-                } else {
-                    showStatus('❌ Location token exchange failed', 'error');
-                }
-            } catch (error) {
-                showStatus('Location token test error: ' + error.message, 'error');
-            }
-        }
-
-        async function debugLocationsCall() {
-            try {
-                showStatus('Debugging locations API...', 'success');
-                const response = await fetch('/api/debug-locations', { method: 'POST' });
-                const result = await response.json();
-                
-                showDebugInfo(result);
-                
-                if (result.locations_found > 0) {
-                    showStatus('✅ Found ' + result.locations_found + ' locations');
-                    loadLocations(); // Refresh location dropdown
-                } else {
-                    showStatus('❌ No locations found - check debug info', 'error');
-                }
-            } catch (error) {
-                showStatus('Locations debug error: ' + error.message, 'error');
-            }
-        }
-
-        async function debugContactsCall() {
-            try {
-                const locationId = document.getElementById('locationFilter').value;
-                if (locationId === 'all') {
-                    showStatus('Please select a specific location to debug contacts', 'error');
-                    return;
-                }
-                
-                showStatus('Debugging contacts API for selected location...', 'success');
-                const response = await fetch('/api/debug-contacts', { 
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({ location_id: locationId })
-                });
-                const result = await response.json();
-                
-                showDebugInfo(result);
-                
-                if (result.contacts_found > 0) {
-                    showStatus('✅ Found ' + result.contacts_found + ' contacts');
-                    loadDashboard(); // Refresh dashboard
-                } else {
-                    showStatus('❌ No contacts found - check debug info', 'error');
-                }
-            } catch (error) {
-                showStatus('Contacts debug error: ' + error.message, 'error');
-            }
-        }
-    </script>
-</body>
-</html>
-    '''
+    return assets.response('dashboard.html')
 
 @app.route('/oauth/callback')
 def oauth_callback():
@@ -1160,7 +4208,7 @@ def oauth_callback():
         return "<h1>No authorization code received</h1>"
     
     try:
-        resp = requests.post("https://services.leadconnectorhq.com/oauth/token", data={
+        resp = ghl_request('POST', '/oauth/token', data={
             "grant_type": "authorization_code", "client_id": CLIENT_ID,
             "client_secret": CLIENT_SECRET, "code": code, "redirect_uri": REDIRECT_URI
         })
@@ -1169,7 +4217,9 @@ def oauth_callback():
         if "error" in tokens:
             return f"<h1>Token Error</h1><p>{tokens.get('error_description')}</p>"
         
-        client_key = tokens.get('companyId') or tokens.get('locationId')
+        # Sub-account installs carry both ids; keying them by location keeps them
+        # from overwriting their agency's install
+        client_key = tokens.get('locationId') or tokens.get('companyId')
         expires_at = datetime.now() + timedelta(seconds=tokens.get('expires_in', 3600))
         
         conn = sqlite3.connect(analytics.db_path)
@@ -1235,7 +4285,7 @@ def oauth_callback():
 # API Routes
 @app.route('/api/locations')
 def api_locations():
-    locations = analytics.get_locations()
+    locations = analytics.get_locations(requested_company_id())
     return jsonify(locations)
 
 @app.route('/api/stats')
@@ -1244,19 +4294,161 @@ def api_stats():
     stats = analytics.get_basic_stats(location_id)
     return jsonify(stats)
 
+@app.route('/api/search')
+def api_search():
+    query = request.args.get('q', '').strip()
+    location_id = request.args.get('location', 'all')
+    limit = min(max(request.args.get('limit', 20, type=int), 1), SEARCH_MAX_LIMIT)
+    offset = min(max(request.args.get('offset', 0, type=int), 0), SEARCH_MAX_OFFSET)
+    
+    if not query:
+        return jsonify({'status': 'error', 'message': 'q is required'}), 400
+    
+    results, has_more = analytics.search_contacts(query, location_id, limit, offset)
+    return jsonify({
+        'query': query,
+        'location_id': location_id,
+        'results': results,
+        'limit': limit,
+        'offset': offset,
+        'next_offset': offset + limit if has_more and offset + limit <= SEARCH_MAX_OFFSET else None
+    })
+
+@app.route('/api/timeseries')
+def api_timeseries():
+    location_id = request.args.get('location', 'all')
+    bucket = request.args.get('bucket', 'day')
+    if bucket not in TIMESERIES_DEFAULT_SPAN:
+        return jsonify({'status': 'error', 'message': 'bucket must be hour, day or week'}), 400
+    
+    tz_name = request.args.get('tz')
+    tz = load_timezone(tz_name or (analytics.location_directory.get(location_id) or {}).get('timezone'))
+    
+    # Naive from/to values are local to the bucket timezone
+    start, end = parse_time_param(request.args.get('from'), tz), parse_time_param(request.args.get('to'), tz)
+    if start is False or end is False or (start and end and start >= end):
+        return jsonify({'status': 'error', 'message': 'from/to must be ISO timestamps or epoch seconds, from before to'}), 400
+    
+    return jsonify(analytics.timeseries(location_id, bucket, start, end, tz_name))
+
+@app.route('/api/sources')
+def api_sources():
+    location_id = request.args.get('location', 'all')
+    top = min(max(request.args.get('top', SOURCES_DEFAULT_TOP, type=int), 1), SOURCES_MAX_TOP)
+    start, end = parse_time_param(request.args.get('from')), parse_time_param(request.args.get('to'))
+    if start is False or end is False:
+        return jsonify({'status': 'error', 'message': 'from/to must be ISO timestamps or epoch seconds'}), 400
+    
+    return jsonify(analytics.source_breakdown(location_id, start, end, top))
+
+@app.route('/api/leaderboard')
+def api_leaderboard():
+    sort = request.args.get('sort', 'total_contacts')
+    if sort not in LEADERBOARD_SORTS:
+        return jsonify({'status': 'error', 'message': f"sort must be one of {', '.join(LEADERBOARD_SORTS)}"}), 400
+    order = request.args.get('order', 'asc' if sort == 'name' else 'desc')
+    top = request.args.get('top', type=int)
+    
+    rows = analytics.leaderboard(sort, order != 'asc', max(top, 1) if top else None)
+    return jsonify({'sort': sort, 'order': order, 'locations': rows})
+
+@app.route('/api/changes')
+def api_changes():
+    after = max(request.args.get('after', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', CHANGES_DEFAULT_LIMIT, type=int), 1), CHANGES_MAX_LIMIT)
+    include_contacts = request.args.get('include') == 'contact'
+    
+    events, oldest_seq, latest_seq = analytics.changes(after, limit, requested_company_id(), include_contacts)
+    return jsonify({
+        'after': after,
+        'events': events,
+        'next_after': events[-1]['seq'] if events else after,
+        'has_more': bool(events) and events[-1]['seq'] < latest_seq,
+        'latest_seq': latest_seq,
+        # Events between `after` and the oldest retained one were pruned: consumers must resync
+        'resync_required': after < (oldest_seq - 1 if oldest_seq is not None else latest_seq),
+        'retention_days': CHANGES_RETENTION_DAYS
+    })
+
+@app.route('/api/activity')
+def api_activity():
+    """Message activity for one location: contacts awaiting a reply and recent traffic"""
+    location_id = request.args.get('location')
+    if not location_id or location_id == 'all':
+        return jsonify({'status': 'error', 'message': 'location is required'}), 400
+    return jsonify(analytics.activity_summary(location_id))
+
+@app.route('/api/tasks/overdue')
+def api_tasks_overdue():
+    """Overdue open tasks for one location, keyset paged with after=<cursor of the last task>"""
+    location_id = request.args.get('location')
+    if not location_id or location_id == 'all':
+        return jsonify({'status': 'error', 'message': 'location is required'}), 400
+    limit = min(max(request.args.get('limit', TASKS_DEFAULT_LIMIT, type=int), 1), TASKS_MAX_LIMIT)
+    
+    after = None
+    if request.args.get('after'):
+        due, _, task_id = request.args['after'].partition(':')
+        if not due.lstrip('-').isdigit() or not task_id:
+            return jsonify({'status': 'error', 'message': 'after must be a task cursor'}), 400
+        after = (int(due), task_id)
+    
+    tasks, synced_at = analytics.overdue_tasks(location_id, after, limit + 1)
+    return jsonify({
+        'location_id': location_id,
+        'tasks': tasks[:limit],
+        'next_after': tasks[limit - 1]['cursor'] if len(tasks) > limit else None,
+        'synced_at': synced_at
+    })
+
+@app.route('/api/duplicates')
+def api_duplicates():
+    kind = request.args.get('kind') or None
+    location_id = request.args.get('location', 'all')
+    min_locations = max(request.args.get('min_locations', 2, type=int), 1)
+    limit = min(max(request.args.get('limit', 50, type=int), 1), SEARCH_MAX_LIMIT)
+    offset = min(max(request.args.get('offset', 0, type=int), 0), SEARCH_MAX_OFFSET)
+    
+    if kind and kind not in IDENTITY_COLUMNS:
+        return jsonify({'status': 'error', 'message': 'kind must be phone or email'}), 400
+    
+    groups, has_more = analytics.find_duplicates(kind, location_id, min_locations, limit, offset)
+    return jsonify({
+        'kind': kind or 'all',
+        'location_id': location_id,
+        'min_locations': min_locations,
+        'groups': groups,
+        'limit': limit,
+        'offset': offset,
+        'next_offset': offset + limit if has_more and offset + limit <= SEARCH_MAX_OFFSET else None
+    })
+
 @app.route('/api/test-location-token', methods=['POST'])
 def api_test_location_token():
+    """Queue the location token exchange and contacts API test"""
+    data = request.json or {}
+    location_id = data.get('location_id', 'BV8MI0tF6PLcMoYERYYU')  # Default test location
+    
+    job_id = jobs.submit('test_location_token', {'location_id': location_id, 'company_id': data.get('company_id')})
+    return jsonify({
+        'status': 'queued',
+        'job_id': job_id,
+        'status_url': f'/api/jobs/{job_id}',
+        'test_location_id': location_id
+    }), 202
+
+@jobs.handler('test_location_token')
+def run_test_location_token(payload):
     """Test the location token exchange and contacts API"""
-    token_data = get_valid_token()
+    location_id = payload['location_id']
+    token_data = get_valid_token(company_id=payload.get('company_id'), location_id=location_id)
     if not token_data:
-        return jsonify({'status': 'error', 'message': 'No valid token found'})
+        return {'status': 'error', 'message': 'No valid token found'}
     
-    data = request.json or {}
-    location_id = data.get('location_id', 'BV8MI0tF6PLcMoYERYYU')  # Default test location
     company_id = token_data.get('company_id')
     
     if not company_id:
-        return jsonify({'status': 'error', 'message': 'No company ID found'})
+        return {'status': 'error', 'message': 'No company ID found'}
     
     # Test the location token exchange
     result = analytics.test_with_location_token(
@@ -1265,7 +4457,7 @@ def api_test_location_token():
         location_id
     )
     
-    return jsonify({
+    return {
         'status': 'success',
         'message': 'Location token test completed',
         'agency_token_company_id': company_id,
@@ -1276,12 +4468,12 @@ def api_test_location_token():
             'contacts_api_worked': result.get('contacts_test', {}).get('success', False),
             'contacts_found': result.get('contacts_test', {}).get('contacts_found', 0)
         }
-    })
+    }
 
 @app.route('/api/debug-locations', methods=['POST'])
 def api_debug_locations():
     """Debug locations API"""
-    token_data = get_valid_token()
+    token_data = get_valid_token(company_id=requested_company_id())
     if not token_data:
         return jsonify({'status': 'error', 'message': 'No valid token found'})
     
@@ -1293,21 +4485,7 @@ def api_debug_locations():
     
     # Save found locations to database
     if locations:
-        conn = sqlite3.connect(analytics.db_path)
-        cursor = conn.cursor()
-        
-        for loc in locations:
-            location_id = loc.get('_id') or loc.get('id') or loc.get('locationId')
-            location_name = loc.get('name', 'Unknown Location')
-            
-            cursor.execute('''
-                INSERT OR REPLACE INTO locations 
-                (location_id, location_name, company_id, last_synced)
-                VALUES (?, ?, ?, ?)
-            ''', (location_id, location_name, company_id, datetime.now()))
-        
-        conn.commit()
-        conn.close()
+        analytics.save_locations(locations, company_id)
     
     return jsonify({
         'status': 'success',
@@ -1319,29 +4497,50 @@ def api_debug_locations():
 
 @app.route('/api/debug-contacts', methods=['POST'])
 def api_debug_contacts():
-    """Enhanced contacts debug with comprehensive API testing"""
-    token_data = get_valid_token()
-    if not token_data:
-        return jsonify({'status': 'error', 'message': 'No valid token found'})
-    
-    data = request.json
+    """Queue the contacts debug run"""
+    data = request.json or {}
     location_id = data.get('location_id')
     
     if not location_id:
         return jsonify({'status': 'error', 'message': 'Location ID required'})
     
-    contacts = analytics.debug_contacts_api(token_data['access_token'], location_id)
+    job_id = jobs.submit('debug_contacts', {'location_id': location_id, 'company_id': data.get('company_id')})
+    return jsonify({
+        'status': 'queued',
+        'job_id': job_id,
+        'status_url': f'/api/jobs/{job_id}',
+        'location_id': location_id
+    }), 202
+
+@jobs.handler('debug_contacts')
+def run_debug_contacts(payload):
+    """Enhanced contacts debug with comprehensive API testing"""
+    location_id = payload['location_id']
+    if location_id == 'all':
+        token_data = get_valid_token(company_id=payload.get('company_id'))
+    else:
+        token_data = get_valid_token(company_id=payload.get('company_id'), location_id=location_id)
+    if not token_data:
+        return {'status': 'error', 'message': 'No valid token found'}
+    
+    if location_id == 'all':
+        summaries = analytics.debug_all_locations_contacts(token_data['access_token'], token_data.get('company_id'))
+        return {
+            'status': 'success',
+            'mode': 'all_locations',
+            'locations_tested': len(summaries),
+            'locations_with_contacts': sum(1 for s in summaries if s['contacts_found'] > 0),
+            'contacts_found': sum(s['contacts_found'] for s in summaries),
+            'locations': summaries,
+            'message': f'Tested {len(summaries)} locations'
+        }
     
-    # Get the detailed results from the debug
-    detailed_results = getattr(analytics, 'last_debug_results', [])
+    contacts, detailed_results = analytics.debug_contacts_api(token_data['access_token'], location_id)
     
-    # Save found contacts to database
-    saved_count = 0
-    for contact in contacts:
-        if analytics.add_contact(contact, location_id):
-            saved_count += 1
+    # Save found contacts to database; an empty result has nothing to write
+    saved_count = analytics.add_contacts(contacts, location_id) if contacts else 0
     
-    return jsonify({
+    return {
         'status': 'success',
         'contacts_found': len(contacts),
         'contacts_saved': saved_count,
@@ -1365,39 +4564,158 @@ def api_debug_contacts():
             "Try the 'All Contacts' test to see if any contacts exist anywhere",
             "Check if contacts are in a different status/stage"
         ]
+    }
+
+@app.route('/api/tasks/refresh', methods=['POST'])
+def api_tasks_refresh():
+    """Queue an immediate open-task refresh for one location"""
+    data = request.json or {}
+    location_id = data.get('location_id')
+    if not location_id:
+        return jsonify({'status': 'error', 'message': 'Location ID required'})
+    
+    job_id = jobs.submit('sync_tasks', {'location_id': location_id, 'company_id': data.get('company_id')})
+    return jsonify({'status': 'queued', 'job_id': job_id, 'status_url': f'/api/jobs/{job_id}'}), 202
+
+@jobs.handler('sync_tasks')
+def run_sync_tasks(payload):
+    location_id = payload['location_id']
+    company_id = payload.get('company_id') or (analytics.location_directory.get(location_id) or {}).get('company_id')
+    access_token = get_location_access_token(location_id, company_id)
+    if not access_token:
+        return {'status': 'error', 'message': 'No valid token for location'}
+    return analytics.sync_location_tasks(access_token, location_id, force=True)
+
+@app.route('/api/reconcile', methods=['POST'])
+def api_reconcile():
+    """Queue a deleted-contact reconcile for one location"""
+    data = request.json or {}
+    location_id = data.get('location_id')
+    if not location_id:
+        return jsonify({'status': 'error', 'message': 'Location ID required'})
+    
+    job_id = jobs.submit('reconcile_contacts', {
+        'location_id': location_id, 'company_id': data.get('company_id'), 'force': bool(data.get('force'))
+    })
+    return jsonify({
+        'status': 'queued',
+        'job_id': job_id,
+        'status_url': f'/api/jobs/{job_id}',
+        'location_id': location_id
+    }), 202
+
+@jobs.handler('reconcile_contacts')
+def run_reconcile_contacts(payload):
+    """Remove contacts deleted in GHL from one location and refresh edited ones"""
+    location_id = payload['location_id']
+    company_id = payload.get('company_id') or (analytics.location_directory.get(location_id) or {}).get('company_id')
+    access_token = get_location_access_token(location_id, company_id)
+    if not access_token:
+        return {'status': 'error', 'message': 'No valid token for location'}
+    
+    return analytics.reconcile_location_contacts(access_token, location_id, force=payload.get('force', False))
+
+@app.route('/api/import-contacts', methods=['POST'])
+def api_import_contacts():
+    """Upload a GHL contacts CSV export for one location; the import runs as a job"""
+    location_id = request.form.get('location_id') or request.args.get('location_id')
+    upload = request.files.get('file')
+    if not location_id or not upload:
+        return jsonify({'status': 'error', 'message': 'location_id and a CSV file are required'}), 400
+    
+    # Job workers share the database's filesystem, so the upload waits beside it
+    import_dir = IMPORT_DIR or os.path.join(os.path.dirname(os.path.abspath(analytics.db_path)), 'imports')
+    os.makedirs(import_dir, exist_ok=True)
+    path = os.path.join(import_dir, f"{uuid.uuid4().hex}.csv")
+    upload.save(path)
+    
+    job_id = jobs.submit('import_contacts_csv', {'location_id': location_id, 'path': path})
+    return jsonify({
+        'status': 'queued',
+        'job_id': job_id,
+        'status_url': f'/api/jobs/{job_id}',
+        'location_id': location_id,
+        'bytes': os.path.getsize(path)
+    }), 202
+
+def remove_import_upload(payload):
+    if os.path.exists(payload['path']):
+        os.remove(payload['path'])
+
+@jobs.handler('import_contacts_csv', cleanup=remove_import_upload)
+def run_import_contacts_csv(payload):
+    """Import an uploaded CSV, reporting progress as the job's result until it finishes"""
+    with open(payload['path'], newline='', encoding='utf-8-sig') as f:
+        return analytics.import_contacts_csv(f, payload['location_id'], on_progress=jobs.progress)
+
+@app.route('/api/debug-info')
+def api_debug_info():
+    """Token status and the most recent GHL calls for the /debug page"""
+    token_data = get_valid_token(company_id=requested_company_id())
+    limit = min(max(request.args.get('limit', DEBUG_LOGS_DEFAULT_LIMIT, type=int), 1), DEBUG_LOGS_MAX_LIMIT)
+    return jsonify({
+        'token_available': bool(token_data),
+        'company_id': token_data.get('company_id') if token_data else None,
+        'recent_api_calls': analytics.get_debug_logs(limit)
     })
 
+@app.route('/api/jobs/<job_id>')
+def api_job_status(job_id):
+    job = jobs.get(job_id)
+    if not job:
+        return jsonify({'status': 'error', 'message': 'Job not found'}), 404
+    return jsonify(job)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/health')
 def health_check():
     try:
-        token_data = get_valid_token()
+        token_data = get_valid_token(company_id=requested_company_id())
         debug_logs = analytics.get_debug_logs(5)
         
+        def count_contacts(path):
+            conn = analytics.shards.connect(path)
+            count = conn.execute('SELECT COUNT(*) FROM contacts').fetchone()[0]
+            conn.close()
+            return count
+        
+        shard_counts = analytics.shards.map(count_contacts)
+        total_contacts = sum(shard_counts)
+        
         conn = sqlite3.connect(analytics.db_path)
         cursor = conn.cursor()
         
-        cursor.execute('SELECT COUNT(*) FROM contacts')
-        total_contacts = cursor.fetchone()[0]
-        
         cursor.execute('SELECT COUNT(*) FROM locations')
         total_locations = cursor.fetchone()[0]
         
+        cursor.execute('SELECT COUNT(*), COUNT(DISTINCT company_id) FROM oauth_tokens')
+        installations, companies = cursor.fetchone()
+        
         conn.close()
         
+        circuits = breakers.snapshot()
         return jsonify({
-            'status': 'healthy',
+            'status': 'degraded' if circuits['open'] or circuits['half_open'] else 'healthy',
             'timestamp': datetime.now().isoformat(),
             'base_url': BASE_URL,
             'version': 'Debug v1.0 - API TROUBLESHOOTING',
             'database_health': {
                 'total_contacts': total_contacts,
-                'total_locations': total_locations
+                'total_locations': total_locations,
+                'shards': len(shard_counts)
             },
             'oauth_status': 'valid' if token_data else 'missing',
+            'installations': {'total': installations, 'companies': companies},
             'company_id': token_data.get('company_id') if token_data else None,
+            'ghl_circuits': circuits,
+            'fingerprint_index': analytics.fingerprints.stats(),
             'recent_api_calls': debug_logs,
             'debug_endpoints': [
                 f'{BASE_URL}/debug',
+                f'{BASE_URL}/api/debug-info',
                 f'{BASE_URL}/api/test-connection',
                 f'{BASE_URL}/api/debug-locations',
                 f'{BASE_URL}/api/debug-contacts'
@@ -0,0 +1,390 @@
+# asgi.py - async serving mode
+#
+#   gunicorn asgi:application -k uvicorn.workers.UvicornWorker -w 2
+#
+# GHL-bound routes are served natively here and await their network I/O on a
+# shared httpx client, so one process can hold thousands of in-flight GHL calls
+# and SSE streams. Every other route falls through to the Flask app unchanged,
+# so JSON contracts are identical in both modes.
+import asyncio
+import json
+import os
+import time
+import httpx
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from flask import Response, jsonify
+from werkzeug.test import EnvironBuilder
+
+from app import (
+    app, analytics, jobs, metrics, log, rate_limiter, breakers, get_valid_token, get_location_access_token,
+    normalize_endpoint, request_tenant, requested_company_id, record_span,
+    SyncScheduler, GHLSyncError, CircuitOpenError, LeaseLostError,
+    APP_ID, GHL_API_BASE, GHL_API_VERSION, GHL_TIMEOUT, SYNC_PAGE_SIZE
+)
+
+ASYNC_MAX_CONNECTIONS = int(os.getenv('ASYNC_MAX_CONNECTIONS', '100'))
+ASYNC_WSGI_THREADS = int(os.getenv('ASYNC_WSGI_THREADS', '32'))  # Flask requests in flight per process
+
+wsgi_executor = ThreadPoolExecutor(max_workers=ASYNC_WSGI_THREADS, thread_name_prefix='wsgi')
+
+class PooledWsgiInstance(WsgiToAsgiInstance):
+    """WsgiToAsgiInstance that runs the Flask app on wsgi_executor
+    
+    asgiref's own run_wsgi_app is thread_sensitive, which puts every request that
+    falls through to Flask on one shared thread per process.
+    """
+    run_wsgi_app = sync_to_async(WsgiToAsgiInstance.__dict__['run_wsgi_app'].func,
+                                 thread_sensitive=False, executor=wsgi_executor)
+
+class PooledWsgiToAsgi(WsgiToAsgi):
+    async def __call__(self, scope, receive, send):
+        await PooledWsgiInstance(self.wsgi_application)(scope, receive, send)
+
+flask_app = PooledWsgiToAsgi(app)
+client = None
+
+async def ghl_request_async(method, path, retries=3, tenant=None, **kwargs):
+    """Async twin of app.ghl_request, drawing on the same rate limiter and circuit breakers"""
+    url = path if path.startswith('http') else f"{GHL_API_BASE}{path}"
+    endpoint = f"{method} {normalize_endpoint(url)}"
+    breaker = breakers.get(endpoint, tenant or request_tenant(kwargs))
+    probe = breaker.before_call()
+    recorded = False
+    
+    try:
+        for attempt in range(retries + 1):
+            waited = 0.0
+            while (delay := rate_limiter.try_acquire()) > 0:
+                await asyncio.sleep(delay)
+                waited += delay
+            metrics.observe('ghl_rate_limit_wait_seconds', waited)
+            
+            started = time.perf_counter()
+            try:
+                resp = await client.request(method, url, **kwargs)
+            except httpx.HTTPError:
+                metrics.observe('ghl_request_duration_seconds', time.perf_counter() - started,
+                                endpoint=endpoint, status='error')
+                breaker.record(False, time.perf_counter() - started, probe)
+                recorded = True
+                raise
+            elapsed = time.perf_counter() - started
+            metrics.observe('ghl_request_duration_seconds', elapsed,
+                            endpoint=endpoint, status=str(resp.status_code))
+            record_span('ghl', endpoint, elapsed)
+            if resp.status_code != 429:
+                breaker.record(resp.status_code < 500, elapsed, probe)
+                recorded = True
+                return resp
+            if attempt == retries:
+                return resp
+            
+            retry_after = resp.headers.get('Retry-After')
+            delay = float(retry_after) if retry_after and retry_after.isdigit() else 2 ** attempt
+            log.warning('ghl_rate_limited', endpoint=endpoint, retry_in=delay, attempt=attempt + 1, per_second=1)
+            await asyncio.sleep(delay)
+    finally:
+        if not recorded:
+            breaker.release(probe)
+
+async def fetch_locations(access_token, company_id):
+    """Same lookups as DebugLeadAnalytics.debug_locations_api, without blocking a thread"""
+    headers = {"Authorization": f"Bearer {access_token}", "Version": "2021-04-15"}
+    
+    attempts = [
+        ('/oauth/installedLocations', {"companyId": company_id, "appId": APP_ID, "isInstalled": "true"}),
+        ('/locations/', {"companyId": company_id})
+    ]
+    for path, params in attempts:
+        try:
+            resp = await ghl_request_async('GET', path, headers=headers, params=params)
+        except (httpx.HTTPError, CircuitOpenError) as e:
+            log.error('locations_probe_error', approach=path, error=str(e))
+            continue
+        
+        await asyncio.to_thread(analytics.log_api_call, f"{GHL_API_BASE}{path}", "GET",
+                                resp.status_code, params, resp.text[:1000])
+        if resp.status_code == 200:
+            return resp.json().get('locations', [])
+        log.warning('locations_probe_failed', approach=path, status=resp.status_code, body=resp.text[:200])
+    
+    return []
+
+async def sync_location_contacts_async(access_token, location_id, cursor=None, on_page=None):
+    """Async twin of DebugLeadAnalytics.sync_location_contacts"""
+    headers = {"Authorization": f"Bearer {access_token}", "Version": GHL_API_VERSION}
+    start_after, start_after_id = cursor or (None, None)
+    written = 0
+    
+    while True:
+        params = {"locationId": location_id, "limit": SYNC_PAGE_SIZE}
+        if start_after_id:
+            params["startAfter"] = start_after
+            params["startAfterId"] = start_after_id
+        
+        resp = await ghl_request_async('GET', '/contacts/', headers=headers, params=params)
+        if resp.status_code != 200:
+            raise GHLSyncError(f"HTTP {resp.status_code}: {resp.text[:200]}")
+        
+        data = resp.json()
+        contacts = data.get('contacts', [])
+        if not contacts:
+            break
+        
+        written += await asyncio.to_thread(analytics.add_contacts, contacts, location_id)
+        
+        meta = data.get('meta', {})
+        if meta.get('startAfterId'):
+            start_after, start_after_id = meta.get('startAfter'), meta.get('startAfterId')
+        else:
+            start_after, start_after_id = contacts[-1].get('dateAdded'), contacts[-1].get('id')
+        
+        if on_page:
+            await asyncio.to_thread(on_page, (start_after, start_after_id))
+        
+        if len(contacts) < SYNC_PAGE_SIZE:
+            break
+    
+    return written, (start_after, start_after_id)
+
+class AsyncSyncScheduler(SyncScheduler):
+    """SyncScheduler that runs each location sync as a task instead of a thread
+    
+    Shares the sync_schedule leases with the threaded scheduler, so both kinds of
+    worker can run against the same database.
+    """
+    async def run_job_async(self, location_id):
+        state = await asyncio.to_thread(self.load_state, location_id)
+        try:
+            access_token = await asyncio.to_thread(get_location_access_token, location_id, state['company_id'])
+            if not access_token:
+                raise GHLSyncError("No valid token for location")
+            
+            written, _ = await sync_location_contacts_async(
+                access_token, location_id,
+                cursor=state['cursor'],
+                on_page=lambda c: self.save_cursor(location_id, c)
+            )
+            # Activity sync still calls GHL synchronously; it runs on the scheduler's own
+            # pool (one thread per slot) so minutes-long syncs can't starve to_thread
+            await asyncio.get_running_loop().run_in_executor(self.executor, self.sync_activity, access_token, location_id)
+        except CircuitOpenError as e:
+            await asyncio.to_thread(self.defer, location_id, e)
+            return
+        except LeaseLostError as e:
+            log.warning('sync_lease_lost', location_id=location_id, worker_id=self.worker_id, error=str(e))
+            return
+        except Exception as e:
+            await asyncio.to_thread(self.record_failure, location_id, state, e)
+            return
+        
+        await asyncio.to_thread(self.record_success, location_id, state, written)
+    
+    async def run_async(self, poll_interval=1.0, seed_interval=60):
+        global client
+        client = client or httpx.AsyncClient(timeout=GHL_TIMEOUT, limits=httpx.Limits(max_connections=self.concurrency))
+        log.info('scheduler_started', worker_id=self.worker_id, slots=self.concurrency, mode='async')
+        last_seed = 0
+        
+        while not self.stopping.is_set():
+            if time.time() - last_seed >= seed_interval:
+                await asyncio.to_thread(self.seed)
+                last_seed = time.time()
+            
+            for location_id, task in list(self.running.items()):
+                if task.done():
+                    del self.running[location_id]
+            
+            free = self.concurrency - len(self.running)
+            if free > 0:
+                for location_id in await asyncio.to_thread(self.claim, free):
+                    self.running[location_id] = asyncio.create_task(self.run_job_async(location_id))
+            
+            await asyncio.sleep(poll_interval)
+        
+        if self.running:
+            await asyncio.gather(*self.running.values(), return_exceptions=True)
+        log.info('scheduler_stopped', worker_id=self.worker_id, mode='async')
+
+class JobWatcher:
+    """Fans job status out to SSE clients with one SQLite poll per tick, not one per client"""
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self.watchers = {}
+        self.task = None
+    
+    def poll(self, job_ids):
+        conn = analytics.connect()
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT id, status FROM jobs WHERE id IN ({','.join('?' * len(job_ids))})", job_ids)
+        statuses = dict(cursor.fetchall())
+        conn.close()
+        return statuses
+    
+    async def run(self):
+        while self.watchers:
+            statuses = await asyncio.to_thread(self.poll, list(self.watchers))
+            for job_id, queues in list(self.watchers.items()):
+                for queue in queues:
+                    queue.put_nowait(statuses.get(job_id))
+            await asyncio.sleep(self.interval)
+        self.task = None
+    
+    def watch(self, job_id):
+        queue = asyncio.Queue()
+        self.watchers.setdefault(job_id, set()).add(queue)
+        if not self.task:
+            self.task = asyncio.create_task(self.run())
+        return queue
+    
+    def unwatch(self, job_id, queue):
+        queues = self.watchers.get(job_id, set())
+        queues.discard(queue)
+        if not queues:
+            self.watchers.pop(job_id, None)
+
+job_watcher = JobWatcher()
+
+# Routes
+#
+# Native routes run inside a Flask request context and return Flask responses,
+# so they get the same before/after_request hooks (Server-Timing, slow-request
+# log, ?profile=1) and jsonify output as the routes served through WsgiToAsgi.
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+def request_context(scope, body):
+    headers = [(name.decode('latin1'), value.decode('latin1')) for name, value in scope.get('headers', [])]
+    return app.request_context(EnvironBuilder(
+        method=scope['method'], path=scope['path'], query_string=scope.get('query_string', b'').decode('latin1'),
+        headers=headers, data=body
+    ).get_environ())
+
+async def send_start(send, response):
+    headers = [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in response.headers.items()]
+    await send({'type': 'http.response.start', 'status': response.status_code, 'headers': headers})
+
+def native(handler):
+    """Adapt `async def handler(send, receive, *args)` returning a Flask response to an ASGI route
+    
+    A handler that streams sends its own body after calling send_start on the
+    response it returns, and returns None when done.
+    """
+    async def route(scope, receive, send, *args):
+        ctx = request_context(scope, await read_body(receive))
+        ctx.push()
+        try:
+            response = app.preprocess_request()
+            if response is None:
+                response = await handler(send, receive, *args)
+            if response is not None:
+                response = app.process_response(app.make_response(response))
+                await send_start(send, response)
+                await send({'type': 'http.response.body', 'body': response.get_data()})
+        finally:
+            ctx.pop()
+    return route
+
+@native
+async def api_debug_locations(send, receive):
+    """Debug locations API"""
+    token_data = await asyncio.to_thread(get_valid_token, requested_company_id())
+    if not token_data:
+        return jsonify({'status': 'error', 'message': 'No valid token found'})
+    
+    company_id = token_data.get('company_id')
+    if not company_id:
+        return jsonify({'status': 'error', 'message': 'No company ID found in token'})
+    
+    locations = await fetch_locations(token_data['access_token'], company_id)
+    if locations:
+        await asyncio.to_thread(analytics.save_locations, locations, company_id)
+    
+    return jsonify({
+        'status': 'success',
+        'locations_found': len(locations),
+        'company_id': company_id,
+        'sample_locations': locations[:3] if locations else [],
+        'message': f'Found {len(locations)} locations'
+    })
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+@native
+async def api_job_events(send, receive, job_id):
+    """Server-sent events for a job: one event per status change, closing when it finishes
+    
+    The stream also closes when the client goes away or the job row disappears.
+    """
+    job = await asyncio.to_thread(jobs.get, job_id)
+    if not job:
+        return jsonify({'status': 'error', 'message': 'Job not found'}), 404
+    
+    # Headers go out now; Server-Timing covers the time to the first event
+    await send_start(send, app.process_response(Response(mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})))
+    
+    async def emit(job):
+        await send({'type': 'http.response.body', 'body': f"data: {json.dumps(job)}\n\n".encode(), 'more_body': True})
+    
+    await emit(job)
+    last_status = job['status']
+    queue = job_watcher.watch(job_id)
+    disconnect = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        while last_status not in ('done', 'error'):
+            update = asyncio.ensure_future(queue.get())
+            await asyncio.wait({update, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+            if disconnect.done():
+                update.cancel()
+                return
+            status = update.result()
+            if status is None:
+                log.warning('job_events_job_missing', job_id=job_id)
+                break
+            if status != last_status:
+                last_status = status
+                await emit(await asyncio.to_thread(jobs.get, job_id))
+    finally:
+        disconnect.cancel()
+        job_watcher.unwatch(job_id, queue)
+    
+    await send({'type': 'http.response.body', 'body': b''})
+
+ROUTES = {
+    ('POST', '/api/debug-locations'): api_debug_locations,
+}
+
+async def lifespan(receive, send):
+    global client
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            client = httpx.AsyncClient(timeout=GHL_TIMEOUT, limits=httpx.Limits(max_connections=ASYNC_MAX_CONNECTIONS))
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await client.aclose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    
+    if scope['type'] == 'http':
+        path = scope['path']
+        handler = ROUTES.get((scope['method'], path))
+        if handler:
+            return await handler(scope, receive, send)
+        if scope['method'] == 'GET' and path.startswith('/api/jobs/') and path.endswith('/events'):
+            return await api_job_events(scope, receive, send, path[len('/api/jobs/'):-len('/events')])
+    
+    await flask_app(scope, receive, send)
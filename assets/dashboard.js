@@ -0,0 +1,241 @@
+let currentData = {};
+
+document.addEventListener('DOMContentLoaded', function() {
+    loadLocations();
+    loadDashboard();
+});
+
+function showStatus(message, type = 'success') {
+    const statusDiv = document.getElementById('status');
+    statusDiv.innerHTML = '<div class="' + type + '">' + message + '</div>';
+    setTimeout(() => statusDiv.innerHTML = '', 10000);
+}
+
+function showDebugInfo(info) {
+    document.getElementById('debugInfo').innerHTML = '<pre>' + JSON.stringify(info, null, 2) + '</pre>';
+}
+
+// Slow GHL calls run as background jobs; poll until the job finishes
+async function runJob(url, body) {
+    const response = await fetch(url, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(body)
+    });
+    const queued = await response.json();
+    if (!queued.job_id) return queued;
+
+    while (true) {
+        await new Promise(resolve => setTimeout(resolve, 1000));
+        const job = await (await fetch('/api/jobs/' + queued.job_id)).json();
+        if (job.status === 'done') return job.result;
+        if (job.status === 'error') throw new Error(job.error);
+    }
+}
+
+async function loadLocations() {
+    try {
+        const response = await fetch('/api/locations');
+        const locations = await response.json();
+        
+        const select = document.getElementById('locationFilter');
+        select.innerHTML = '<option value="all">All Locations (' + locations.length + ')</option>';
+        
+        locations.forEach(location => {
+            const option = document.createElement('option');
+            option.value = location.id;
+            option.textContent = location.name;
+            select.appendChild(option);
+        });
+        
+        showStatus('Loaded ' + locations.length + ' locations');
+    } catch (error) {
+        showStatus('Error loading locations: ' + error.message, 'error');
+    }
+}
+
+async function loadDashboard() {
+    try {
+        const locationId = document.getElementById('locationFilter').value;
+        const response = await fetch('/api/stats?location=' + locationId);
+        currentData = await response.json();
+        
+        updateMetrics();
+        loadSources(locationId);
+        loadLeaderboard();
+        showStatus('Dashboard data loaded');
+    } catch (error) {
+        showStatus('Error loading dashboard: ' + error.message, 'error');
+    }
+}
+
+function updateMetrics() {
+    const metricsGrid = document.getElementById('metricsGrid');
+    
+    const metrics = [
+        { 
+            label: 'Total Contacts', 
+            value: currentData.total_contacts || 0,
+            sub: 'Database count'
+        },
+        { 
+            label: 'With Phone', 
+            value: currentData.contacts_with_phone || 0,
+            sub: (currentData.phone_rate || 0) + '% of total'
+        },
+        { 
+            label: 'With Email', 
+            value: currentData.contacts_with_email || 0,
+            sub: (currentData.email_rate || 0) + '% of total'
+        },
+        { 
+            label: 'Complete Contacts', 
+            value: currentData.contacts_with_both || 0,
+            sub: 'Both phone & email'
+        }
+    ];
+
+    metricsGrid.innerHTML = '';
+    
+    metrics.forEach(function(metric) {
+        const card = document.createElement('div');
+        card.className = 'metric';
+        card.innerHTML = 
+            '<div class="metric-value">' + metric.value + '</div>' +
+            '<div class="metric-label">' + metric.label + '</div>' +
+            '<div class="metric-sub">' + metric.sub + '</div>';
+        metricsGrid.appendChild(card);
+    });
+    
+    // Show sample contacts if available
+    if (currentData.sample_contacts && currentData.sample_contacts.length > 0) {
+        const sampleDiv = document.createElement('div');
+        sampleDiv.className = 'debug-section';
+        sampleDiv.innerHTML = '<h4>📋 Sample Contacts:</h4>' + 
+            currentData.sample_contacts.map(c => '<p>' + c + '</p>').join('');
+        metricsGrid.appendChild(sampleDiv);
+    }
+}
+
+async function loadSources(locationId) {
+    const breakdown = await (await fetch('/api/sources?location=' + encodeURIComponent(locationId))).json();
+    document.getElementById('sourcesTable').innerHTML =
+        '<tr><th>Source</th><th>Leads</th><th>Share</th><th>Phone</th><th>Email</th><th>Complete</th></tr>' +
+        breakdown.sources.map(s =>
+            '<tr><td>' + s.source.replace(/</g, '&lt;') + '</td><td>' + s.contacts + '</td><td>' + s.share + '%</td><td>' +
+            s.phone_rate + '%</td><td>' + s.email_rate + '%</td><td>' + s.complete_rate + '%</td></tr>'
+        ).join('');
+}
+
+let leaderboardSort = 'total_contacts';
+async function loadLeaderboard(sort) {
+    leaderboardSort = sort || leaderboardSort;
+    const board = await (await fetch('/api/leaderboard?sort=' + leaderboardSort)).json();
+    const columns = [
+        ['name', 'Location'], ['total_contacts', 'Leads'], ['phone_rate', 'Phone %'], ['email_rate', 'Email %'],
+        ['complete_rate', 'Complete %'], ['new_today', 'New Today'], ['new_this_week', 'New This Week']
+    ];
+    document.getElementById('leaderboardTable').innerHTML =
+        '<tr>' + columns.map(([key, label]) =>
+            '<th style="cursor: pointer" onclick="loadLeaderboard(\'' + key + '\')">' + label + (key === leaderboardSort ? ' ▾' : '') + '</th>'
+        ).join('') + '</tr>' +
+        board.locations.map(row =>
+            '<tr>' + columns.map(([key]) => '<td>' + String(row[key]).replace(/</g, '&lt;') + '</td>').join('') + '</tr>'
+        ).join('');
+}
+
+let searchTimer = null;
+function searchContacts(offset = 0) {
+    clearTimeout(searchTimer);
+    searchTimer = setTimeout(async () => {
+        const q = document.getElementById('searchBox').value.trim();
+        const resultsDiv = document.getElementById('searchResults');
+        if (!q) { resultsDiv.innerHTML = ''; return; }
+        
+        const locationId = document.getElementById('locationFilter').value;
+        const response = await fetch('/api/search?q=' + encodeURIComponent(q) +
+            '&location=' + encodeURIComponent(locationId) + '&offset=' + offset);
+        const page = await response.json();
+        
+        const esc = s => String(s).replace(/[&<>"]/g, ch => ({'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;'}[ch]));
+        resultsDiv.innerHTML = (page.results || []).map(r =>
+            '<div class="search-result"><b>' + esc(r.name || '(no name)') + '</b> ' +
+            esc([r.email, r.phone, r.source, r.location_name].filter(Boolean).join(' · ')) + '</div>'
+        ).join('') || '<div class="search-result">No matches</div>';
+        if (offset > 0) {
+            resultsDiv.innerHTML += '<button onclick="searchContacts(' + Math.max(offset - page.limit, 0) + ')">Previous</button>';
+        }
+        if (page.next_offset !== null && page.next_offset !== undefined) {
+            resultsDiv.innerHTML += '<button onclick="searchContacts(' + page.next_offset + ')">Next</button>';
+        }
+    }, offset ? 0 : 200);
+}
+
+async function testLocationToken() {
+    try {
+        const locationId = document.getElementById('locationFilter').value;
+        if (locationId === 'all') {
+            showStatus('Please select a specific location to test location token', 'error');
+            return;
+        }
+        
+        showStatus('🔑 Testing location token exchange...', 'success');
+        const result = await runJob('/api/test-location-token', { location_id: locationId });
+        
+        showDebugInfo(result);
+        
+        const diagnosis = result.diagnosis || {};
+        
+        if (diagnosis.token_exchange_worked && diagnosis.contacts_api_worked) {
+            showStatus('🎉 SUCCESS! Location token works - Found ' + diagnosis.contacts_found + ' contacts!');
+            loadDashboard(); // Refresh to show new data
+        } else if (diagnosis.token_exchange_worked) {
+            showStatus('✅ Token exchange worked, but contacts API still failed', 'error');
+        } else {
+            showStatus('❌ Location token exchange failed', 'error');
+        }
+    } catch (error) {
+        showStatus('Location token test error: ' + error.message, 'error');
+    }
+}
+
+async function debugLocationsCall() {
+    try {
+        showStatus('Debugging locations API...', 'success');
+        const response = await fetch('/api/debug-locations', { method: 'POST' });
+        const result = await response.json();
+        
+        showDebugInfo(result);
+        
+        if (result.locations_found > 0) {
+            showStatus('✅ Found ' + result.locations_found + ' locations');
+            loadLocations(); // Refresh location dropdown
+        } else {
+            showStatus('❌ No locations found - check debug info', 'error');
+        }
+    } catch (error) {
+        showStatus('Locations debug error: ' + error.message, 'error');
+    }
+}
+
+async function debugContactsCall() {
+    try {
+        const locationId = document.getElementById('locationFilter').value;
+        
+        showStatus(locationId === 'all'
+            ? 'Debugging contacts API across all locations...'
+            : 'Debugging contacts API for selected location...', 'success');
+        const result = await runJob('/api/debug-contacts', { location_id: locationId });
+        
+        showDebugInfo(result);
+        
+        if (result.contacts_found > 0) {
+            showStatus('✅ Found ' + result.contacts_found + ' contacts');
+            loadDashboard(); // Refresh dashboard
+        } else {
+            showStatus('❌ No contacts found - check debug info', 'error');
+        }
+    } catch (error) {
+        showStatus('Contacts debug error: ' + error.message, 'error');
+    }
+}
@@ -0,0 +1,55 @@
+document.addEventListener('DOMContentLoaded', loadDebugInfo);
+
+async function loadDebugInfo() {
+    // ?company_id= on the page scopes the token lookup, as it does for every API route
+    const response = await fetch('/api/debug-info' + window.location.search);
+    const info = await response.json();
+
+    const tokenStatus = document.getElementById('tokenStatus');
+    tokenStatus.className = info.token_available ? 'success' : 'error';
+    tokenStatus.textContent = info.token_available ? 'YES' : 'NO';
+    document.getElementById('companyId').textContent = info.token_available
+        ? 'Company ID: ' + (info.company_id || 'Unknown') : '';
+
+    const apiCalls = document.getElementById('apiCalls');
+    apiCalls.innerHTML = '';
+    info.recent_api_calls.forEach(call => {
+        const line = document.createElement('p');
+        line.className = call.status_code === 200 ? 'success' : 'error';
+        line.textContent = call.timestamp + ': ' + call.method + ' ' + call.endpoint + ' - Status: ' + call.status_code
+            + (call.error_message ? ' - Error: ' + call.error_message : '');
+        apiCalls.appendChild(line);
+    });
+}
+
+function showResult(title, result) {
+    document.getElementById('results').innerHTML = '<div class="section"><h3>' + title + '</h3><pre></pre></div>';
+    document.querySelector('#results pre').textContent = JSON.stringify(result, null, 2);
+}
+
+async function testConnection() {
+    const response = await fetch('/api/test-connection', { method: 'POST' });
+    showResult('🔗 Connection Test', await response.json());
+}
+
+async function debugLocations() {
+    const response = await fetch('/api/debug-locations', { method: 'POST' });
+    showResult('📍 Locations Debug', await response.json());
+}
+
+async function debugContacts() {
+    const locationId = prompt('Enter Location ID to test:');
+    if (locationId) {
+        const response = await fetch('/api/debug-contacts', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ location_id: locationId })
+        });
+        let result = await response.json();
+        while (result.job_id && !['done', 'error'].includes(result.status)) {
+            await new Promise(resolve => setTimeout(resolve, 1000));
+            result = await (await fetch('/api/jobs/' + result.job_id)).json();
+        }
+        showResult('👥 Contacts Debug', result);
+    }
+}
@@ -0,0 +1,102 @@
+# bench/gen_contacts.py - build a synthetic contacts database for benchmarks
+#
+#   python bench/gen_contacts.py --rows 1000000 --locations 50 --output /tmp/bench.db
+#
+# Rows go through the app's own schema; location sizes follow a Zipf-like curve
+# so a few locations are huge and most are small, as in real agencies.
+import os
+import sys
+import time
+import json
+import random
+import argparse
+import contextlib
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ghl_stub import SOURCES
+
+BATCH_SIZE = 50000
+
+def location_sizes(rows, locations):
+    weights = [1 / (rank + 1) for rank in range(locations)]
+    total = sum(weights)
+    sizes = [int(rows * w / total) for w in weights]
+    sizes[0] += rows - sum(sizes)
+    return sizes
+
+def generate(db_path, rows, locations, seed=42):
+    with contextlib.redirect_stdout(sys.stderr):
+        from app import DebugLeadAnalytics, normalize_phone, normalize_email
+        analytics = DebugLeadAnalytics(db_path)
+    
+    rng = random.Random(seed)
+    now = datetime.now()
+    conn = analytics.connect()
+    conn.execute('PRAGMA synchronous = OFF')
+    cursor = conn.cursor()
+    
+    location_ids = [f"bench-loc-{i:04d}" for i in range(locations)]
+    cursor.executemany('''
+        INSERT OR REPLACE INTO locations (location_id, location_name, company_id, last_synced)
+        VALUES (?, ?, 'bench-company', ?)
+    ''', [(loc, f"Bench Location {i}", now) for i, loc in enumerate(location_ids)])
+    
+    started = time.perf_counter()
+    written = 0
+    for location_id, size in zip(location_ids, location_sizes(rows, locations)):
+        for batch_start in range(0, size, BATCH_SIZE):
+            batch = []
+            for i in range(batch_start, min(batch_start + BATCH_SIZE, size)):
+                added = now - timedelta(minutes=rng.randrange(0, 60 * 24 * 365))
+                email = '' if rng.random() < 0.2 else f"lead{i}@example{i % 13}.com"
+                phone = '' if rng.random() < 0.15 else f"+1555{rng.randrange(10 ** 7):07d}"
+                batch.append((
+                    f"{location_id}-c{i:08d}",
+                    location_id,
+                    f"First{i}",
+                    f"Last{i % 997}",
+                    email,
+                    phone,
+                    rng.choice(SOURCES),
+                    added.strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+                    added,
+                    '[]',
+                    json.dumps(['lead']),
+                    added,
+                    normalize_phone(phone),
+                    normalize_email(email),
+                    int(added.timestamp())
+                ))
+            cursor.executemany('''
+                INSERT OR REPLACE INTO contacts
+                (contact_id, location_id, first_name, last_name, email, phone, source,
+                 date_added, created_at, custom_fields, tags, last_updated,
+                 phone_e164, email_norm, date_added_ts)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', batch)
+            conn.commit()
+            written += len(batch)
+            print(f"  {written:,}/{rows:,} rows", file=sys.stderr)
+    
+    analytics.rebuild_identities(cursor)
+    conn.commit()
+    conn.close()
+    return {'rows': written, 'locations': locations, 'seconds': round(time.perf_counter() - started, 2)}
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic contacts database')
+    parser.add_argument('--rows', type=int, default=10000, help='10k to 10M')
+    parser.add_argument('--locations', type=int, default=20)
+    parser.add_argument('--output', default='bench_contacts.db')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    
+    for path in (args.output, f"{args.output}-wal", f"{args.output}-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+    print(json.dumps(generate(args.output, args.rows, args.locations, args.seed)))
+
+if __name__ == '__main__':
+    main()
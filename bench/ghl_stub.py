@@ -0,0 +1,246 @@
+# bench/ghl_stub.py - local stand-in for the GHL endpoints the app calls
+#
+#   python bench/ghl_stub.py --port 9000 --locations 5 --contacts 20000 --latency 0.05 --rate-429 0.02
+#   python bench/ghl_stub.py --conversations 500 --messages 40
+#   GHL_API_BASE=http://127.0.0.1:9000 gunicorn app:app
+#
+# Contacts are generated on the fly from their index, so any dataset size costs
+# no memory. Latency, maximum page size and the share of requests answered with
+# 429 are configurable; request counts per endpoint are kept for reports.
+import json
+import time
+import random
+import argparse
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+BASE_DATE_MS = 1704067200000  # 2024-01-01T00:00:00Z
+SOURCES = ['Facebook Lead Ad', 'Google Ads', 'Website Form', 'Referral', 'Manual', 'Zapier', 'Chat Widget']
+
+class StubConfig:
+    def __init__(self, locations=3, contacts=1000, latency=0.0, max_page_size=100,
+                 rate_429=0.0, retry_after=1, company_id='stub-company', seed=42,
+                 conversations=0, messages=5, tasks=0):
+        self.locations = locations
+        self.contacts = contacts
+        self.conversations = conversations
+        self.messages = messages
+        self.tasks = tasks
+        self.latency = latency
+        self.max_page_size = max_page_size
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.company_id = company_id
+        self.random = random.Random(seed)
+        self.counts = Counter()
+        self.lock = threading.Lock()
+    
+    def location_ids(self):
+        return [f"stub-loc-{i}" for i in range(self.locations)]
+
+def make_contact(location_id, index):
+    """Deterministic GHL-shaped contact; every 7th has no phone, every 5th no email"""
+    return {
+        'id': f"{location_id}-c{index:08d}",
+        'locationId': location_id,
+        'firstName': f"First{index}",
+        'lastName': f"Last{index % 997}",
+        'email': '' if index % 5 == 0 else f"lead{index}@example{index % 13}.com",
+        'phone': '' if index % 7 == 0 else f"+1555{index % 10000000:07d}",
+        'source': SOURCES[index % len(SOURCES)],
+        'dateAdded': time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime((BASE_DATE_MS + index * 60000) / 1000)),
+        'tags': ['lead'] if index % 3 else ['lead', 'hot'],
+        'customFields': []
+    }
+
+def make_message(location_id, index, number):
+    """Message `number` of the conversation with contact `index`; inbound and outbound alternate"""
+    return {
+        'id': f"{location_id}-v{index:08d}-m{number:04d}",
+        'conversationId': f"{location_id}-v{index:08d}",
+        'contactId': f"{location_id}-c{index:08d}",
+        'locationId': location_id,
+        'direction': 'inbound' if number % 2 == 0 else 'outbound',
+        'messageType': 'TYPE_EMAIL' if index % 4 == 0 else 'TYPE_SMS',
+        'dateAdded': time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime((BASE_DATE_MS + index * 60000 + number * 1000) / 1000))
+    }
+
+def make_handler(config):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        
+        def log_message(self, *args):
+            pass
+        
+        def send_json(self, payload, status=200, headers=None):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def read_form(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            raw = self.rfile.read(length).decode() if length else ''
+            if self.headers.get('Content-Type', '').startswith('application/json'):
+                return json.loads(raw or '{}')
+            return {k: v[0] for k, v in parse_qs(raw).items()}
+        
+        def handle_request(self, method):
+            url = urlparse(self.path)
+            query = {k: v[0] for k, v in parse_qs(url.query).items()}
+            body = self.read_form() if method == 'POST' else {}
+            
+            with config.lock:
+                config.counts[f"{method} {url.path}"] += 1
+                throttled = config.random.random() < config.rate_429
+            
+            if config.latency:
+                time.sleep(config.latency)
+            
+            if throttled:
+                with config.lock:
+                    config.counts['429'] += 1
+                return self.send_json({'message': 'Too many requests'}, 429,
+                                      {'Retry-After': str(config.retry_after)})
+            
+            route = (method, url.path.rstrip('/') or '/')
+            if route in (('GET', '/contacts'), ('GET', '/contacts/search'), ('POST', '/contacts/search')):
+                return self.contacts({**query, **body})
+            if route == ('POST', '/oauth/token'):
+                return self.send_json({
+                    'access_token': f"stub-access-{int(time.time() * 1000)}",
+                    'refresh_token': 'stub-refresh',
+                    'token_type': 'Bearer',
+                    'expires_in': 86399,
+                    'scope': 'contacts.readonly locations.readonly',
+                    'companyId': config.company_id,
+                    'userType': 'Company'
+                })
+            if route == ('POST', '/oauth/locationToken'):
+                return self.send_json({
+                    'access_token': f"stub-location-{body.get('locationId')}",
+                    'token_type': 'Bearer',
+                    'expires_in': 86399,
+                    'scope': 'contacts.readonly',
+                    'locationId': body.get('locationId'),
+                    'userType': 'Location'
+                }, 201)
+            if route == ('GET', '/conversations/search'):
+                return self.conversations(query)
+            if method == 'GET' and url.path.startswith('/conversations/') and url.path.endswith('/messages'):
+                return self.messages(url.path.split('/')[2], query)
+            if method == 'POST' and url.path.startswith('/locations/') and url.path.endswith('/tasks/search'):
+                return self.task_search(url.path.split('/')[2], body)
+            if route in (('GET', '/oauth/installedLocations'), ('GET', '/locations')):
+                return self.send_json({'locations': [
+                    {'_id': loc, 'name': f"Stub Location {i}", 'isInstalled': True}
+                    for i, loc in enumerate(config.location_ids())
+                ]})
+            
+            self.send_json({'message': f"No stub for {method} {url.path}"}, 404)
+        
+        def contacts(self, params):
+            location_id = params.get('locationId') or config.location_ids()[0]
+            limit = min(int(params.get('limit') or 20), config.max_page_size)
+            start_after_id = params.get('startAfterId')
+            start = int(start_after_id.rsplit('-c', 1)[1]) + 1 if start_after_id else 0
+            
+            contacts = [make_contact(location_id, i) for i in range(start, min(start + limit, config.contacts))]
+            meta = {'total': config.contacts, 'currentPage': start // max(limit, 1) + 1}
+            if contacts:
+                meta['startAfterId'] = contacts[-1]['id']
+                meta['startAfter'] = BASE_DATE_MS + (start + len(contacts) - 1) * 60000
+            self.send_json({'contacts': contacts, 'meta': meta})
+        
+        def conversations(self, params):
+            """One conversation per contact below config.conversations, ordered by last message"""
+            location_id = params.get('locationId') or config.location_ids()[0]
+            limit = min(int(params.get('limit') or 20), config.max_page_size)
+            after = int(params.get('startAfterDate') or 0)
+            last_ms = lambda i: BASE_DATE_MS + i * 60000 + (config.messages - 1) * 1000
+            start = next((i for i in range(config.conversations) if last_ms(i) > after), config.conversations)
+            self.send_json({'conversations': [{
+                'id': f"{location_id}-v{i:08d}",
+                'contactId': f"{location_id}-c{i:08d}",
+                'locationId': location_id,
+                'lastMessageDate': last_ms(i),
+                'lastMessageType': 'TYPE_EMAIL' if i % 4 == 0 else 'TYPE_SMS'
+            } for i in range(start, min(start + limit, config.conversations))], 'total': config.conversations})
+        
+        def messages(self, conversation_id, params):
+            location_id, index = conversation_id.rsplit('-v', 1)
+            limit = min(int(params.get('limit') or 20), config.max_page_size)
+            last_id = params.get('lastMessageId')
+            end = int(last_id.rsplit('-m', 1)[1]) if last_id else config.messages
+            numbers = list(range(end - 1, max(end - 1 - limit, -1), -1))
+            self.send_json({'messages': {
+                'lastMessageId': f"{conversation_id}-m{numbers[-1]:04d}" if numbers else None,
+                'nextPage': bool(numbers) and numbers[-1] > 0,
+                'messages': [make_message(location_id, int(index), n) for n in numbers]
+            }})
+        
+        def task_search(self, location_id, params):
+            """config.tasks tasks per location, one due every 6 hours from BASE_DATE_MS; every third is completed"""
+            limit = min(int(params.get('limit') or 20), config.max_page_size)
+            skip = int(params.get('skip') or 0)
+            completed = params.get('completed')
+            matching = [i for i in range(config.tasks) if completed is None or (i % 3 == 0) == bool(completed)]
+            self.send_json({'tasks': [{
+                'id': f"{location_id}-t{i:08d}",
+                'title': f"Follow up {i}",
+                'contactId': f"{location_id}-c{i:08d}",
+                'assignedTo': f"user{i % 4}",
+                'dueDate': time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(BASE_DATE_MS / 1000 + i * 21600)),
+                'completed': i % 3 == 0
+            } for i in matching[skip:skip + limit]]})
+        
+        def do_GET(self):
+            self.handle_request('GET')
+        
+        def do_POST(self):
+            self.handle_request('POST')
+    
+    return Handler
+
+def start_stub(config=None, host='127.0.0.1', port=0):
+    """Serve the stub on a background thread; returns (base_url, server, config)"""
+    config = config or StubConfig()
+    ThreadingHTTPServer.daemon_threads = True
+    server = ThreadingHTTPServer((host, port), make_handler(config))
+    server.request_queue_size = 1024
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://{host}:{server.server_address[1]}", server, config
+
+def main():
+    parser = argparse.ArgumentParser(description='Local GHL API stub')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--locations', type=int, default=3)
+    parser.add_argument('--contacts', type=int, default=1000, help='contacts per location')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--max-page-size', type=int, default=100)
+    parser.add_argument('--rate-429', type=float, default=0.0, help='share of requests answered with 429')
+    parser.add_argument('--conversations', type=int, default=0, help='conversations per location')
+    parser.add_argument('--messages', type=int, default=5, help='messages per conversation')
+    parser.add_argument('--tasks', type=int, default=0, help='tasks per location')
+    args = parser.parse_args()
+    
+    config = StubConfig(locations=args.locations, contacts=args.contacts, latency=args.latency,
+                        max_page_size=args.max_page_size, rate_429=args.rate_429,
+                        conversations=args.conversations, messages=args.messages, tasks=args.tasks)
+    base_url, server, _ = start_stub(config, args.host, args.port)
+    print(f"GHL stub listening on {base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
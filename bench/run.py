@@ -0,0 +1,203 @@
+# bench/run.py - repeatable timings for ingest, stats, /api/stats and token paths
+#
+#   python bench/run.py --rows 100000 --output bench_report.json
+#   python bench/run.py --rows 100000 --compare bench_report.json
+#
+# Everything runs against a generated database and the local GHL stub, so runs
+# are comparable across commits. The JSON report records per-benchmark timings
+# plus the commit and environment; --compare flags medians that regressed.
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+import contextlib
+import statistics
+from datetime import datetime, timedelta
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_ROOT)
+
+from ghl_stub import StubConfig, start_stub, make_contact
+from gen_contacts import generate
+
+REGRESSION_THRESHOLD = 1.10
+
+def timed(fn, repeat, warmup=1, setup=None):
+    """Run fn repeat times (after warmup) and summarise the wall-clock times in ms
+    
+    setup, if given, runs untimed before every call.
+    """
+    for _ in range(warmup):
+        setup and setup()
+        fn()
+    samples = []
+    for _ in range(repeat):
+        setup and setup()
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {
+        'runs': repeat,
+        'min_ms': round(samples[0], 3),
+        'median_ms': round(statistics.median(samples), 3),
+        'p95_ms': round(samples[min(int(repeat * 0.95), repeat - 1)], 3),
+        'max_ms': round(samples[-1], 3),
+    }
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix='ghl-bench-')
+    db_path = os.path.join(workdir, 'bench.db')
+    
+    stub_url, stub_server, stub = start_stub(StubConfig(
+        locations=args.stub_locations, contacts=args.stub_contacts,
+        latency=args.stub_latency, rate_429=args.stub_429
+    ))
+    os.environ.update(DATABASE_PATH=db_path, GHL_API_BASE=stub_url, GHL_RATE_LIMIT=str(args.rate_limit))
+    
+    print(f"Generating {args.rows:,} contacts in {db_path}", file=sys.stderr)
+    dataset = generate(db_path, args.rows, args.locations)
+    
+    with contextlib.redirect_stdout(sys.stderr):
+        import app as ghl_app
+    analytics = ghl_app.analytics
+    client = ghl_app.app.test_client()
+    quiet = contextlib.redirect_stdout(open(os.devnull, 'w'))
+    
+    conn = analytics.connect()
+    largest, smallest = conn.execute('''
+        SELECT (SELECT location_id FROM contacts GROUP BY location_id ORDER BY COUNT(*) DESC LIMIT 1),
+               (SELECT location_id FROM contacts GROUP BY location_id ORDER BY COUNT(*) ASC LIMIT 1)
+    ''').fetchone()
+    conn.execute('''
+        INSERT OR REPLACE INTO oauth_tokens
+        (client_key, access_token, refresh_token, expires_at, location_id, company_id)
+        VALUES ('stub-company', 'stub-access', 'stub-refresh', ?, NULL, 'stub-company')
+    ''', (datetime.now() + timedelta(days=1),))
+    conn.commit()
+    token_record = conn.execute("SELECT * FROM oauth_tokens WHERE client_key = 'stub-company'").fetchone()
+    conn.close()
+    
+    results = {}
+    with quiet:
+        # Ingest: pages of 100 through the same batched upsert the sync uses
+        pages = [[make_contact('bench-ingest', p * 100 + i) for i in range(100)] for p in range(args.ingest_pages)]
+        started = time.perf_counter()
+        for page in pages:
+            analytics.add_contacts(page, 'bench-ingest')
+        elapsed = time.perf_counter() - started
+        results['ingest.add_contacts'] = {
+            'rows': len(pages) * 100, 'seconds': round(elapsed, 3),
+            'rows_per_second': round(len(pages) * 100 / elapsed, 1)
+        }
+        
+        # End-to-end sync of one stub location (HTTP + parse + upsert)
+        before = sum(stub.counts.values())
+        started = time.perf_counter()
+        written, _ = analytics.sync_location_contacts('stub-access', stub.location_ids()[0])
+        elapsed = time.perf_counter() - started
+        results['ingest.sync_location_contacts'] = {
+            'rows': written, 'seconds': round(elapsed, 3),
+            'rows_per_second': round(written / elapsed, 1),
+            'ghl_requests': sum(stub.counts.values()) - before
+        }
+        
+        results['stats.get_basic_stats.all'] = timed(lambda: analytics.get_basic_stats('all'), args.repeat)
+        results['stats.get_basic_stats.largest_location'] = timed(lambda: analytics.get_basic_stats(largest), args.repeat)
+        results['stats.get_basic_stats.smallest_location'] = timed(lambda: analytics.get_basic_stats(smallest), args.repeat)
+        results['http.api_stats.all'] = timed(lambda: client.get('/api/stats?location=all'), args.repeat)
+        results['http.api_stats.largest_location'] = timed(lambda: client.get(f'/api/stats?location={largest}'), args.repeat)
+        
+        results['token.get_valid_token'] = timed(ghl_app.get_valid_token, args.repeat)
+        # Put the original token back each time; refresh_access_token skips the
+        # GHL call when another caller has already stored a fresh token
+        def reset_token():
+            conn = analytics.connect()
+            conn.execute('UPDATE oauth_tokens SET access_token = ?, refresh_token = ?, expires_at = ? WHERE client_key = ?',
+                         (token_record[2], token_record[3], token_record[4], token_record[1]))
+            conn.commit()
+            conn.close()
+        refreshes_before = stub.counts.get('POST /oauth/token', 0)
+        results['token.refresh_access_token'] = timed(
+            lambda: ghl_app.refresh_access_token(token_record), args.repeat, setup=reset_token)
+        results['token.refresh_access_token']['ghl_requests'] = stub.counts.get('POST /oauth/token', 0) - refreshes_before
+        reset_token()
+        results['token.get_location_token'] = timed(
+            lambda: analytics.get_location_token('stub-access', 'stub-company', stub.location_ids()[0]), args.repeat)
+        results['token.get_location_access_token.memory_hit'] = timed(
+            lambda: ghl_app.get_location_access_token(stub.location_ids()[0]), args.repeat)
+    
+    stub_server.shutdown()
+    return {
+        'meta': {
+            'timestamp': datetime.now().isoformat(),
+            'git_commit': git_commit(),
+            'python': platform.python_version(),
+            'sqlite': __import__('sqlite3').sqlite_version,
+            'platform': platform.platform(),
+        },
+        'config': vars(args),
+        'dataset': dataset,
+        'stub_requests': dict(stub.counts),
+        'results': results,
+    }
+
+def compare(report, baseline):
+    """Print median/throughput changes against a previous report; returns the regressions"""
+    regressions = []
+    for name, result in report['results'].items():
+        before = baseline.get('results', {}).get(name)
+        if not before:
+            continue
+        if 'median_ms' in result:
+            ratio = result['median_ms'] / max(before['median_ms'], 1e-9)
+        else:
+            ratio = before['rows_per_second'] / max(result['rows_per_second'], 1e-9)
+        flag = 'REGRESSION' if ratio > REGRESSION_THRESHOLD else ''
+        print(f"{name:45s} {ratio:6.2f}x time {flag}", file=sys.stderr)
+        if flag:
+            regressions.append(name)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the benchmark suite')
+    parser.add_argument('--rows', type=int, default=100000, help='contacts in the generated database')
+    parser.add_argument('--locations', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--ingest-pages', type=int, default=100)
+    parser.add_argument('--stub-locations', type=int, default=3)
+    parser.add_argument('--stub-contacts', type=int, default=5000)
+    parser.add_argument('--stub-latency', type=float, default=0.0)
+    parser.add_argument('--stub-429', type=float, default=0.0)
+    parser.add_argument('--rate-limit', type=float, default=100000)
+    parser.add_argument('--output', default='bench_report.json')
+    parser.add_argument('--compare', help='previous report to compare against')
+    args = parser.parse_args()
+    
+    report = run(args)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    
+    for name, result in report['results'].items():
+        summary = f"{result['median_ms']} ms median" if 'median_ms' in result else f"{result['rows_per_second']} rows/s"
+        print(f"{name:45s} {summary}", file=sys.stderr)
+    print(f"Report written to {args.output}", file=sys.stderr)
+    
+    if args.compare:
+        with open(args.compare) as f:
+            if compare(report, json.load(f)):
+                sys.exit(1)
+
+if __name__ == '__main__':
+    main()
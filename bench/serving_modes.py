@@ -0,0 +1,145 @@
+# bench/serving_modes.py - compare sync (gunicorn) and async (ASGI) serving under load
+#
+#   python bench/serving_modes.py --requests 2000 --concurrency 200 --latency 0.2
+#
+# Starts the GHL stub with fixed latency, then runs the same load against
+# POST /api/debug-locations (GHL-bound), GET /api/stats (SQLite-bound) and a
+# concurrent mix of routes the async mode hands to Flask, in each mode, printing
+# throughput and latency percentiles as JSON.
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import contextlib
+import tempfile
+import subprocess
+from datetime import datetime, timedelta
+
+import httpx
+
+from ghl_stub import StubConfig, start_stub
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Routes asgi.py does not serve natively, interleaved in one load
+FALLTHROUGH_MIX = [
+    ('GET', '/api/stats?location=all'),
+    ('GET', '/health'),
+    ('GET', '/dashboard'),
+    ('GET', '/api/leaderboard'),
+    ('GET', '/api/locations'),
+    ('GET', '/api/sources'),
+]
+
+MODES = {
+    'sync': ['gunicorn', 'app:app', '-w', '{workers}'],
+    'async': ['gunicorn', 'asgi:application', '-k', 'uvicorn.workers.UvicornWorker', '-w', '{workers}'],
+}
+
+def seed_database(workdir):
+    """Create the app database in workdir with a long-lived agency token"""
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_ROOT)
+    with contextlib.redirect_stdout(sys.stderr):
+        from app import analytics
+    
+    conn = analytics.connect()
+    conn.execute('''
+        INSERT OR REPLACE INTO oauth_tokens
+        (client_key, access_token, refresh_token, expires_at, location_id, company_id)
+        VALUES ('bench-company', 'bench-token', 'bench-refresh', ?, NULL, 'bench-company')
+    ''', (datetime.now() + timedelta(days=1),))
+    conn.commit()
+    conn.close()
+
+async def run_load(base_url, routes, total, concurrency):
+    """Send `total` requests cycling through routes [(method, path)], `concurrency` at a time"""
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+    
+    async with httpx.AsyncClient(base_url=base_url, timeout=120,
+                                 limits=httpx.Limits(max_connections=concurrency)) as client:
+        async def one(method, path):
+            nonlocal errors
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    resp = await client.request(method, path)
+                    if resp.status_code != 200:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+        
+        started = time.perf_counter()
+        await asyncio.gather(*(one(*routes[i % len(routes)]) for i in range(total)))
+        elapsed = time.perf_counter() - started
+    
+    latencies.sort()
+    pct = lambda p: round(latencies[min(int(len(latencies) * p), len(latencies) - 1)] * 1000, 1)
+    return {
+        'requests': total,
+        'errors': errors,
+        'seconds': round(elapsed, 2),
+        'requests_per_second': round(total / elapsed, 1),
+        'p50_ms': pct(0.50),
+        'p95_ms': pct(0.95),
+        'p99_ms': pct(0.99),
+    }
+
+def wait_until_up(base_url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            httpx.get(f"{base_url}/api/locations", timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server at {base_url} did not start")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.2, help='upstream GHL latency in seconds')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--modes', default='sync,async')
+    args = parser.parse_args()
+    
+    workdir = tempfile.mkdtemp(prefix='ghl-bench-')
+    stub_url, _, _ = start_stub(StubConfig(latency=args.latency))
+    env = dict(os.environ,
+               GHL_API_BASE=stub_url,
+               GHL_RATE_LIMIT='100000',
+               PYTHONPATH=REPO_ROOT)
+    seed_database(workdir)
+    
+    report = {'config': vars(args), 'modes': {}}
+    for mode in args.modes.split(','):
+        command = [part.format(workers=args.workers) for part in MODES[mode]]
+        command += ['-b', f"127.0.0.1:{args.port}", '--timeout', '120', '--log-level', 'warning']
+        server = subprocess.Popen(command, cwd=workdir, env=env,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        base_url = f"http://127.0.0.1:{args.port}"
+        try:
+            wait_until_up(base_url)
+            report['modes'][mode] = {
+                'debug_locations': asyncio.run(run_load(base_url, [('POST', '/api/debug-locations')],
+                                                        args.requests, args.concurrency)),
+                'stats': asyncio.run(run_load(base_url, [('GET', '/api/stats?location=all')],
+                                              args.requests, args.concurrency)),
+                'fallthrough_mix': asyncio.run(run_load(base_url, FALLTHROUGH_MIX,
+                                                        args.requests, args.concurrency)),
+            }
+        finally:
+            server.terminate()
+            server.wait()
+    
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+# import_contacts.py - load a GHL contacts CSV export for one location
+#
+#   python import_contacts.py contacts.csv --location LOCATION_ID
+#
+# Same import as POST /api/import-contacts, run in the foreground with progress
+# on stderr. The API sync then carries on from the newest imported contact.
+import sys
+import json
+import argparse
+from app import analytics
+
+def main():
+    parser = argparse.ArgumentParser(description='Import a GHL contacts CSV export')
+    parser.add_argument('csv_path')
+    parser.add_argument('--location', required=True, help='location_id the contacts belong to')
+    parser.add_argument('--defer-indexes', choices=['auto', 'yes', 'no'], default='auto',
+                        help='drop and rebuild secondary indexes around the load (auto: only on a shard no other location uses)')
+    args = parser.parse_args()
+
+    def report(progress):
+        print(f"\r{progress['rows_imported']:,} imported, {progress['rows_skipped']:,} skipped "
+              f"({progress['rows_per_second']:,} rows/s)", end='', file=sys.stderr, flush=True)
+
+    defer_indexes = {'auto': None, 'yes': True, 'no': False}[args.defer_indexes]
+    with open(args.csv_path, newline='', encoding='utf-8-sig') as f:
+        summary = analytics.import_contacts_csv(f, args.location, defer_indexes=defer_indexes, on_progress=report)
+    print(file=sys.stderr)
+    print(json.dumps(summary, indent=2))
+
+if __name__ == '__main__':
+    main()
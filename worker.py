@@ -0,0 +1,29 @@
+# worker.py - background contact sync process (Procfile `worker:`)
+#
+#   python worker.py          threaded scheduler, SYNC_CONCURRENCY threads
+#   python worker.py --async  asyncio scheduler, SYNC_CONCURRENCY tasks
+import sys
+import signal
+import asyncio
+from app import analytics, jobs, SyncScheduler
+
+def main():
+    # Also drain the web app's job queue so jobs survive web restarts
+    jobs.start()
+    
+    if '--async' in sys.argv:
+        from asgi import AsyncSyncScheduler
+        scheduler = AsyncSyncScheduler(analytics)
+    else:
+        scheduler = SyncScheduler(analytics)
+    
+    signal.signal(signal.SIGTERM, lambda *_: scheduler.stop())
+    signal.signal(signal.SIGINT, lambda *_: scheduler.stop())
+    
+    if '--async' in sys.argv:
+        asyncio.run(scheduler.run_async())
+    else:
+        scheduler.run_forever()
+
+if __name__ == '__main__':
+    main()